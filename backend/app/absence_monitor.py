@@ -0,0 +1,201 @@
+"""
+Incremental chronic-absenteeism detection.
+
+Every student has one ``AbsenceCounter`` holding two bitmasks over a rolling
+window of calendar days ending at their latest mark (bit i = that day minus
+i days): which days were marked and which of those were absences. A new
+register shifts and sets bits, so the rolling rate is two popcounts and the
+consecutive-absence run is a counter; no history is rescanned. Alerts are
+edge-triggered, sent once when a student crosses a threshold and re-armed
+when they drop back below it.
+
+``process_marks`` runs in the post-commit stage of ``mark_attendance``;
+``validate_counters`` replays recent attendance nightly and corrects drift.
+"""
+from __future__ import annotations
+
+import logging
+from datetime import date, timedelta
+from types import SimpleNamespace
+from typing import Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+CHRONIC = "chronic_absence"
+CONSECUTIVE = "consecutive_absence"
+
+# Replay depth for validation; longer runs keep the stored count
+VALIDATE_LOOKBACK_DAYS = 90
+
+
+def window_days() -> int:
+    # Masks live in a signed 64-bit column
+    return max(1, min(62, settings.ABSENCE_WINDOW_DAYS))
+
+
+def _popcount(mask: int) -> int:
+    return bin(mask or 0).count("1")
+
+
+def _trailing_run(marked: int, absent: int, window: int) -> tuple[int, bool]:
+    """Absences among marked days counting back from bit 0; True if the run reaches the window edge."""
+    run = 0
+    for i in range(window):
+        bit = 1 << i
+        if not marked & bit:
+            continue
+        if not absent & bit:
+            return run, False
+        run += 1
+    return run, True
+
+
+def advance(c, d: date, absent: bool, window: int) -> None:
+    """Fold one mark into a counter (an AbsenceCounter or any object with the same fields)."""
+    full = (1 << window) - 1
+    marked, absent_mask = c.marked_mask or 0, c.absent_mask or 0
+    newest = c.window_end is None or d > c.window_end
+    if c.window_end is None:
+        marked = absent_mask = 0
+        c.window_end = d
+    elif d > c.window_end:
+        shift = (d - c.window_end).days
+        marked = (marked << shift) & full if shift < window else 0
+        absent_mask = (absent_mask << shift) & full if shift < window else 0
+        c.window_end = d
+    offset = (c.window_end - d).days
+    if offset < window:
+        bit = 1 << offset
+        marked |= bit
+        absent_mask = (absent_mask | bit) if absent else (absent_mask & ~bit)
+    c.marked_mask, c.absent_mask = marked, absent_mask
+
+    if newest:
+        c.consecutive_absences = (c.consecutive_absences or 0) + 1 if absent else 0
+    elif offset < window:
+        # A past day was corrected: recount the run from the masks
+        run, open_ended = _trailing_run(marked, absent_mask, window)
+        c.consecutive_absences = max(run, c.consecutive_absences or 0) if open_ended else run
+
+
+def absence_rate(c) -> Optional[float]:
+    marked = _popcount(c.marked_mask)
+    return round(_popcount(c.absent_mask) * 100.0 / marked, 1) if marked else None
+
+
+def evaluate(c) -> list[str]:
+    """Alert kinds newly triggered for this counter; updates the re-arm flags."""
+    kinds = []
+    rate = absence_rate(c)
+    chronic = (
+        rate is not None
+        and _popcount(c.marked_mask) >= settings.ABSENCE_MIN_MARKED_DAYS
+        and rate >= settings.ABSENCE_RATE_THRESHOLD
+    )
+    if chronic and not c.rate_alerted:
+        kinds.append(CHRONIC)
+    c.rate_alerted = chronic
+    streak = (c.consecutive_absences or 0) >= settings.ABSENCE_CONSECUTIVE_THRESHOLD
+    if streak and not c.streak_alerted:
+        kinds.append(CONSECUTIVE)
+    c.streak_alerted = streak
+    return kinds
+
+
+def _new_counter(student_id: int) -> models.AbsenceCounter:
+    return models.AbsenceCounter(
+        student_id=student_id, window_end=None, marked_mask=0, absent_mask=0,
+        consecutive_absences=0, rate_alerted=False, streak_alerted=False,
+    )
+
+
+def process_marks(db: Session, d: date, marks: Iterable[tuple[int, str]]) -> list[dict]:
+    """
+    Advance the counters for one register and commit. Returns the alerts that
+    fired as dicts of {student_id, kind, date, rate, consecutive}.
+    """
+    status_by_student = {int(sid): (status or "").upper() for sid, status in marks}
+    if not status_by_student:
+        return []
+    window = window_days()
+    counters = {
+        c.student_id: c
+        for c in db.query(models.AbsenceCounter).filter(models.AbsenceCounter.student_id.in_(list(status_by_student)))
+    }
+    alerts = []
+    for sid, status in status_by_student.items():
+        c = counters.get(sid)
+        if c is None:
+            c = counters[sid] = _new_counter(sid)
+            db.add(c)
+        advance(c, d, status == "ABSENT", window)
+        for kind in evaluate(c):
+            alerts.append({
+                "student_id": sid,
+                "kind": kind,
+                "date": d.isoformat(),
+                "rate": absence_rate(c),
+                "consecutive": c.consecutive_absences,
+                "window_days": window,
+            })
+    db.commit()
+    return alerts
+
+
+def validate_counters(db: Session, as_of: Optional[date] = None) -> dict:
+    """
+    Rebuild counter state from recent attendance and fix any stored counter
+    that disagrees. Alert flags are left alone, so a missed alert fires on the
+    student's next register.
+    """
+    as_of = as_of or date.today()
+    window = window_days()
+    since = as_of - timedelta(days=max(VALIDATE_LOOKBACK_DAYS, window))
+    rows = (
+        db.query(models.Attendance.student_id, models.Attendance.date, models.Attendance.status)
+        .filter(models.Attendance.date >= since, models.Attendance.date <= as_of)
+        .order_by(models.Attendance.student_id, models.Attendance.date)
+        .yield_per(5000)
+    )
+    fresh: dict[int, SimpleNamespace] = {}
+    for sid, d, status in rows:
+        c = fresh.get(sid)
+        if c is None:
+            c = fresh[sid] = SimpleNamespace(window_end=None, marked_mask=0, absent_mask=0, consecutive_absences=0, marked_days=0)
+        advance(c, d, (status or "").upper() == "ABSENT", window)
+        c.marked_days += 1
+
+    checked = corrected = 0
+    stored = db.query(models.AbsenceCounter).filter(
+        (models.AbsenceCounter.window_end >= since) | models.AbsenceCounter.student_id.in_(list(fresh) or [-1])
+    )
+    seen = set()
+    for c in stored:
+        seen.add(c.student_id)
+        checked += 1
+        f = fresh.get(c.student_id) or SimpleNamespace(window_end=None, marked_mask=0, absent_mask=0, consecutive_absences=0, marked_days=0)
+        consecutive = f.consecutive_absences
+        if f.marked_days and consecutive == f.marked_days:
+            # Every replayed day was an absence: the run may predate the lookback
+            consecutive = max(consecutive, c.consecutive_absences or 0)
+        if (c.window_end, c.marked_mask or 0, c.absent_mask or 0, c.consecutive_absences or 0) != (
+            f.window_end, f.marked_mask, f.absent_mask, consecutive
+        ):
+            c.window_end, c.marked_mask, c.absent_mask = f.window_end, f.marked_mask, f.absent_mask
+            c.consecutive_absences = consecutive
+            corrected += 1
+    for sid, f in fresh.items():
+        if sid in seen:
+            continue
+        c = _new_counter(sid)
+        c.window_end, c.marked_mask, c.absent_mask, c.consecutive_absences = f.window_end, f.marked_mask, f.absent_mask, f.consecutive_absences
+        db.add(c)
+        checked += 1
+        corrected += 1
+    db.commit()
+    return {"as_of": as_of.isoformat(), "checked": checked, "corrected": corrected}
@@ -0,0 +1,302 @@
+"""
+Materialised analytics cube keyed by (term, class_name, subject).
+
+Each cell holds count, sum, sum of squares, pass count and min/max of raw
+scores. Writers apply deltas with an atomic ``INSERT ... ON CONFLICT DO
+UPDATE SET col = col + excluded.col``; only min/max need a rescan, and only
+for cells that lost or changed a score. Reports then read O(subjects) rows
+instead of every ExamResult.
+
+The cube is built once at startup (see ``ensure_built``) and kept current
+by the writers. A writer calls ``lock_for_write`` before reading the old
+scores it is about to replace, so two transactions touching the same
+assessment cannot both subtract the same old value; ``rebuild`` excludes
+all writers while it runs. Passes are counted against settings.PASS_MARK,
+so rebuild after changing the pass mark.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from typing import Iterable, Optional
+
+from sqlalchemy import and_, case, func, literal_column, or_, text
+from sqlalchemy.orm import Session
+
+from . import models
+from .bulk import dialect_insert
+from .settings import settings
+
+Cell = tuple[str, str, str]
+
+# PostgreSQL advisory lock key: shared by writers, exclusive for rebuilds;
+# the (key, assessment_id) pair serialises writers of one assessment
+LOCK_KEY = 0x637562
+
+
+def cell_for(a: models.Assessment) -> Cell:
+    return (a.term or "", a.class_name or "", a.subject or "(none)")
+
+
+def is_built(db: Session) -> bool:
+    return db.query(models.AnalyticsCube.id).first() is not None
+
+
+def ensure_built(db: Session) -> None:
+    """Populate an empty cube from existing results (commits). Run at startup, not per request."""
+    _lock_exclusive(db)
+    if is_built(db):
+        db.commit()
+        return
+    rebuild(db)
+
+
+def _lock_exclusive(db: Session) -> None:
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": LOCK_KEY})
+
+
+def lock_for_write(db: Session, assessment_ids: Iterable[int]) -> None:
+    """
+    Hold the cube write lock for these assessments until the transaction
+    ends. Call before reading the scores that ``apply_result_changes`` or
+    ``remove_assessment`` will subtract.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock_shared(:k)"), {"k": LOCK_KEY})
+        # Sorted so two multi-assessment writers cannot deadlock
+        for aid in sorted(set(assessment_ids)):
+            db.execute(text("SELECT pg_advisory_xact_lock(:k, :aid)"), {"k": LOCK_KEY, "aid": aid})
+    elif dialect == "sqlite":
+        # A write statement takes SQLite's RESERVED lock now rather than at the upsert
+        db.execute(text("UPDATE analytics_cube SET id = id WHERE 0"))
+
+
+def _least(db: Session, a, b):
+    # NULL-safe LEAST/GREATEST: keep whichever side is set
+    fn = func.least if db.get_bind().dialect.name == "postgresql" else func.min
+    return fn(func.coalesce(a, b), func.coalesce(b, a))
+
+
+def _greatest(db: Session, a, b):
+    fn = func.greatest if db.get_bind().dialect.name == "postgresql" else func.max
+    return fn(func.coalesce(a, b), func.coalesce(b, a))
+
+
+def _apply(db: Session, deltas: dict[Cell, dict]) -> None:
+    """Add per-cell deltas atomically; cells are created on first touch."""
+    rows = [
+        {
+            "term": cell[0],
+            "class_name": cell[1],
+            "subject": cell[2],
+            "result_count": d["count"],
+            "score_sum": d["sum"],
+            "score_sum_sq": d["sum_sq"],
+            "pass_count": d["passed"],
+            "min_score": d["min"],
+            "max_score": d["max"],
+        }
+        for cell, d in deltas.items()
+    ]
+    if not rows:
+        return
+    insert = dialect_insert(db)
+    if insert is None:
+        # Without ON CONFLICT support keep the cube correct by recomputing the cells
+        recompute_cells(db, list(deltas))
+        return
+    t = models.AnalyticsCube.__table__
+    stmt = insert(t).values(rows)
+    ex = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["term", "class_name", "subject"],
+        set_={
+            "result_count": t.c.result_count + ex.result_count,
+            "score_sum": t.c.score_sum + ex.score_sum,
+            "score_sum_sq": t.c.score_sum_sq + ex.score_sum_sq,
+            "pass_count": t.c.pass_count + ex.pass_count,
+            "min_score": _least(db, t.c.min_score, ex.min_score),
+            "max_score": _greatest(db, t.c.max_score, ex.max_score),
+            "updated_at": func.now(),
+        },
+    )
+    db.execute(stmt)
+
+
+def apply_result_changes(db: Session, changes: Iterable[tuple[int, Optional[float], Optional[float]]]) -> None:
+    """
+    Fold score changes into the cube. ``changes`` holds
+    (assessment_id, old_score or None, new_score or None) for every written
+    or removed ExamResult. Call inside the writer's transaction, after the
+    ExamResult rows themselves have been written; the old scores must have
+    been read under ``lock_for_write``.
+    """
+    changes = list(changes)
+    if not changes:
+        return
+    aids = {aid for aid, _, _ in changes}
+    cells = {a.id: cell_for(a) for a in db.query(models.Assessment).filter(models.Assessment.id.in_(aids)).all()}
+    pass_mark = settings.PASS_MARK
+
+    deltas: dict[Cell, dict] = {}
+    rescan: set[Cell] = set()
+    for aid, old, new in changes:
+        cell = cells.get(aid)
+        if cell is None or old == new:
+            continue
+        d = deltas.setdefault(cell, {"count": 0, "sum": 0.0, "sum_sq": 0.0, "passed": 0, "min": None, "max": None})
+        if old is not None:
+            d["count"] -= 1
+            d["sum"] -= old
+            d["sum_sq"] -= old * old
+            d["passed"] -= 1 if old >= pass_mark else 0
+            # The old value may have been the cell's min or max
+            rescan.add(cell)
+        if new is not None:
+            d["count"] += 1
+            d["sum"] += new
+            d["sum_sq"] += new * new
+            d["passed"] += 1 if new >= pass_mark else 0
+            d["min"] = new if d["min"] is None else min(d["min"], new)
+            d["max"] = new if d["max"] is None else max(d["max"], new)
+    _apply(db, deltas)
+    if rescan:
+        recompute_bounds(db, list(rescan))
+
+
+def remove_assessment(db: Session, assessment: models.Assessment) -> None:
+    """Subtract an assessment's results before they are deleted."""
+    lock_for_write(db, [assessment.id])
+    score = models.ExamResult.score
+    n, total, total_sq, passed = (
+        db.query(
+            func.count(score),
+            func.coalesce(func.sum(score), 0.0),
+            func.coalesce(func.sum(score * score), 0.0),
+            func.coalesce(func.sum(case((score >= settings.PASS_MARK, 1), else_=0)), 0),
+        )
+        .filter(models.ExamResult.assessment_id == assessment.id, score.isnot(None))
+        .one()
+    )
+    if not n:
+        return
+    cell = cell_for(assessment)
+    _apply(db, {cell: {"count": -n, "sum": -float(total), "sum_sq": -float(total_sq), "passed": -int(passed), "min": None, "max": None}})
+    recompute_bounds(db, [cell], exclude_assessment_id=assessment.id)
+
+
+def _grouped_source():
+    """(term, class_name, subject) aggregates straight from ExamResult."""
+    score = models.ExamResult.score
+    cols = (
+        func.coalesce(models.Assessment.term, literal_column("''")).label("term"),
+        func.coalesce(models.Assessment.class_name, literal_column("''")).label("class_name"),
+        func.coalesce(models.Assessment.subject, literal_column("'(none)'")).label("subject"),
+    )
+    aggs = (
+        func.count(score).label("result_count"),
+        func.sum(score).label("score_sum"),
+        func.sum(score * score).label("score_sum_sq"),
+        func.sum(case((score >= settings.PASS_MARK, 1), else_=0)).label("pass_count"),
+        func.min(score).label("min_score"),
+        func.max(score).label("max_score"),
+    )
+    return cols, aggs
+
+
+def _source_query(db: Session, cols, aggs, term: Optional[str] = None):
+    q = (
+        db.query(*cols, *aggs)
+        .join(models.Assessment, models.ExamResult.assessment_id == models.Assessment.id)
+        .filter(models.ExamResult.score.isnot(None))
+    )
+    if term is not None:
+        q = q.filter(models.Assessment.term == term)
+    return q.group_by(*cols)
+
+
+def _cell_filter(model_cols, cells: list[Cell]):
+    return or_(*[and_(model_cols[0] == c[0], model_cols[1] == c[1], model_cols[2] == c[2]) for c in cells])
+
+
+def recompute_bounds(db: Session, cells: list[Cell], exclude_assessment_id: Optional[int] = None) -> None:
+    """Refresh min/max for the given cells from the underlying results."""
+    cols, _ = _grouped_source()
+    q = (
+        db.query(*cols, func.min(models.ExamResult.score), func.max(models.ExamResult.score))
+        .join(models.Assessment, models.ExamResult.assessment_id == models.Assessment.id)
+        .filter(models.ExamResult.score.isnot(None))
+        .filter(_cell_filter([c.element for c in cols], cells))
+    )
+    if exclude_assessment_id is not None:
+        q = q.filter(models.Assessment.id != exclude_assessment_id)
+    q = q.group_by(*cols)
+    bounds = {(t, c, s): (lo, hi) for t, c, s, lo, hi in q.all()}
+    cube = models.AnalyticsCube
+    for cell in cells:
+        lo, hi = bounds.get(cell, (None, None))
+        db.query(cube).filter(
+            cube.term == cell[0], cube.class_name == cell[1], cube.subject == cell[2]
+        ).update({"min_score": lo, "max_score": hi}, synchronize_session=False)
+
+
+def recompute_cells(db: Session, cells: list[Cell]) -> None:
+    """Fully recompute the given cells (fallback for dialects without upsert)."""
+    cols, aggs = _grouped_source()
+    q = _source_query(db, cols, aggs).filter(_cell_filter([c.element for c in cols], cells))
+    fresh = {(r.term, r.class_name, r.subject): r for r in q.all()}
+    cube = models.AnalyticsCube
+    for cell in cells:
+        db.query(cube).filter(cube.term == cell[0], cube.class_name == cell[1], cube.subject == cell[2]).delete(synchronize_session=False)
+        r = fresh.get(cell)
+        if r is not None and r.result_count:
+            db.add(cube(term=cell[0], class_name=cell[1], subject=cell[2], result_count=r.result_count, score_sum=r.score_sum,
+                        score_sum_sq=r.score_sum_sq, pass_count=r.pass_count, min_score=r.min_score, max_score=r.max_score))
+    db.flush()
+
+
+def rebuild(db: Session, term: Optional[str] = None) -> int:
+    """Rebuild the cube (or one term of it) from ExamResult in one INSERT ... SELECT. Commits."""
+    _lock_exclusive(db)
+    cube = models.AnalyticsCube
+    q = db.query(cube)
+    if term is not None:
+        q = q.filter(cube.term == term)
+    q.delete(synchronize_session=False)
+
+    cols, aggs = _grouped_source()
+    source = _source_query(db, cols, aggs, term)
+    t = cube.__table__
+    db.execute(
+        t.insert().from_select(
+            ["term", "class_name", "subject", "result_count", "score_sum", "score_sum_sq", "pass_count", "min_score", "max_score"],
+            source.statement,
+        )
+    )
+    db.commit()
+    count = db.query(func.count(cube.id))
+    if term is not None:
+        count = count.filter(cube.term == term)
+    return count.scalar() or 0
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Rebuild the analytics cube from exam results.")
+    parser.add_argument("--term", default=None, help="only rebuild this term")
+    args = parser.parse_args(argv)
+
+    from .db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        cells = rebuild(db, args.term)
+        print(json.dumps({"term": args.term, "cells": cells}))
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,501 @@
+"""
+Grading engine: weighted subject totals, letter grades and points.
+
+A class's results are pulled with one joined query and reduced column-wise
+into per-subject numerator/denominator arrays indexed by student, so a whole
+class is graded in a single pass. Grading scales are compiled once into
+sorted band arrays and looked up with ``bisect``.
+"""
+from __future__ import annotations
+
+import json
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from sqlalchemy import Integer, Numeric, case, cast, func, literal_column
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import cached, invalidate
+from .settings import settings
+
+# Used when no GradingScale row exists yet
+DEFAULT_SCALE_ITEMS = [
+    {"min": 0, "max": 39, "grade": "F", "point": 0},
+    {"min": 40, "max": 49, "grade": "D", "point": 1},
+    {"min": 50, "max": 59, "grade": "C", "point": 2},
+    {"min": 60, "max": 69, "grade": "B", "point": 3},
+    {"min": 70, "max": 79, "grade": "B+", "point": 3.5},
+    {"min": 80, "max": 100, "grade": "A", "point": 4},
+]
+
+
+class CompiledScale:
+    """Grading bands sorted by lower bound for O(log n) lookups."""
+
+    __slots__ = ("name", "lows", "grades", "points")
+
+    def __init__(self, name: str, bands: list[tuple[float, str, float]]):
+        bands = sorted(bands, key=lambda b: b[0])
+        self.name = name
+        self.lows = [b[0] for b in bands]
+        self.grades = [b[1] for b in bands]
+        self.points = [b[2] for b in bands]
+
+    def lookup(self, score: Optional[float]) -> tuple[Optional[str], Optional[float]]:
+        if score is None:
+            return None, None
+        i = bisect_right(self.lows, score) - 1
+        if i < 0:
+            return None, None
+        return self.grades[i], self.points[i]
+
+
+@lru_cache(maxsize=64)
+def compile_scale(items_json: str, name: str = "") -> CompiledScale:
+    """Compile a GradingScale.items_json string; cached on the exact text."""
+    try:
+        items = json.loads(items_json or "[]")
+    except ValueError:
+        items = []
+    bands = []
+    for it in items if isinstance(items, list) else []:
+        try:
+            bands.append((float(it["min"]), str(it["grade"]), float(it.get("point") or 0)))
+        except (KeyError, TypeError, ValueError):
+            continue
+    if not bands:
+        return compile_scale(json.dumps(DEFAULT_SCALE_ITEMS), name or "default")
+    return CompiledScale(name, bands)
+
+
+def load_scale(db: Session, name: Optional[str] = None) -> CompiledScale:
+    """Named scale, else settings.DEFAULT_GRADING_SCALE, else the first scale, else the built-in bands."""
+    q = db.query(models.GradingScale.name, models.GradingScale.items_json)
+    row = None
+    if name or settings.DEFAULT_GRADING_SCALE:
+        row = q.filter(models.GradingScale.name == (name or settings.DEFAULT_GRADING_SCALE)).first()
+    if row is None and not name:
+        row = q.order_by(models.GradingScale.id.asc()).first()
+    if row is None:
+        return compile_scale(json.dumps(DEFAULT_SCALE_ITEMS), "default")
+    return compile_scale(row.items_json, row.name)
+
+
+def weighted_totals(rows: Iterable[tuple]) -> dict:
+    """
+    Reduce (key, score, total_score, weight) rows to weighted percentages.
+
+    Each score is normalised to a percentage of its assessment's total and
+    weighted by the assessment weight: sum(w * pct) / sum(w) per key.
+    """
+    num: dict = {}
+    den: dict = {}
+    for key, score, total_score, weight in rows:
+        if score is None:
+            continue
+        w = float(weight if weight is not None else 1.0)
+        pct = float(score) / float(total_score or 100.0) * 100.0
+        num[key] = num.get(key, 0.0) + w * pct
+        den[key] = den.get(key, 0.0) + w
+    return {k: (num[k] / den[k] if den[k] else None) for k in num}
+
+
+# Cache namespace for everything derived from exam results and grading scales
+ANALYTICS_CACHE = "analytics"
+
+
+def results_changed() -> None:
+    """Call after any ExamResult, Assessment or GradingScale write to drop cached analytics."""
+    invalidate(ANALYTICS_CACHE)
+
+
+@cached(ANALYTICS_CACHE)
+def compute_term_grades(
+    db: Session,
+    term: Optional[str],
+    class_name: Optional[str],
+    subject: Optional[str] = None,
+    scale_name: Optional[str] = None,
+) -> dict:
+    """
+    Weighted subject totals, grades and points for every student in a class/term.
+
+    Returns {term, class_name, scale, subjects, students: [...]}, where each
+    student carries per-subject {total, grade, points} plus an overall average,
+    grade and points total.
+    """
+    scale = load_scale(db, scale_name)
+
+    q = (
+        db.query(
+            models.ExamResult.student_id,
+            models.Assessment.subject,
+            models.ExamResult.score,
+            models.Assessment.total_score,
+            models.Assessment.weight,
+        )
+        .join(models.Assessment, models.ExamResult.assessment_id == models.Assessment.id)
+    )
+    if term:
+        q = q.filter(models.Assessment.term == term)
+    if class_name:
+        q = q.filter(models.Assessment.class_name == class_name)
+    if subject:
+        q = q.filter(models.Assessment.subject == subject)
+
+    # Column-wise accumulation: one numerator/denominator array per subject
+    student_index: dict[int, int] = {}
+    subject_index: dict[str, int] = {}
+    num: list[array] = []
+    den: list[array] = []
+    for sid, subj, score, total_score, weight in q.all():
+        if score is None:
+            continue
+        subj = subj or "(none)"
+        si = student_index.setdefault(sid, len(student_index))
+        ci = subject_index.get(subj)
+        if ci is None:
+            ci = subject_index[subj] = len(subject_index)
+            num.append(array("d"))
+            den.append(array("d"))
+        col_n, col_d = num[ci], den[ci]
+        if len(col_n) <= si:
+            grow = si + 1 - len(col_n)
+            col_n.extend([0.0] * grow)
+            col_d.extend([0.0] * grow)
+        w = float(weight if weight is not None else 1.0)
+        col_n[si] += w * float(score) / float(total_score or 100.0) * 100.0
+        col_d[si] += w
+
+    subjects = sorted(subject_index)
+    students = []
+    for sid, si in sorted(student_index.items()):
+        per_subject = {}
+        totals = []
+        for subj in subjects:
+            ci = subject_index[subj]
+            d = den[ci][si] if si < len(den[ci]) else 0.0
+            if not d:
+                continue
+            total = num[ci][si] / d
+            grade, points = scale.lookup(total)
+            per_subject[subj] = {"total": round(total, 2), "grade": grade, "points": points}
+            totals.append(total)
+        average = sum(totals) / len(totals) if totals else None
+        grade, _ = scale.lookup(average)
+        students.append({
+            "student_id": sid,
+            "subjects": per_subject,
+            "average": round(average, 2) if average is not None else None,
+            "grade": grade,
+            "points_total": sum((v["points"] or 0) for v in per_subject.values()),
+        })
+
+    return {
+        "term": term,
+        "class_name": class_name,
+        "scale": scale.name,
+        "subjects": subjects,
+        "students": students,
+    }
+
+
+RANK_METHODS = ("competition", "dense")
+
+
+def rank_values(pairs: Iterable[tuple], method: str = "competition") -> dict:
+    """
+    Rank (key, value) pairs, highest value first.
+
+    ``competition`` gives 1, 2, 2, 4; ``dense`` gives 1, 2, 2, 3.
+    """
+    ranks = {}
+    prev = None
+    position = 0
+    dense = 0
+    for i, (key, value) in enumerate(sorted(pairs, key=lambda p: -p[1]), start=1):
+        if value != prev:
+            position = i
+            dense += 1
+            prev = value
+        ranks[key] = position if method == "competition" else dense
+    return ranks
+
+
+def _mean_std(values: list[float]) -> tuple[Optional[float], Optional[float]]:
+    if not values:
+        return None, None
+    mean = sum(values) / len(values)
+    var = sum((v - mean) ** 2 for v in values) / len(values)
+    return mean, var ** 0.5
+
+
+def _subject_col():
+    # Literal default keeps the expression identical in SELECT and GROUP BY on every driver
+    return func.coalesce(models.Assessment.subject, literal_column("'(none)'"))
+
+
+def _percent_expr():
+    # A zero total is treated like a missing one (out of 100), as the Python paths do
+    return models.ExamResult.score * 100.0 / func.coalesce(func.nullif(models.Assessment.total_score, 0), 100.0)
+
+
+def _subject_totals_query(db: Session, term: Optional[str], class_name: Optional[str]):
+    w = func.coalesce(models.Assessment.weight, 1.0)
+    pct = _percent_expr()
+    # Rounded so equal marks tie exactly regardless of float noise; all-zero
+    # weights give NULL (no total) rather than a division error
+    total = func.round(cast(func.sum(w * pct) / func.nullif(func.sum(w), 0), Numeric(12, 6)), 4).label("total")
+    q = (
+        db.query(
+            models.ExamResult.student_id.label("student_id"),
+            _subject_col().label("subject"),
+            total,
+        )
+        .join(models.Assessment, models.ExamResult.assessment_id == models.Assessment.id)
+        .filter(models.ExamResult.score.isnot(None))
+    )
+    if term:
+        q = q.filter(models.Assessment.term == term)
+    if class_name:
+        q = q.filter(models.Assessment.class_name == class_name)
+    return q.group_by(models.ExamResult.student_id, _subject_col())
+
+
+def _rankings_sql(db: Session, term: Optional[str], class_name: Optional[str], method: str):
+    """PostgreSQL: positions, means and deviations via window functions."""
+    totals = _subject_totals_query(db, term, class_name).subquery()
+    graded = totals.c.total.isnot(None)
+    rank_fn = func.rank if method == "competition" else func.dense_rank
+    subject_rows = db.query(
+        totals.c.student_id,
+        totals.c.subject,
+        totals.c.total,
+        rank_fn().over(partition_by=totals.c.subject, order_by=totals.c.total.desc()).label("position"),
+        func.avg(totals.c.total).over(partition_by=totals.c.subject).label("mean"),
+        func.stddev_pop(totals.c.total).over(partition_by=totals.c.subject).label("std"),
+        func.count().over(partition_by=totals.c.subject).label("n"),
+    ).filter(graded).all()
+
+    average = func.round(func.avg(totals.c.total), 4)
+    overall_rows = (
+        db.query(
+            totals.c.student_id,
+            average.label("average"),
+            rank_fn().over(order_by=average.desc()).label("position"),
+        )
+        .filter(graded)
+        .group_by(totals.c.student_id)
+        .all()
+    )
+    per_subject = [(r.student_id, r.subject, float(r.total), int(r.position)) for r in subject_rows]
+    stats = {
+        r.subject: (float(r.mean) if r.mean is not None else None, float(r.std) if r.std is not None else None, int(r.n))
+        for r in subject_rows
+    }
+    overall = [(r.student_id, float(r.average), int(r.position)) for r in overall_rows]
+    return per_subject, stats, overall
+
+
+def _rankings_python(db: Session, term: Optional[str], class_name: Optional[str], method: str):
+    """Fallback: the same grouped totals ranked with a sort over each column."""
+    by_subject: dict[str, list[tuple[int, float]]] = {}
+    by_student: dict[int, list[float]] = {}
+    for sid, subj, total in _subject_totals_query(db, term, class_name).all():
+        if total is None:
+            continue  # only zero-weight assessments
+        total = float(total)
+        by_subject.setdefault(subj, []).append((sid, total))
+        by_student.setdefault(sid, []).append(total)
+
+    per_subject = []
+    stats = {}
+    for subj, pairs in by_subject.items():
+        ranks = rank_values(pairs, method)
+        per_subject.extend((sid, subj, total, ranks[sid]) for sid, total in pairs)
+        mean, std = _mean_std([t for _, t in pairs])
+        stats[subj] = (mean, std, len(pairs))
+
+    averages = [(sid, round(sum(v) / len(v), 4)) for sid, v in by_student.items()]
+    ranks = rank_values(averages, method)
+    overall = [(sid, avg, ranks[sid]) for sid, avg in averages]
+    return per_subject, stats, overall
+
+
+@cached(ANALYTICS_CACHE)
+def class_rankings(
+    db: Session,
+    term: Optional[str],
+    class_name: Optional[str],
+    method: str = "competition",
+) -> dict:
+    """
+    Class and subject positions for every student in a class/term.
+
+    Positions are based on weighted subject totals (see ``compute_term_grades``)
+    and the mean of those totals overall. Ties share a position.
+    """
+    if method not in RANK_METHODS:
+        raise ValueError(f"method must be one of {RANK_METHODS}")
+
+    if db.get_bind().dialect.name == "postgresql":
+        per_subject, stats, overall = _rankings_sql(db, term, class_name, method)
+    else:
+        per_subject, stats, overall = _rankings_python(db, term, class_name, method)
+
+    subjects_by_student: dict[int, dict] = {}
+    for sid, subj, total, position in per_subject:
+        subjects_by_student.setdefault(sid, {})[subj] = {
+            "total": round(total, 2),
+            "position": position,
+            "out_of": stats[subj][2],
+        }
+    students = [
+        {
+            "student_id": sid,
+            "average": round(avg, 2),
+            "position": position,
+            "subjects": subjects_by_student.get(sid, {}),
+        }
+        for sid, avg, position in sorted(overall, key=lambda r: (r[2], r[0]))
+    ]
+    out = {
+        "term": term,
+        "class_name": class_name,
+        "method": method,
+        "out_of": len(students),
+        "subjects": [
+            {
+                "subject": subj,
+                "mean": round(mean, 2) if mean is not None else None,
+                "std_dev": round(std, 2) if std is not None else None,
+                "count": n,
+            }
+            for subj, (mean, std, n) in sorted(stats.items())
+        ],
+        "students": students,
+    }
+    return out
+
+
+DEFAULT_PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def _percentile(sorted_values: list[float], p: float) -> Optional[float]:
+    """Linear interpolation between closest ranks, matching percentile_cont."""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * p / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def _histogram(sorted_values: list[float], bins: int) -> list[int]:
+    width = 100.0 / bins
+    counts = [0] * bins
+    for v in sorted_values:
+        counts[min(bins - 1, max(0, int(v / width)))] += 1
+    return counts
+
+
+def _summary(values: list[float], bins: int, percentiles: tuple) -> dict:
+    n = len(values)
+    return {
+        "count": n,
+        "mean": round(sum(values) / n, 2) if n else None,
+        "min": round(values[0], 2) if n else None,
+        "max": round(values[-1], 2) if n else None,
+        "histogram": _histogram(values, bins),
+        "percentiles": {f"p{p:g}": _round(_percentile(values, p)) for p in percentiles},
+    }
+
+
+def _round(v: Optional[float]) -> Optional[float]:
+    return round(float(v), 2) if v is not None else None
+
+
+def _distribution_sql(db: Session, base, pct, subject, bins: int, percentiles: tuple) -> tuple[dict, dict]:
+    """PostgreSQL: bucket counts by GROUP BY and percentiles by percentile_cont."""
+    width = 100.0 / bins
+    bucket = cast(func.floor(pct / width), Integer)
+    bucket = case((bucket >= bins, bins - 1), (bucket < 0, 0), else_=bucket)
+    v = base.with_entities(subject.label("subject"), pct.label("pct"), bucket.label("b")).subquery()
+
+    cols = [
+        func.count(v.c.pct).label("n"),
+        func.avg(v.c.pct).label("mean"),
+        func.min(v.c.pct).label("min"),
+        func.max(v.c.pct).label("max"),
+    ] + [func.percentile_cont(p / 100.0).within_group(v.c.pct).label(f"p{i}") for i, p in enumerate(percentiles)]
+
+    def to_summary(r) -> dict:
+        return {
+            "count": int(r.n),
+            "mean": _round(r.mean),
+            "min": _round(r.min),
+            "max": _round(r.max),
+            "histogram": [0] * bins,
+            "percentiles": {f"p{p:g}": _round(getattr(r, f"p{i}")) for i, p in enumerate(percentiles)},
+        }
+
+    by_subject = {r.subject: to_summary(r) for r in db.query(v.c.subject, *cols).group_by(v.c.subject).all() if r.n}
+    overall_row = db.query(*cols).one()
+    overall = to_summary(overall_row) if overall_row.n else _summary([], bins, percentiles)
+    for subj, b, n in db.query(v.c.subject, v.c.b, func.count()).group_by(v.c.subject, v.c.b).all():
+        by_subject[subj]["histogram"][int(b)] += n
+        overall["histogram"][int(b)] += n
+    return by_subject, overall
+
+
+@cached(ANALYTICS_CACHE)
+def score_distribution(
+    db: Session,
+    term: Optional[str],
+    class_name: Optional[str],
+    bins: int = 10,
+    percentiles: tuple = DEFAULT_PERCENTILES,
+) -> dict:
+    """
+    Histograms and percentile tables of percentage scores per subject and overall.
+
+    Scores are normalised to their assessment's total_score. Histogram bins
+    split 0-100 evenly; 100 falls into the last bin.
+    """
+    percentiles = tuple(sorted(set(float(p) for p in percentiles)))
+
+    subject = _subject_col()
+    pct = _percent_expr()
+    base = (
+        db.query(models.ExamResult)
+        .join(models.Assessment, models.ExamResult.assessment_id == models.Assessment.id)
+        .filter(models.ExamResult.score.isnot(None))
+    )
+    if term:
+        base = base.filter(models.Assessment.term == term)
+    if class_name:
+        base = base.filter(models.Assessment.class_name == class_name)
+
+    if db.get_bind().dialect.name == "postgresql":
+        by_subject, overall = _distribution_sql(db, base, pct, subject, bins, percentiles)
+    else:
+        # One sorted pass over the score vectors; each subject's slice is already ordered
+        vectors: dict[str, list[float]] = {}
+        for subj, value in base.with_entities(subject, pct).order_by(subject, pct).all():
+            vectors.setdefault(subj, []).append(float(value))
+        by_subject = {subj: _summary(vals, bins, percentiles) for subj, vals in vectors.items()}
+        overall = _summary(sorted(v for vals in vectors.values() for v in vals), bins, percentiles)
+
+    width = 100.0 / bins
+    out = {
+        "term": term,
+        "class_name": class_name,
+        "bins": bins,
+        "bin_edges": [round(i * width, 2) for i in range(bins + 1)],
+        "overall": overall,
+        "subjects": [{"subject": subj, **by_subject[subj]} for subj in sorted(by_subject)],
+    }
+    return out
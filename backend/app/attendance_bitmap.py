@@ -0,0 +1,240 @@
+"""
+Compact per-term attendance bitmaps.
+
+Each student gets one ``AttendanceBitmap`` row per Term holding a 2-bit code
+per weekday (Mon-Fri) from the term start: 0 unmarked, 1 present, 2 late,
+3 absent, four days to a byte. Rates come from a 256-entry lookup table over
+the packed bytes and streaks/patterns from a single unpack, so a term of
+rates for the whole school is one small table read instead of a scan of the
+attendance rows. Weekend marks are not represented.
+
+``mark_attendance`` keeps bitmaps current; ``rebuild`` regenerates them from
+the attendance table (``python -m app.attendance_bitmap``).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from datetime import date, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+UNMARKED, PRESENT, LATE, ABSENT = 0, 1, 2, 3
+CODES = {"PRESENT": PRESENT, "LATE": LATE, "ABSENT": ABSENT}
+
+# Per byte: (present, late, absent) among its four 2-bit slots
+_BYTE_COUNTS = [
+    tuple(sum(1 for k in range(4) if (b >> (2 * k)) & 3 == code) for code in (PRESENT, LATE, ABSENT))
+    for b in range(256)
+]
+
+
+def school_day_index(start: date, d: date) -> Optional[int]:
+    """Weekday offset of ``d`` from ``start``; None for weekends or dates before start."""
+    if d < start or d.weekday() >= 5:
+        return None
+    return school_days(start, d) - 1
+
+
+def school_days(start: date, end: date) -> int:
+    """Number of weekdays in [start, end]."""
+    if end < start:
+        return 0
+    weeks, rem = divmod((end - start).days + 1, 7)
+    return weeks * 5 + sum(1 for i in range(rem) if (start + timedelta(days=weeks * 7 + i)).weekday() < 5)
+
+
+def empty(day_count: int) -> bytearray:
+    return bytearray((day_count + 3) // 4)
+
+
+def set_code(bits: bytearray, index: int, code: int) -> None:
+    byte, slot = divmod(index, 4)
+    shift = 2 * slot
+    bits[byte] = (bits[byte] & ~(3 << shift) & 0xFF) | (code << shift)
+
+
+def get_code(bits: bytes, index: int) -> int:
+    byte, slot = divmod(index, 4)
+    return (bits[byte] >> (2 * slot)) & 3
+
+
+def unpack(bits: bytes, day_count: int) -> list[int]:
+    return [(bits[i >> 2] >> (2 * (i & 3))) & 3 for i in range(day_count)]
+
+
+def counts(bits: bytes) -> tuple[int, int, int]:
+    """(present, late, absent) via the byte lookup table."""
+    p = l = a = 0
+    for b in bits:
+        bp, bl, ba = _BYTE_COUNTS[b]
+        p += bp
+        l += bl
+        a += ba
+    return p, l, a
+
+
+def summarise(bits: bytes, day_count: int, start: date) -> dict:
+    """Counts, rates, absence streaks and absences per weekday for one bitmap."""
+    present, late, absent = counts(bits)
+    marked = present + late + absent
+    codes = unpack(bits, day_count)
+    longest = run = 0
+    for code in codes:
+        if code == ABSENT:
+            run += 1
+            longest = max(longest, run)
+        elif code != UNMARKED:
+            run = 0
+    # Current streak: trailing absences, ignoring days not yet marked
+    current = 0
+    for code in reversed(codes):
+        if code == UNMARKED and current == 0:
+            continue
+        if code != ABSENT:
+            break
+        current += 1
+    by_weekday = [0] * 5
+    first = start.weekday() if start.weekday() < 5 else 0
+    for i, code in enumerate(codes):
+        if code == ABSENT:
+            by_weekday[(first + i) % 5] += 1
+
+    def rate(n: int) -> float:
+        return round(n * 100.0 / marked, 1) if marked else 0.0
+
+    return {
+        "marked_days": marked,
+        "present": present,
+        "late": late,
+        "absent": absent,
+        "attendance_rate": rate(present + late),
+        "absent_rate": rate(absent),
+        "current_absent_streak": current,
+        "longest_absent_streak": longest,
+        "absent_by_weekday": dict(zip(("mon", "tue", "wed", "thu", "fri"), by_weekday)),
+    }
+
+
+def _term_span(term: models.Term) -> Optional[tuple[date, int]]:
+    if term.start_date is None or term.end_date is None:
+        return None
+    return term.start_date, school_days(term.start_date, term.end_date)
+
+
+def term_for(db: Session, d: date) -> Optional[models.Term]:
+    return (
+        db.query(models.Term)
+        .filter(models.Term.start_date <= d, models.Term.end_date >= d)
+        .order_by(models.Term.start_date.desc())
+        .first()
+    )
+
+
+def apply_marks(db: Session, d: date, marks: Iterable[tuple[int, str]]) -> int:
+    """
+    Write one day's marks into the term bitmaps (does not commit). Bitmaps
+    whose term dates have since changed are rebuilt first. Returns the number
+    of bitmaps touched.
+    """
+    marks = list(marks)
+    term = term_for(db, d)
+    span = _term_span(term) if term else None
+    if not marks or span is None:
+        return 0
+    start, day_count = span
+    index = school_day_index(start, d)
+    if index is None or index >= day_count:
+        return 0
+    sids = {sid for sid, _ in marks}
+    existing = {
+        b.student_id: b
+        for b in db.query(models.AttendanceBitmap).filter(
+            models.AttendanceBitmap.term_id == term.id, models.AttendanceBitmap.student_id.in_(sids)
+        )
+    }
+    if any(b.start_date != start or b.day_count != day_count for b in existing.values()):
+        rebuild(db, term.id, commit=False)
+        return len(sids)
+    for sid, status in marks:
+        bm = existing.get(sid)
+        if bm is None:
+            bm = existing[sid] = models.AttendanceBitmap(
+                student_id=sid, term_id=term.id, start_date=start, day_count=day_count, bits=bytes(empty(day_count))
+            )
+            db.add(bm)
+        bits = bytearray(bm.bits)
+        set_code(bits, index, CODES.get((status or "").upper(), UNMARKED))
+        bm.bits = bytes(bits)
+    db.flush()
+    return len(existing)
+
+
+def rebuild(db: Session, term_id: Optional[int] = None, commit: bool = True) -> int:
+    """Regenerate bitmaps for one term (or every dated term) from Attendance. Returns rows written."""
+    q = db.query(models.Term).filter(models.Term.start_date.isnot(None), models.Term.end_date.isnot(None))
+    if term_id is not None:
+        q = q.filter(models.Term.id == term_id)
+    written = 0
+    for term in q.all():
+        start, day_count = _term_span(term)
+        db.query(models.AttendanceBitmap).filter(models.AttendanceBitmap.term_id == term.id).delete(synchronize_session=False)
+        maps: dict[int, bytearray] = {}
+        rows = (
+            db.query(models.Attendance.student_id, models.Attendance.date, models.Attendance.status)
+            .filter(models.Attendance.date >= term.start_date, models.Attendance.date <= term.end_date)
+            .yield_per(5000)
+        )
+        for sid, d, status in rows:
+            index = school_day_index(start, d)
+            if index is None or index >= day_count:
+                continue
+            bits = maps.get(sid)
+            if bits is None:
+                bits = maps[sid] = empty(day_count)
+            set_code(bits, index, CODES.get((status or "").upper(), UNMARKED))
+        db.bulk_insert_mappings(models.AttendanceBitmap, [
+            {"student_id": sid, "term_id": term.id, "start_date": start, "day_count": day_count, "bits": bytes(bits)}
+            for sid, bits in maps.items()
+        ])
+        written += len(maps)
+    if commit:
+        db.commit()
+    return written
+
+
+def term_stats(db: Session, term_id: int, class_name: Optional[str] = None, student_id: Optional[int] = None) -> list[dict]:
+    """Per-student summaries for a term straight from the bitmaps."""
+    q = db.query(models.AttendanceBitmap).filter(models.AttendanceBitmap.term_id == term_id)
+    if student_id is not None:
+        q = q.filter(models.AttendanceBitmap.student_id == student_id)
+    if class_name:
+        q = q.join(models.Student, models.Student.id == models.AttendanceBitmap.student_id).filter(
+            models.Student.class_name == class_name
+        )
+    return [
+        {"student_id": b.student_id, **summarise(b.bits, b.day_count, b.start_date)}
+        for b in q.order_by(models.AttendanceBitmap.student_id).all()
+    ]
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Rebuild attendance bitmaps from the attendance table.")
+    parser.add_argument("--term-id", type=int, default=None, help="only rebuild this term")
+    args = parser.parse_args(argv)
+
+    from .db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        print(json.dumps({"term_id": args.term_id, "bitmaps": rebuild(db, args.term_id)}))
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -154,4 +154,60 @@ def generate_monthly_fee_statements(db: Session, month: str = None):
         
     except Exception as e:
         logger.error(f"Error generating monthly statements: {str(e)}")
-        return 0
\ No newline at end of file
+        return 0
+
+
+def purge_old_notifications(db: Session, days_old: int = None, archive: str = None):
+    """
+    Remove old notifications in small batches; safe to schedule during school hours
+    """
+    try:
+        from .retention import purge_notifications
+
+        summary = purge_notifications(db, days_old=days_old, archive=archive)
+        logger.info(
+            f"Purged {summary['deleted']} notifications in {summary['batches']} batches"
+            + (f" (archived to {summary['archive_path'] or 'notification_archives'})" if archive else "")
+        )
+        return summary["deleted"]
+
+    except Exception as e:
+        logger.error(f"Error purging old notifications: {str(e)}")
+        return 0
+
+
+def rebuild_attendance_bitmaps(db: Session, term_id: int = None):
+    """
+    Regenerate the packed per-term attendance bitmaps from the attendance table
+    """
+    try:
+        from .attendance_bitmap import rebuild
+
+        written = rebuild(db, term_id)
+        logger.info(f"Rebuilt {written} attendance bitmaps" + (f" for term {term_id}" if term_id else ""))
+        return written
+
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error rebuilding attendance bitmaps: {str(e)}")
+        return 0
+
+
+def validate_absence_counters(db: Session, as_of: date = None):
+    """
+    Nightly check of the incremental absence counters against the attendance table
+    """
+    try:
+        from .absence_monitor import validate_counters
+
+        result = validate_counters(db, as_of)
+        if result["corrected"]:
+            logger.warning(f"Corrected {result['corrected']} of {result['checked']} absence counters")
+        else:
+            logger.info(f"Checked {result['checked']} absence counters")
+        return result
+
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error validating absence counters: {str(e)}")
+        return None
@@ -0,0 +1,73 @@
+"""
+Set-based upserts shared by the bulk write paths.
+
+PostgreSQL and SQLite both support ``INSERT ... ON CONFLICT DO UPDATE``; the
+statement is built with the dialect-specific ``insert`` construct so a whole
+payload is written in one round trip per chunk.
+"""
+from __future__ import annotations
+
+from typing import Iterable, Optional, Sequence
+
+from sqlalchemy.orm import Session
+
+# Keeps bound parameters per statement well under SQLite's 32766 limit
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def dialect_insert(db: Session):
+    """The dialect's ``insert`` construct supporting ON CONFLICT, or None."""
+    name = db.get_bind().dialect.name
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+
+def upsert(
+    db: Session,
+    model,
+    rows: Sequence[dict],
+    index_elements: Sequence[str],
+    update_columns: Iterable[str],
+    constraint: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> int:
+    """
+    Insert ``rows`` into ``model``'s table, updating ``update_columns`` when a
+    row collides on ``index_elements``. On PostgreSQL the named ``constraint``
+    is targeted directly. Does not commit. Returns the number of rows written.
+    """
+    if not rows:
+        return 0
+    update_columns = list(update_columns)
+    insert = dialect_insert(db)
+    if insert is None:
+        # Other dialects: fall back to ORM merge keyed on the conflict columns
+        for row in rows:
+            q = db.query(model)
+            for col in index_elements:
+                q = q.filter(getattr(model, col) == row[col])
+            obj = q.first()
+            if obj is None:
+                db.add(model(**row))
+            else:
+                for col in update_columns:
+                    setattr(obj, col, row[col])
+        db.flush()
+        return len(rows)
+
+    is_pg = db.get_bind().dialect.name == "postgresql"
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        stmt = insert(model.__table__).values(list(chunk))
+        set_ = {col: stmt.excluded[col] for col in update_columns}
+        if is_pg and constraint:
+            stmt = stmt.on_conflict_do_update(constraint=constraint, set_=set_)
+        else:
+            stmt = stmt.on_conflict_do_update(index_elements=list(index_elements), set_=set_)
+        db.execute(stmt)
+    return len(rows)
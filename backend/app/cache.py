@@ -0,0 +1,283 @@
+"""
+Result caching with single-flight coalescing for expensive read paths.
+
+``@cached("analytics")`` memoises a function on its normalised arguments
+(the SQLAlchemy session is ignored). When several requests ask for the same
+key at once only one computes it; the rest wait for that result. Entries
+expire after a TTL and a whole namespace can be dropped with
+``invalidate(namespace)``, which bumps the namespace generation so old keys
+are simply never read again. Finer-grained drops use scopes: a function
+declared with ``scopes=`` folds the generations of the sub-namespaces it
+reads (e.g. one per day) into its key, so ``invalidate("attendance:2024-05-06")``
+only retires entries that cover that day.
+
+The backend is chosen by settings.CACHE_BACKEND: "memory" (per process),
+"redis" (shared between workers, coalesced with a SET NX lock) or "none".
+Memory generations live in the process too, so an ``invalidate`` in one
+worker is invisible to the others; with settings.WEB_CONCURRENCY > 1 the
+memory backend is refused and caching is off unless Redis is configured.
+Redis values are stored as JSON, so cached functions must return plain
+JSON data (dicts with string keys, lists, numbers, strings).
+"""
+from __future__ import annotations
+
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from .settings import settings
+
+try:
+    import redis  # type: ignore
+except Exception:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+_MISS = object()
+
+
+class MemoryBackend:
+    """Per-process TTL store; single-flight via one Event per in-flight key."""
+
+    max_entries = 2048  # sweep expired entries once the store grows past this
+
+    def __init__(self):
+        self._data: dict[str, tuple[float, Any]] = {}
+        self._generations: dict[str, int] = {}
+        self._inflight: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def generation(self, namespace: str) -> int:
+        return self._generations.get(namespace, 0)
+
+    def generations(self, namespaces: list[str]) -> list[int]:
+        return [self._generations.get(ns, 0) for ns in namespaces]
+
+    def invalidate(self, namespace: str) -> None:
+        prefix = f"{namespace}:"
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISS
+        expires, value = entry
+        if expires < time.monotonic():
+            self._data.pop(key, None)
+            return _MISS
+        return value
+
+    def set(self, key: str, value, ttl: float) -> None:
+        now = time.monotonic()
+        if len(self._data) >= self.max_entries:
+            with self._lock:
+                for k in [k for k, (exp, _) in self._data.items() if exp < now]:
+                    del self._data[k]
+        self._data[key] = (now + ttl, value)
+
+    def get_or_compute(self, key: str, ttl: float, compute: Callable[[], Any], wait_timeout: float):
+        while True:
+            value = self.get(key)
+            if value is not _MISS:
+                return value
+            with self._lock:
+                event = self._inflight.get(key)
+                leader = event is None
+                if leader:
+                    event = self._inflight[key] = threading.Event()
+            if leader:
+                try:
+                    value = compute()
+                    self.set(key, value, ttl)
+                    return value
+                finally:
+                    with self._lock:
+                        self._inflight.pop(key, None)
+                    event.set()
+            if not event.wait(wait_timeout):
+                # Leader is stuck; stop waiting and compute independently
+                return compute()
+            value = self.get(key)
+            if value is not _MISS:
+                return value
+            # Leader failed or was invalidated mid-flight: retry as a new leader
+
+
+class RedisBackend:
+    """Shared store; cross-process single-flight via a short-lived SET NX lock."""
+
+    poll_interval = 0.05
+    # Release the lock only while it still holds our token; it may have expired and been re-taken
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, url: str):
+        self._client = redis.Redis.from_url(url)
+        self._release = self._client.register_script(self._RELEASE)
+        self._local = MemoryBackend()  # coalesce threads before touching Redis
+
+    def generation(self, namespace: str) -> int:
+        value = self._client.get(f"cache:gen:{namespace}")
+        return int(value) if value else 0
+
+    def generations(self, namespaces: list[str]) -> list[int]:
+        if not namespaces:
+            return []
+        return [int(v) if v else 0 for v in self._client.mget([f"cache:gen:{ns}" for ns in namespaces])]
+
+    def invalidate(self, namespace: str) -> None:
+        self._client.incr(f"cache:gen:{namespace}")
+
+    def get(self, key: str):
+        raw = self._client.get(f"cache:{key}")
+        return _MISS if raw is None else json.loads(raw)
+
+    def set(self, key: str, value, ttl: float) -> None:
+        self._client.set(f"cache:{key}", json.dumps(value, separators=(",", ":")), px=int(ttl * 1000))
+
+    def _compute_shared(self, key: str, ttl: float, compute: Callable[[], Any], wait_timeout: float):
+        value = self.get(key)
+        if value is not _MISS:
+            return value
+        lock = f"cache:lock:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + wait_timeout
+        while not self._client.set(lock, token, nx=True, px=int(wait_timeout * 1000)):
+            time.sleep(self.poll_interval)
+            value = self.get(key)
+            if value is not _MISS:
+                return value
+            if time.monotonic() > deadline:
+                return compute()
+        try:
+            value = compute()
+            self.set(key, value, ttl)
+            return value
+        finally:
+            self._release(keys=[lock], args=[token])
+
+    def get_or_compute(self, key: str, ttl: float, compute: Callable[[], Any], wait_timeout: float):
+        # Short local TTL: Redis stays the source of truth across workers
+        return self._local.get_or_compute(
+            key, min(ttl, 1.0), lambda: self._compute_shared(key, ttl, compute, wait_timeout), wait_timeout
+        )
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The configured backend, or None when caching is disabled."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                kind = (settings.CACHE_BACKEND or "memory").lower()
+                if kind == "none":
+                    _backend = False
+                elif kind == "redis" and redis is not None:
+                    _backend = RedisBackend(settings.REDIS_URL)
+                elif settings.WEB_CONCURRENCY > 1:
+                    # Per-process generations would leave other workers serving stale data
+                    logger.warning(
+                        f"CACHE_BACKEND={kind} cannot be shared by {settings.WEB_CONCURRENCY} workers; "
+                        "caching disabled (install redis and set CACHE_BACKEND=redis)"
+                    )
+                    _backend = False
+                else:
+                    if kind == "redis":
+                        logger.warning("CACHE_BACKEND=redis but redis is not installed; using memory cache")
+                    _backend = MemoryBackend()
+    return _backend or None
+
+
+def set_backend(backend) -> None:
+    """Swap the backend (tests, or None to re-read settings)."""
+    global _backend
+    _backend = backend
+
+
+def invalidate(*namespaces: str) -> None:
+    backend = get_backend()
+    if backend is None:
+        return
+    for ns in namespaces:
+        try:
+            backend.invalidate(ns)
+        except Exception:
+            logger.exception(f"Cache invalidation failed for {ns}")
+
+
+def _normalise(value):
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    if isinstance(value, (set, frozenset)):
+        return sorted(_normalise(v) for v in value)
+    if isinstance(value, (list, tuple)):
+        return [_normalise(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _normalise(v) for k, v in sorted(value.items())}
+    return value
+
+
+def make_key(namespace: str, generation: int, name: str, params: dict) -> str:
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"{namespace}:{generation}:{name}:{digest}"
+
+
+def cached(
+    namespace: str,
+    ttl: Optional[float] = None,
+    scopes: Optional[Callable[[dict], Iterable[str]]] = None,
+):
+    """
+    Cache a function's return value per normalised arguments. Session
+    arguments are excluded from the key; empty strings count as None.
+
+    ``scopes`` maps the bound arguments to the sub-namespaces the result
+    depends on; invalidating ``f"{namespace}:{scope}"`` drops only the
+    entries whose scopes include it.
+    """
+
+    def decorator(fn):
+        sig = inspect.signature(fn)
+        name = f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            backend = get_backend()
+            if backend is None:
+                return fn(*args, **kwargs)
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = {k: _normalise(v) for k, v in bound.arguments.items() if not isinstance(v, Session)}
+            expires = settings.CACHE_TTL_SECONDS if ttl is None else ttl
+            try:
+                if scopes is not None:
+                    names = [f"{namespace}:{s}" for s in scopes(bound.arguments)]
+                    params["__scopes__"] = backend.generations(names)
+                key = make_key(namespace, backend.generation(namespace), name, params)
+                return backend.get_or_compute(key, expires, lambda: fn(*args, **kwargs), settings.CACHE_WAIT_SECONDS)
+            except Exception as e:
+                if redis is not None and isinstance(e, redis.RedisError):
+                    logger.warning(f"Cache unavailable ({e.__class__.__name__}); computing {name} directly")
+                    return fn(*args, **kwargs)
+                raise
+
+        wrapper.uncached = fn
+        return wrapper
+
+    return decorator
@@ -0,0 +1,173 @@
+"""
+Spreadsheet import/export helpers.
+
+Workbooks are written with openpyxl's write-only mode into a temporary file and
+streamed back in chunks, and read with read-only mode, so memory stays flat no
+matter how many rows a sheet holds.
+"""
+from __future__ import annotations
+
+import os
+import tempfile
+from typing import Iterable, Iterator, Optional
+
+try:
+    from openpyxl import Workbook, load_workbook  # type: ignore
+except Exception:
+    Workbook = None  # type: ignore
+    load_workbook = None  # type: ignore
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+MARK_SHEET_HEADER = ["student_id", "admission_no", "full_name", "score"]
+
+
+def _require_openpyxl() -> None:
+    if Workbook is None or load_workbook is None:
+        raise RuntimeError("openpyxl is not available on this system.")
+
+
+def _sheet_title(text: str, used: set[str]) -> str:
+    # Excel titles: max 31 chars, no []:*?/\
+    clean = "".join("_" if ch in "[]:*?/\\" else ch for ch in (text or "Sheet"))[:31] or "Sheet"
+    title, n = clean, 2
+    while title in used:
+        suffix = f" ({n})"
+        title = clean[:31 - len(suffix)] + suffix
+        n += 1
+    used.add(title)
+    return title
+
+
+def write_mark_sheets(sheets: Iterable[tuple[dict, Iterable[tuple]]]) -> str:
+    """
+    Write one worksheet per assessment and return the temporary file path.
+
+    ``sheets`` yields (assessment, rows) where assessment is a dict with id,
+    name, class_name, subject, term and rows are (student_id, admission_no,
+    full_name, score) tuples. Row 1 carries the assessment id so uploads can
+    be matched back without relying on the sheet title.
+    """
+    _require_openpyxl()
+    wb = Workbook(write_only=True)
+    used: set[str] = set()
+    for a, rows in sheets:
+        ws = wb.create_sheet(title=_sheet_title(f"{a.get('class_name') or ''} {a.get('subject') or ''} {a.get('name') or ''}".strip(), used))
+        ws.append([
+            "assessment_id", a["id"],
+            "name", a.get("name"),
+            "class_name", a.get("class_name"),
+            "subject", a.get("subject"),
+            "term", a.get("term"),
+        ])
+        ws.append(MARK_SHEET_HEADER)
+        for row in rows:
+            ws.append(list(row))
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    wb.save(path)
+    return path
+
+
+def stream_and_remove(path: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Yield a temporary file in chunks, deleting it once fully sent."""
+    try:
+        with open(path, "rb") as fh:
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def read_mark_sheets(fileobj, default_assessment_id: Optional[int] = None) -> tuple[list[dict], list[dict]]:
+    """
+    Parse every worksheet of an uploaded mark-sheet workbook.
+
+    Returns (rows, errors). Each row is {assessment_id, student_id, score};
+    blank scores are skipped. Sheets without an assessment id in row 1 use
+    ``default_assessment_id``; when it is given, a sheet naming a different
+    assessment is rejected rather than imported there.
+    """
+    _require_openpyxl()
+    try:
+        wb = load_workbook(fileobj, read_only=True, data_only=True)
+    except Exception:
+        return [], [{"sheet": None, "row": None, "error": "not a valid .xlsx workbook"}]
+
+    rows: list[dict] = []
+    errors: list[dict] = []
+    try:
+        for ws in wb.worksheets:
+            aid = default_assessment_id
+            for row_no, values in enumerate(ws.iter_rows(values_only=True), start=1):
+                if not values or all(v is None or v == "" for v in values):
+                    continue
+                values = tuple(values) + (None,) * (4 - len(values))
+                label = str(values[0] or "").strip().lower()
+                if label == "assessment_id":
+                    try:
+                        aid = int(values[1])
+                    except (TypeError, ValueError):
+                        errors.append({"sheet": ws.title, "row": row_no, "error": "invalid assessment_id"})
+                        break
+                    if default_assessment_id is not None and aid != default_assessment_id:
+                        errors.append({
+                            "sheet": ws.title,
+                            "row": row_no,
+                            "error": f"sheet is for assessment {aid}, not {default_assessment_id}",
+                        })
+                        break
+                    continue
+                if label == "student_id":
+                    continue  # column header
+                if aid is None:
+                    errors.append({"sheet": ws.title, "row": row_no, "error": "assessment_id missing"})
+                    break
+                sid, score = values[0], values[3]
+                if score is None or score == "":
+                    continue
+                try:
+                    sid = int(sid)
+                    score = float(score)
+                except (TypeError, ValueError):
+                    errors.append({"sheet": ws.title, "row": row_no, "error": "student_id and numeric score are required"})
+                    continue
+                if score < 0:
+                    errors.append({"sheet": ws.title, "row": row_no, "error": "score must not be negative"})
+                    continue
+                rows.append({"assessment_id": aid, "student_id": sid, "score": score})
+    finally:
+        wb.close()
+    return rows, errors
+
+
+def write_attendance_register(title: str, days: list, students: Iterable[dict]) -> str:
+    """
+    Write a month register (students down, days across) and return the temp
+    file path. ``students`` carry admission_no, full_name and ``marks``, one
+    status character per day.
+    """
+    _require_openpyxl()
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=_sheet_title(title, set()))
+    ws.append(["admission_no", "full_name", *[d.day for d in days], "present", "late", "absent"])
+    for s in students:
+        marks = s["marks"]
+        ws.append([
+            s.get("admission_no"),
+            s.get("full_name"),
+            *[("" if ch == "." else ch) for ch in marks],
+            marks.count("P"),
+            marks.count("L"),
+            marks.count("A"),
+        ])
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    wb.save(path)
+    return path
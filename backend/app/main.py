@@ -1,9 +1,13 @@
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import text
 from .settings import settings
 from .logging_utils import install_memory_handler
-from .db import engine, Base
+from .db import engine, Base, SessionLocal
+from . import analytics_cube, report_card_jobs, schema_upgrades, timetable_integrity
 from .routers import auth as auth_router
 from .routers import users as users_router
 from .routers import admin as admin_router
@@ -28,7 +32,47 @@ try:
 except Exception:
     redis = None
 
-app = FastAPI(title="Elite Parent School MIS API", version="0.1.0")
+logger = logging.getLogger(__name__)
+
+
+def run_startup_tasks() -> None:
+    """Bring an existing database and job directory up to date; each step logs and moves on if it fails."""
+    db = SessionLocal()
+    try:
+        # Built here rather than on the first report request, where concurrent readers raced
+        analytics_cube.ensure_built(db)
+    except Exception:
+        db.rollback()
+        logger.exception("Analytics cube build failed; run python -m app.analytics_cube")
+    # Indexes added to existing tables only reach older databases here
+    try:
+        schema_upgrades.ensure_indexes(db)
+    except Exception:
+        db.rollback()
+        logger.exception("Could not add missing indexes")
+    # Older databases lack the slot double-booking indexes; add them where no conflicts block them
+    try:
+        timetable_integrity.ensure_unique_indexes(db)
+    except Exception:
+        db.rollback()
+        logger.exception("Could not check timetable slot indexes")
+    finally:
+        db.close()
+
+    # Report card jobs left unfinished by a previous process would otherwise read as queued forever
+    try:
+        report_card_jobs.sweep_stale_jobs()
+    except OSError:
+        logger.exception("Could not sweep stale report card jobs")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    run_startup_tasks()
+    yield
+
+
+app = FastAPI(title="Elite Parent School MIS API", version="0.1.0", lifespan=lifespan)
 
 # Install memory log handler for admin logs view
 install_memory_handler()
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional, List
 from sqlalchemy import (
-    Boolean, Column, Date, DateTime, Float, ForeignKey, Integer, String, Text, UniqueConstraint, func, Enum, LargeBinary
+    BigInteger, Boolean, Column, Date, DateTime, Float, ForeignKey, Index, Integer, String, Table, Text, UniqueConstraint, func, Enum, LargeBinary, text
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .db import Base
@@ -25,6 +25,22 @@ class NotificationChannel(enum.Enum):
     IN_APP = "in_app"
 
 
+user_roles = Table(
+    "user_roles",
+    Base.metadata,
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+    Column("role_id", Integer, ForeignKey("roles.id", ondelete="CASCADE"), primary_key=True),
+)
+
+
+class Role(Base):
+    __tablename__ = "roles"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    name: Mapped[str] = mapped_column(String(100), unique=True)
+    description: Mapped[str | None] = mapped_column(Text)
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -36,6 +52,7 @@ class User(Base):
     hashed_password: Mapped[str] = mapped_column(String(255))
     is_active: Mapped[bool] = mapped_column(Boolean, default=True, index=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    roles: Mapped[List["Role"]] = relationship(secondary=user_roles)
 
     __table_args__ = (
         UniqueConstraint("username", name="uq_users_username"),
@@ -95,9 +112,62 @@ class Attendance(Base):
 
     __table_args__ = (
         UniqueConstraint("student_id", "date", name="uq_attendance_student_date"),
+        # Register loads probe (date, student_id) for one class's roster
+        Index("ix_attendance_date_student", "date", "student_id"),
+    )
+
+
+class PeriodAttendance(Base):
+    """Per-lesson marks; the daily Attendance row is rolled up from these."""
+    __tablename__ = "period_attendance"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    student_id: Mapped[int] = mapped_column(Integer, index=True)
+    date: Mapped[Date] = mapped_column(Date)
+    period_index: Mapped[int] = mapped_column(Integer)
+    slot_id: Mapped[int | None] = mapped_column(Integer, index=True)  # TimetableSlot the register was taken for
+    status: Mapped[str] = mapped_column(String(20))  # PRESENT, LATE, ABSENT
+    remarks: Mapped[str | None] = mapped_column(String(255))
+
+    __table_args__ = (
+        UniqueConstraint("student_id", "date", "period_index", name="uq_period_attendance_student_date_period"),
+        # Daily rollups and slot registers read one date at a time
+        Index("ix_period_attendance_date_student", "date", "student_id"),
     )
 
 
+class AttendanceBitmap(Base):
+    """Packed 2-bit attendance codes per student per term, one per weekday from the term start."""
+    __tablename__ = "attendance_bitmaps"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    student_id: Mapped[int] = mapped_column(Integer, index=True)
+    term_id: Mapped[int] = mapped_column(Integer, index=True)
+    start_date: Mapped[Date] = mapped_column(Date)  # the term start the day indexes are relative to
+    day_count: Mapped[int] = mapped_column(Integer)
+    bits: Mapped[bytes] = mapped_column(LargeBinary)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("student_id", "term_id", name="uq_attendance_bitmap_student_term"),
+    )
+
+
+class AbsenceCounter(Base):
+    """Rolling absence state per student, advanced incrementally as registers are marked."""
+    __tablename__ = "absence_counters"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    student_id: Mapped[int] = mapped_column(Integer, unique=True, index=True)
+    window_end: Mapped[Date | None] = mapped_column(Date)  # bit 0 of the masks is this day
+    marked_mask: Mapped[int] = mapped_column(BigInteger, default=0)  # bit i: window_end - i days was marked
+    absent_mask: Mapped[int] = mapped_column(BigInteger, default=0)  # bit i: ... and was an absence
+    consecutive_absences: Mapped[int] = mapped_column(Integer, default=0)  # over marked days only
+    rate_alerted: Mapped[bool] = mapped_column(Boolean, default=False)
+    streak_alerted: Mapped[bool] = mapped_column(Boolean, default=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
 class Assessment(Base):
     __tablename__ = "assessments"
 
@@ -107,6 +177,7 @@ class Assessment(Base):
     subject: Mapped[str] = mapped_column(String(50), index=True)
     term: Mapped[str] = mapped_column(String(50), index=True)
     total_score: Mapped[float] = mapped_column(Float, default=100.0)
+    weight: Mapped[float] = mapped_column(Float, default=1.0)  # relative weight within the subject's term grade
     date: Mapped[Date] = mapped_column(Date, index=True)
     created_by: Mapped[int | None] = mapped_column(Integer, index=True)
 
@@ -124,6 +195,27 @@ class ExamResult(Base):
     )
 
 
+class AnalyticsCube(Base):
+    """Pre-aggregated raw-score statistics per (term, class, subject), kept current by deltas."""
+    __tablename__ = "analytics_cube"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    term: Mapped[str] = mapped_column(String(50), index=True, default="")
+    class_name: Mapped[str] = mapped_column(String(50), index=True, default="")
+    subject: Mapped[str] = mapped_column(String(50), index=True, default="")
+    result_count: Mapped[int] = mapped_column(Integer, default=0)
+    score_sum: Mapped[float] = mapped_column(Float, default=0.0)
+    score_sum_sq: Mapped[float] = mapped_column(Float, default=0.0)
+    pass_count: Mapped[int] = mapped_column(Integer, default=0)  # scores >= settings.PASS_MARK
+    min_score: Mapped[float | None] = mapped_column(Float)
+    max_score: Mapped[float | None] = mapped_column(Float)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("term", "class_name", "subject", name="uq_analytics_cube_cell"),
+    )
+
+
 class CommTemplate(Base):
     __tablename__ = "comm_templates"
 
@@ -246,6 +338,15 @@ class TimetableSlot(Base):
 
     __table_args__ = (
         UniqueConstraint("term", "day_of_week", "period_index", "class_name", name="uq_slot_unique"),
+        # A teacher or room can only be in one place per period; unassigned slots are exempt
+        Index(
+            "uq_slot_teacher", "term", "day_of_week", "period_index", "teacher_id", unique=True,
+            postgresql_where=text("teacher_id IS NOT NULL"), sqlite_where=text("teacher_id IS NOT NULL"),
+        ),
+        Index(
+            "uq_slot_room", "term", "day_of_week", "period_index", "room", unique=True,
+            postgresql_where=text("room IS NOT NULL"), sqlite_where=text("room IS NOT NULL"),
+        ),
     )
 
 
@@ -378,6 +479,17 @@ class Notification(Base):
     created_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), server_default=func.now(), index=True)
 
 
+class NotificationArchive(Base):
+    __tablename__ = "notification_archives"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    first_notification_id: Mapped[int] = mapped_column(Integer, index=True)
+    last_notification_id: Mapped[int] = mapped_column(Integer, index=True)
+    row_count: Mapped[int] = mapped_column(Integer)
+    payload: Mapped[bytes] = mapped_column(LargeBinary)  # zlib-compressed NDJSON of the archived rows
+    archived_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
 class NotificationPreference(Base):
     __tablename__ = "notification_preferences"
 
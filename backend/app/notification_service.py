@@ -1,9 +1,9 @@
 from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from datetime import datetime
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_
 from app.models import (
-    User, Student, Notification, NotificationPreference, ParentStudentLink,
+    User, Role, Student, Notification, NotificationPreference, ParentStudentLink,
     NotificationType, ExamResult, Attendance, FeePayment, DisciplinaryCase
 )
 from app.mailer import send_email_advanced
@@ -126,6 +126,15 @@ class NotificationService:
     ) -> bool:
         """Check if user wants to receive this type of notification"""
         pref = self.get_notification_preferences(user_id)
+        return self._pref_allows(pref, notification_type, channel)
+
+    @staticmethod
+    def _pref_allows(
+        pref: Optional[NotificationPreference],
+        notification_type: NotificationType,
+        channel: str = "in_app"
+    ) -> bool:
+        """Evaluate an already-loaded preference row"""
         if not pref:
             return True  # Default to sending if no preferences set
         
@@ -207,6 +216,147 @@ class NotificationService:
             if status in ['absent', 'late'] and self.should_send_notification(parent.id, NotificationType.ATTENDANCE_MARKED, "email"):
                 self.send_email_notification(parent, title, message)
 
+    def notify_attendance_marked_bulk(self, date: datetime, marks: List[tuple]) -> int:
+        """
+        Notify parents for a whole register at once.
+
+        ``marks`` is a list of (student_id, status). Links, students, parents and
+        preferences are loaded with one query each and all notifications are
+        committed together. Returns the number of notifications created.
+        """
+        status_by_student = {sid: status for sid, status in marks}
+        if not status_by_student:
+            return 0
+        sids = list(status_by_student)
+        links = self.db.query(ParentStudentLink).filter(
+            ParentStudentLink.student_id.in_(sids)
+        ).all()
+        if not links:
+            return 0
+        students = {
+            s.id: s for s in self.db.query(Student).filter(Student.id.in_(sids)).all()
+        }
+        parent_ids = list({link.parent_user_id for link in links})
+        parents = {
+            u.id: u for u in self.db.query(User).filter(User.id.in_(parent_ids)).all()
+        }
+        prefs = {
+            p.user_id: p for p in self.db.query(NotificationPreference).filter(
+                NotificationPreference.user_id.in_(parent_ids)
+            ).all()
+        }
+
+        emails = []
+        created = 0
+        for link in links:
+            student = students.get(link.student_id)
+            parent = parents.get(link.parent_user_id)
+            if not student or not parent:
+                continue
+            pref = prefs.get(parent.id)
+            if not self._pref_allows(pref, NotificationType.ATTENDANCE_MARKED):
+                continue
+            status = status_by_student[link.student_id]
+
+            title = f"Attendance Update for {student.full_name}"
+            message = f"Attendance marked for {date.strftime('%B %d, %Y')}: {status.title()}"
+            self.db.add(Notification(
+                user_id=parent.id,
+                type=NotificationType.ATTENDANCE_MARKED,
+                title=title,
+                message=message,
+                data=json.dumps({
+                    "student_id": link.student_id,
+                    "date": date.isoformat(),
+                    "status": status
+                })
+            ))
+            created += 1
+
+            # Email only for concerning statuses, same as the single-student path
+            if status.lower() in ['absent', 'late'] and self._pref_allows(pref, NotificationType.ATTENDANCE_MARKED, "email"):
+                emails.append((parent, title, message))
+
+        self.db.commit()
+        for parent, title, message in emails:
+            self.send_email_notification(parent, title, message)
+        return created
+
+    def notify_absence_alerts(self, alerts: List[Dict[str, Any]], staff_roles: Optional[List[str]] = None) -> int:
+        """
+        Notify parents and pastoral staff about students crossing an absence
+        threshold (see app.absence_monitor). Every recipient gets one
+        notification per alert; loads are batched as in the register path.
+        Returns the number of notifications created.
+        """
+        if not alerts:
+            return 0
+        sids = list({a["student_id"] for a in alerts})
+        students = {
+            s.id: s for s in self.db.query(Student).filter(Student.id.in_(sids)).all()
+        }
+        links = self.db.query(ParentStudentLink).filter(
+            ParentStudentLink.student_id.in_(sids)
+        ).all()
+        parents_of: Dict[int, List[int]] = {}
+        for link in links:
+            parents_of.setdefault(link.student_id, []).append(link.parent_user_id)
+        staff = []
+        if staff_roles:
+            # Role names as checked by require_roles; User.role is a legacy free-text label
+            staff = self.db.query(User).join(User.roles).filter(
+                Role.name.in_(staff_roles), User.is_active.is_(True)
+            ).distinct().all()
+        user_ids = list({link.parent_user_id for link in links} | {u.id for u in staff})
+        users = {
+            u.id: u for u in self.db.query(User).filter(User.id.in_(user_ids)).all()
+        } if user_ids else {}
+        prefs = {
+            p.user_id: p for p in self.db.query(NotificationPreference).filter(
+                NotificationPreference.user_id.in_(user_ids)
+            ).all()
+        } if user_ids else {}
+
+        emails = []
+        created = 0
+        for alert in alerts:
+            student = students.get(alert["student_id"])
+            if not student:
+                continue
+            if alert["kind"] == "consecutive_absence":
+                detail = f"absent for {alert['consecutive']} consecutive school days"
+            else:
+                detail = f"absent on {alert['rate']}% of marked days in the last {alert.get('window_days')} days"
+            title = f"Attendance Concern for {student.full_name}"
+            message = f"{student.full_name} has been {detail} (as of {alert['date']})."
+            data = json.dumps({
+                "alert": alert["kind"],
+                "student_id": student.id,
+                "rate": alert.get("rate"),
+                "consecutive": alert.get("consecutive"),
+                "date": alert["date"],
+            })
+            recipients = [users.get(uid) for uid in parents_of.get(student.id, [])] + staff
+            for user in {u.id: u for u in recipients if u}.values():
+                pref = prefs.get(user.id)
+                if not self._pref_allows(pref, NotificationType.ATTENDANCE_MARKED):
+                    continue
+                self.db.add(Notification(
+                    user_id=user.id,
+                    type=NotificationType.ATTENDANCE_MARKED,
+                    title=title,
+                    message=message,
+                    data=data
+                ))
+                created += 1
+                if self._pref_allows(pref, NotificationType.ATTENDANCE_MARKED, "email"):
+                    emails.append((user, title, message))
+
+        self.db.commit()
+        for user, title, message in emails:
+            self.send_email_notification(user, title, message)
+        return created
+
     def notify_fee_payment_confirmed(self, student_id: int, amount: float, balance: float):
         """Notify parents when fee payment is confirmed"""
         parents = self.get_parent_users_for_student(student_id)
@@ -405,11 +555,9 @@ class NotificationService:
             and_(Notification.user_id == user_id, Notification.is_read == False)
         ).count()
 
-    def delete_old_notifications(self, days_old: int = 90) -> int:
-        """Delete notifications older than specified days"""
-        cutoff_date = datetime.now() - timedelta(days=days_old)
-        deleted_count = self.db.query(Notification).filter(
-            Notification.created_at < cutoff_date
-        ).delete()
-        self.db.commit()
-        return deleted_count
\ No newline at end of file
+    def delete_old_notifications(self, days_old: int = 90, archive: Optional[str] = None) -> int:
+        """Delete notifications older than specified days in bounded batches"""
+        from app.retention import purge_notifications
+
+        summary = purge_notifications(self.db, days_old=days_old, archive=archive)
+        return summary["deleted"]
\ No newline at end of file
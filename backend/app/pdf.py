@@ -1,55 +1,314 @@
+"""
+PDF rendering service on top of WeasyPrint.
+
+Parsing CSS and discovering fonts dominate the cost of small documents, so
+the shared stylesheet and FontConfiguration are built once per process and
+reused for every render. Document bodies are ``string.Template`` objects
+compiled at import; values are HTML-escaped before substitution. Use
+``render_many`` for batches, and ``python -m app.pdf --bench N`` to compare
+against the naive per-document setup.
+"""
 from __future__ import annotations
 
+import argparse
+import time
 from datetime import datetime, timezone
-from textwrap import dedent
+from functools import lru_cache
+from html import escape
+from string import Template
+from typing import Callable, Iterable, Iterator
+
 try:
     from weasyprint import HTML, CSS  # type: ignore
+    from weasyprint.text.fonts import FontConfiguration  # type: ignore
 except Exception:
     HTML = None  # type: ignore
     CSS = None  # type: ignore
+    FontConfiguration = None  # type: ignore
 
 from .settings import settings
 
+SCHOOL_NAME = "Elite Parent School"
 
-def render_application_receipt(app, student) -> bytes:
-    issued = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
-    school = "Elite Parent School"
-    html = dedent(f"""
-    <html>
-      <head>
-        <meta charset="utf-8" />
-        <style>
-          body {{ font-family: -apple-system, BlinkMacSystemFont, Segoe UI, Roboto, Helvetica, Arial, sans-serif; font-size: 12px; color: #222; }}
-          h1 {{ font-size: 20px; margin-bottom: 4px; }}
-          .meta, .section {{ margin: 12px 0; }}
-          table {{ width: 100%; border-collapse: collapse; }}
-          th, td {{ text-align: left; padding: 6px; border-bottom: 1px solid #ddd; }}
-          .muted {{ color: #666; }}
-        </style>
-      </head>
-      <body>
-        <h1>Admission Receipt</h1>
-        <div class="muted">{school}</div>
-        <div class="meta">
-          <div><b>Reference:</b> {app.reference}</div>
-          <div><b>Issued:</b> {issued}</div>
-        </div>
-        <div class="section">
-          <table>
-            <tr><th>Student</th><td>{app.first_name} {app.last_name}</td></tr>
-            <tr><th>Admission No</th><td>{student.admission_no}</td></tr>
-            <tr><th>Class</th><td>{student.class_name or ''}</td></tr>
-            <tr><th>Gender</th><td>{app.gender or ''}</td></tr>
-            <tr><th>Date of Birth</th><td>{(app.date_of_birth.isoformat() if app.date_of_birth else '')}</td></tr>
-            <tr><th>Guardian Contact</th><td>{app.guardian_contact or ''}</td></tr>
-            <tr><th>Email</th><td>{app.email or ''}</td></tr>
-          </table>
-        </div>
-        <p class="muted">Keep this receipt for your records.</p>
-      </body>
-    </html>
-    """)
+BASE_CSS = """
+@page { size: A4; margin: 24px; }
+body { font-family: -apple-system, BlinkMacSystemFont, Segoe UI, Roboto, Helvetica, Arial, sans-serif; font-size: 12px; color: #222; }
+h1 { font-size: 20px; margin-bottom: 4px; }
+.meta, .section { margin: 12px 0; }
+table { width: 100%; border-collapse: collapse; }
+th, td { text-align: left; padding: 6px; border-bottom: 1px solid #ddd; }
+.muted { color: #666; }
+h2 { font-size: 14px; margin: 16px 0 4px; }
+"""
+
+_PAGE = Template("""<html><head><meta charset="utf-8" /></head><body>$body</body></html>""")
+
+RECEIPT_TEMPLATE = Template("""
+<h1>Admission Receipt</h1>
+<div class="muted">$school</div>
+<div class="meta">
+  <div><b>Reference:</b> $reference</div>
+  <div><b>Issued:</b> $issued</div>
+</div>
+<div class="section">
+  <table>
+    <tr><th>Student</th><td>$student_name</td></tr>
+    <tr><th>Admission No</th><td>$admission_no</td></tr>
+    <tr><th>Class</th><td>$class_name</td></tr>
+    <tr><th>Gender</th><td>$gender</td></tr>
+    <tr><th>Date of Birth</th><td>$date_of_birth</td></tr>
+    <tr><th>Guardian Contact</th><td>$guardian_contact</td></tr>
+    <tr><th>Email</th><td>$email</td></tr>
+  </table>
+</div>
+<p class="muted">Keep this receipt for your records.</p>
+""")
+
+REPORT_CARD_TEMPLATE = Template("""
+<h1>Report Card</h1>
+<div class="muted">$school</div>
+<div class="meta">
+  <div><b>Student:</b> $full_name ($admission_no)</div>
+  <div><b>Class:</b> $class_name &nbsp; <b>Term:</b> $term</div>
+  <div><b>Issued:</b> $issued</div>
+</div>
+<div class="section">
+  <table>
+    <tr><th>Subject</th><th>Total %</th><th>Grade</th><th>Position</th></tr>
+    ${_subject_rows}
+  </table>
+</div>
+<div class="section">
+  <div><b>Average:</b> $average &nbsp; <b>Grade:</b> $grade &nbsp; <b>Points:</b> $points_total</div>
+  <div><b>Class position:</b> $position of $out_of</div>
+</div>
+""")
+
+REPORT_CARD_ROW = Template("<tr><td>$subject</td><td>$total</td><td>$grade</td><td>$position/$out_of</td></tr>")
+
+TRANSCRIPT_TEMPLATE = Template("""
+<h1>Academic Transcript</h1>
+<div class="muted">$school</div>
+<div class="meta">
+  <div><b>Student:</b> $full_name ($admission_no)</div>
+  <div><b>Class:</b> $class_name &nbsp; <b>Grading scale:</b> $scale</div>
+  <div><b>Issued:</b> $issued</div>
+</div>
+${_terms}
+<div class="section">
+  <div><b>Cumulative average:</b> $cumulative_average &nbsp; <b>Grade:</b> $cumulative_grade</div>
+</div>
+""")
+
+TRANSCRIPT_TERM = Template("""
+<div class="section">
+  <h2>$term</h2>
+  <table>
+    <tr><th>Subject</th><th>Total %</th><th>Grade</th><th>Points</th></tr>
+    ${_subject_rows}
+    <tr><th>Average</th><th>$average</th><th>$grade</th><th></th></tr>
+  </table>
+</div>
+""")
+
+TRANSCRIPT_ROW = Template("<tr><td>$subject</td><td>$total</td><td>$grade</td><td>$points</td></tr>")
+
+TEMPLATES: dict[str, Template] = {
+    "receipt": RECEIPT_TEMPLATE,
+    "report_card": REPORT_CARD_TEMPLATE,
+    "transcript": TRANSCRIPT_TEMPLATE,
+}
+
+
+def _require_weasyprint() -> None:
     if HTML is None or CSS is None:
         raise RuntimeError("WeasyPrint is not available on this system.")
-    pdf = HTML(string=html).write_pdf(stylesheets=[CSS(string="@page { size: A4; margin: 24px; }")])
-    return pdf
+
+
+@lru_cache(maxsize=1)
+def _font_config():
+    return FontConfiguration() if FontConfiguration is not None else None
+
+
+@lru_cache(maxsize=8)
+def _stylesheets(extra_css: str = "") -> tuple:
+    """Parsed once per process (and per extra stylesheet)."""
+    _require_weasyprint()
+    fc = _font_config()
+    sheets = [CSS(string=BASE_CSS, font_config=fc)]
+    if extra_css:
+        sheets.append(CSS(string=extra_css, font_config=fc))
+    return tuple(sheets)
+
+
+def _text(value) -> str:
+    return escape("" if value is None else str(value))
+
+
+def fill(template: Template, context: dict) -> str:
+    """Substitute escaped values; keys starting with "_" are trusted, pre-rendered HTML."""
+    values = {k: (v if k.startswith("_") else _text(v)) for k, v in context.items()}
+    return template.safe_substitute(values)
+
+
+def render_html(name: str, context: dict) -> str:
+    return _PAGE.substitute(body=fill(TEMPLATES[name], context))
+
+
+def render(name: str, context: dict, extra_css: str = "") -> bytes:
+    """Render one named template to PDF bytes."""
+    _require_weasyprint()
+    return HTML(string=render_html(name, context)).write_pdf(
+        stylesheets=list(_stylesheets(extra_css)), font_config=_font_config()
+    )
+
+
+def render_many(name: str, contexts: Iterable[dict], extra_css: str = "") -> Iterator[bytes]:
+    """Render a batch with one template, stylesheet and font configuration."""
+    _require_weasyprint()
+    sheets = list(_stylesheets(extra_css))
+    fc = _font_config()
+    template = TEMPLATES[name]
+    image_cache: dict = {}  # logos etc. fetched once for the batch
+    for context in contexts:
+        html = _PAGE.substitute(body=fill(template, context))
+        yield HTML(string=html).write_pdf(stylesheets=sheets, font_config=fc, cache=image_cache)
+
+
+def receipt_context(app, student) -> dict:
+    return {
+        "school": SCHOOL_NAME,
+        "reference": app.reference,
+        "issued": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M UTC"),
+        "student_name": f"{app.first_name} {app.last_name}",
+        "admission_no": student.admission_no,
+        "class_name": student.class_name,
+        "gender": app.gender,
+        "date_of_birth": app.date_of_birth.isoformat() if app.date_of_birth else None,
+        "guardian_contact": app.guardian_contact,
+        "email": app.email,
+    }
+
+
+def render_application_receipt(app, student) -> bytes:
+    return render("receipt", receipt_context(app, student))
+
+
+def _num(value) -> str:
+    return "" if value is None else f"{value:.1f}"
+
+
+def report_card_context(card: dict) -> dict:
+    """Template values for a card dict from report_card_jobs.collect_cards."""
+    rows = "".join(
+        fill(REPORT_CARD_ROW, {**s, "total": _num(s.get("total"))})
+        for s in card.get("subjects") or []
+    )
+    return {
+        "school": card.get("school") or SCHOOL_NAME,
+        "full_name": card.get("full_name"),
+        "admission_no": card.get("admission_no"),
+        "class_name": card.get("class_name"),
+        "term": card.get("term") or "All",
+        "issued": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+        "average": _num(card.get("average")),
+        "grade": card.get("grade"),
+        "points_total": card.get("points_total"),
+        "position": card.get("position"),
+        "out_of": card.get("out_of"),
+        "_subject_rows": rows,
+    }
+
+
+def render_report_card(card: dict) -> bytes:
+    return render("report_card", report_card_context(card))
+
+
+def render_report_cards(cards: Iterable[dict]) -> Iterator[bytes]:
+    return render_many("report_card", (report_card_context(c) for c in cards))
+
+
+def transcript_context(t: dict) -> dict:
+    """Template values for a transcript from transcripts.build_transcripts."""
+    terms = "".join(
+        fill(TRANSCRIPT_TERM, {
+            "term": term["term"] or "Unspecified term",
+            "average": _num(term["average"]),
+            "grade": term["grade"],
+            "_subject_rows": "".join(
+                fill(TRANSCRIPT_ROW, {**s, "total": _num(s["total"])}) for s in term["subjects"]
+            ),
+        })
+        for term in t["terms"]
+    )
+    return {
+        "school": SCHOOL_NAME,
+        "full_name": t["full_name"],
+        "admission_no": t["admission_no"],
+        "class_name": t["class_name"],
+        "scale": t["scale"],
+        "issued": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+        "cumulative_average": _num(t["cumulative_average"]),
+        "cumulative_grade": t["cumulative_grade"],
+        "_terms": terms,
+    }
+
+
+def render_transcript(t: dict) -> bytes:
+    return render("transcript", transcript_context(t))
+
+
+def render_transcripts(transcripts: Iterable[dict]) -> Iterator[bytes]:
+    return render_many("transcript", (transcript_context(t) for t in transcripts))
+
+
+def _bench(n: int) -> dict:
+    card = {
+        "full_name": "Bench Student",
+        "admission_no": "B-001",
+        "class_name": "S1A",
+        "term": "T1",
+        "subjects": [{"subject": f"Subject {i}", "total": 60 + i, "grade": "B", "position": i + 1, "out_of": 40} for i in range(10)],
+        "average": 64.5,
+        "grade": "B",
+        "points_total": 30,
+        "position": 5,
+        "out_of": 40,
+    }
+
+    def timed(fn: Callable[[], None]) -> float:
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+    def naive():
+        # What every render used to do: fresh CSS parse and font discovery
+        for _ in range(n):
+            html = render_html("report_card", report_card_context(card))
+            HTML(string=html).write_pdf(stylesheets=[CSS(string=BASE_CSS)])
+
+    def cached():
+        for _ in render_many("report_card", (report_card_context(card) for _ in range(n))):
+            pass
+
+    _require_weasyprint()
+    cached_s = timed(cached)
+    naive_s = timed(naive)
+    return {
+        "documents": n,
+        "naive_per_sec": round(n / naive_s, 1),
+        "cached_per_sec": round(n / cached_s, 1),
+        "speedup": round(naive_s / cached_s, 2),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="PDF rendering micro-benchmark.")
+    parser.add_argument("--bench", type=int, default=50, help="documents to render per variant")
+    args = parser.parse_args(argv)
+    print(_bench(args.bench))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,94 @@
+"""
+Period (per-lesson) attendance and its daily rollup.
+
+Registers taken per TimetableSlot are written to ``PeriodAttendance`` with
+one set-based upsert. The daily ``Attendance`` row for every student in the
+register is then derived with a single ``INSERT ... SELECT ... GROUP BY ...
+ON CONFLICT`` over that day's period marks, so no per-row work happens in
+Python or in triggers:
+
+* every marked period ABSENT  -> ABSENT
+* every marked period PRESENT -> PRESENT
+* anything else (late, or missed part of the day) -> LATE
+
+Daily remarks are left untouched. Parents hear about a day once: when the
+rollup first moves a student from unmarked or PRESENT to ABSENT or LATE
+(see ``first_concerns``), not on every later period.
+"""
+from __future__ import annotations
+
+from datetime import date
+from typing import Iterable, Optional, Sequence
+
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .bulk import DEFAULT_CHUNK_SIZE, dialect_insert, upsert
+
+PA = models.PeriodAttendance
+
+CONCERNS = ("ABSENT", "LATE")
+
+
+def _daily_status_query(d: date, student_ids: Sequence[int]):
+    status = func.upper(PA.status)
+    marked = func.count()
+    absent = func.sum(case((status == "ABSENT", 1), else_=0))
+    present = func.sum(case((status == "PRESENT", 1), else_=0))
+    daily = case((absent == marked, "ABSENT"), (present == marked, "PRESENT"), else_="LATE")
+    return (
+        select(PA.student_id, PA.date, daily.label("status"))
+        .where(PA.date == d, PA.student_id.in_(list(student_ids)))
+        .group_by(PA.student_id, PA.date)
+    )
+
+
+def mark_periods(db: Session, d: date, rows: Sequence[dict]) -> int:
+    """Upsert period marks (dicts of student_id, period_index, slot_id, status, remarks). Does not commit."""
+    return upsert(
+        db,
+        PA,
+        [{"date": d, **r} for r in rows],
+        index_elements=["student_id", "date", "period_index"],
+        update_columns=["slot_id", "status", "remarks"],
+        constraint="uq_period_attendance_student_date_period",
+    )
+
+
+def rollup_daily(db: Session, d: date, student_ids: Iterable[int]) -> list[tuple[int, Optional[str], str]]:
+    """
+    Recompute the daily Attendance status of ``student_ids`` on ``d`` from
+    their period marks. Does not commit. Returns (student_id, previous
+    status, status) for the students whose daily status changed.
+    """
+    sids = sorted(set(student_ids))
+    if not sids:
+        return []
+    A = models.Attendance
+    before = dict(db.query(A.student_id, A.status).filter(A.date == d, A.student_id.in_(sids)).all())
+    insert = dialect_insert(db)
+    for start in range(0, len(sids), DEFAULT_CHUNK_SIZE):
+        chunk = sids[start:start + DEFAULT_CHUNK_SIZE]
+        source = _daily_status_query(d, chunk)
+        if insert is None:
+            upsert(db, A, [dict(r._mapping) for r in db.execute(source)], ["student_id", "date"], ["status"])
+            continue
+        stmt = insert(A.__table__).from_select(["student_id", "date", "status"], source)
+        set_ = {"status": stmt.excluded.status}
+        if db.get_bind().dialect.name == "postgresql":
+            stmt = stmt.on_conflict_do_update(constraint="uq_attendance_student_date", set_=set_)
+        else:
+            stmt = stmt.on_conflict_do_update(index_elements=["student_id", "date"], set_=set_)
+        db.execute(stmt)
+    after = db.query(A.student_id, A.status).filter(A.date == d, A.student_id.in_(sids)).all()
+    return [(sid, before.get(sid), status) for sid, status in after if before.get(sid) != status]
+
+
+def first_concerns(changed: Iterable[tuple[int, Optional[str], str]]) -> list[tuple[int, str]]:
+    """The rollup changes that should reach parents: into ABSENT/LATE from anything else."""
+    return [
+        (sid, status)
+        for sid, previous, status in changed
+        if status in CONCERNS and (previous or "").upper() not in CONCERNS
+    ]
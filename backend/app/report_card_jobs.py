@@ -0,0 +1,279 @@
+"""
+Batch PDF report cards for a class or a whole grade, and batch PDF
+transcripts (job kind "transcripts").
+
+Card data is gathered up front with a handful of grouped queries per class
+(term grades and positions), turned into plain dicts and rendered across a
+process pool, since WeasyPrint layout is CPU-bound. Finished PDFs stream into
+a zip under settings.REPORT_CARD_DIR. Job state lives in an in-process
+registry mirrored to ``<job_id>.json`` next to the zip so any worker can
+report progress and serve the download. Every save stamps a heartbeat; an
+unfinished job whose heartbeat is older than
+settings.REPORT_CARD_JOB_TIMEOUT_SECONDS is reported as failed, since the
+worker running it has gone away.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from . import models, transcripts
+from .analytics_service import class_rankings, compute_term_grades
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+_jobs: dict[str, dict] = {}
+_lock = threading.Lock()
+
+# Upper bound on cards per worker task (and so between progress updates)
+_PROGRESS_EVERY = 25
+
+ACTIVE_STATUSES = ("queued", "collecting", "rendering")
+
+
+def _job_dir() -> str:
+    os.makedirs(settings.REPORT_CARD_DIR, exist_ok=True)
+    return settings.REPORT_CARD_DIR
+
+
+def _status_path(job_id: str) -> str:
+    return os.path.join(_job_dir(), f"{job_id}.json")
+
+
+def zip_path(job_id: str) -> str:
+    return os.path.join(_job_dir(), f"report-cards-{job_id}.zip")
+
+
+def _save(job: dict) -> None:
+    job["heartbeat_at"] = datetime.now(timezone.utc).isoformat()
+    with _lock:
+        _jobs[job["id"]] = job
+        snapshot = dict(job)
+    tmp = _status_path(job["id"]) + ".tmp"
+    with open(tmp, "w") as fh:
+        json.dump(snapshot, fh)
+    os.replace(tmp, _status_path(job["id"]))
+
+
+def _is_stale(job: dict) -> bool:
+    if job.get("status") not in ACTIVE_STATUSES:
+        return False
+    try:
+        beat = datetime.fromisoformat(job.get("heartbeat_at") or job["created_at"])
+    except (KeyError, TypeError, ValueError):
+        return True
+    return datetime.now(timezone.utc) - beat > timedelta(seconds=settings.REPORT_CARD_JOB_TIMEOUT_SECONDS)
+
+
+def _fail_stale(job: dict) -> dict:
+    job.update(status="failed", error="worker stopped before the job finished", finished_at=datetime.now(timezone.utc).isoformat())
+    _save(job)
+    logger.warning(f"Report card job {job['id']} marked failed: no heartbeat")
+    return job
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    with _lock:
+        job = _jobs.get(job_id)
+        job = dict(job) if job is not None else None
+    if job is None:
+        try:
+            with open(_status_path(job_id)) as fh:
+                job = json.load(fh)
+        except (OSError, ValueError):
+            return None
+    return _fail_stale(job) if _is_stale(job) else job
+
+
+def sweep_stale_jobs() -> int:
+    """Mark every unfinished job without a recent heartbeat as failed. Run at startup."""
+    swept = 0
+    for name in os.listdir(_job_dir()):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(_job_dir(), name)) as fh:
+                job = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        if _is_stale(job):
+            _fail_stale(job)
+            swept += 1
+    return swept
+
+
+def _in_grade(class_name: str, grade: str) -> bool:
+    # "S1" covers S1, S1A and "S1 East" but not S10
+    rest = class_name[len(grade):]
+    return not rest or not (grade[-1].isdigit() and rest[0].isdigit())
+
+
+def classes_for(db: Session, class_name: Optional[str] = None, grade: Optional[str] = None) -> list[str]:
+    """One class, or every stream of ``grade`` (e.g. "S1" -> S1A, S1B; never S10)."""
+    if class_name:
+        return [class_name]
+    prefix = grade.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    rows = (
+        db.query(models.Student.class_name)
+        .filter(models.Student.class_name.like(f"{prefix}%", escape="\\"))
+        .distinct()
+        .order_by(models.Student.class_name)
+        .all()
+    )
+    return [r[0] for r in rows if r[0] and _in_grade(r[0], grade)]
+
+
+def collect_cards(db: Session, term: Optional[str], classes: list[str]) -> list[dict]:
+    """Plain, picklable card dicts for every enrolled student in ``classes``."""
+    students = (
+        db.query(models.Student)
+        .filter(models.Student.class_name.in_(classes))
+        .order_by(models.Student.class_name, models.Student.id)
+        .all()
+    )
+    cards: list[dict] = []
+    per_class: dict[str, tuple[dict, dict, int]] = {}
+    for cls in classes:
+        grades = compute_term_grades(db, term, cls)
+        ranks = class_rankings(db, term, cls)
+        per_class[cls] = (
+            {s["student_id"]: s for s in grades["students"]},
+            {s["student_id"]: s for s in ranks["students"]},
+            ranks["out_of"],
+        )
+    for st in students:
+        grades, ranks, out_of = per_class[st.class_name]
+        g = grades.get(st.id) or {}
+        r = ranks.get(st.id) or {}
+        rank_subjects = r.get("subjects") or {}
+        cards.append({
+            "student_id": st.id,
+            "admission_no": st.admission_number,
+            "full_name": st.full_name,
+            "class_name": st.class_name,
+            "term": term,
+            "subjects": [
+                {
+                    "subject": subj,
+                    "total": v["total"],
+                    "grade": v["grade"],
+                    "points": v["points"],
+                    "position": (rank_subjects.get(subj) or {}).get("position"),
+                    "out_of": (rank_subjects.get(subj) or {}).get("out_of"),
+                }
+                for subj, v in sorted((g.get("subjects") or {}).items())
+            ],
+            "average": g.get("average"),
+            "grade": g.get("grade"),
+            "points_total": g.get("points_total"),
+            "position": r.get("position"),
+            "out_of": out_of,
+        })
+    return cards
+
+
+def _safe(text) -> str:
+    return "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in str(text))
+
+
+def _card_filename(card: dict) -> str:
+    return f"{_safe(card['class_name'])}/{_safe(card.get('admission_no') or card['student_id'])}.pdf"
+
+
+def _render_chunk(cards: list[dict]) -> list[tuple[str, bytes]]:
+    # Runs in a worker process; the stylesheet and fonts are parsed once per worker
+    from .pdf import render_report_cards
+
+    return [(_card_filename(c), pdf) for c, pdf in zip(cards, render_report_cards(cards))]
+
+
+def _render_transcript_chunk(items: list[dict]) -> list[tuple[str, bytes]]:
+    from .pdf import render_transcripts
+
+    return [(transcripts.filename(t, "pdf"), pdf) for t, pdf in zip(items, render_transcripts(items))]
+
+
+def start_job(
+    term: Optional[str],
+    class_name: Optional[str] = None,
+    grade: Optional[str] = None,
+    requested_by: Optional[int] = None,
+    kind: str = "report_cards",
+    student_ids: Optional[list[int]] = None,
+    scale: Optional[str] = None,
+) -> dict:
+    job = {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "status": "queued",
+        "term": term,
+        "class_name": class_name,
+        "grade": grade,
+        "requested_by": requested_by,
+        "student_ids": student_ids,
+        "scale": scale,
+        "total": 0,
+        "done": 0,
+        "percent": 0.0,
+        "error": None,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "finished_at": None,
+    }
+    _save(job)
+    return job
+
+
+def run_job(job_id: str) -> None:
+    """Collect, render and zip every card or transcript for a queued job. Safe to run in a background task."""
+    from .db import SessionLocal
+
+    job = get_job(job_id)
+    if job is None:
+        return
+    db = SessionLocal()
+    try:
+        job["status"] = "collecting"
+        _save(job)
+        if job.get("kind") == "transcripts":
+            cards = list(transcripts.build_transcripts(db, job["student_ids"] or [], scale_name=job.get("scale")))
+            render = _render_transcript_chunk
+        else:
+            cards = collect_cards(db, job["term"], classes_for(db, job["class_name"], job["grade"]))
+            render = _render_chunk
+        db.close()
+
+        job.update(status="rendering", total=len(cards))
+        _save(job)
+        path = zip_path(job_id)
+        tmp = path + ".part"
+        workers = settings.REPORT_CARD_WORKERS or os.cpu_count() or 1
+        size = max(1, min(_PROGRESS_EVERY, len(cards) // (workers * 4) or 1))
+        chunks = [cards[i:i + size] for i in range(0, len(cards), size)]
+        with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_STORED) as zf:
+            if chunks:
+                with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+                    for rendered in pool.map(render, chunks):
+                        for name, pdf in rendered:
+                            zf.writestr(name, pdf)  # PDFs are already compressed
+                        job["done"] += len(rendered)
+                        job["percent"] = round(job["done"] * 100.0 / len(cards), 1)
+                        _save(job)
+        os.replace(tmp, path)
+        job.update(status="done", percent=100.0, finished_at=datetime.now(timezone.utc).isoformat())
+        _save(job)
+    except Exception as e:
+        logger.exception(f"Report card job {job_id} failed")
+        job.update(status="failed", error=str(e), finished_at=datetime.now(timezone.utc).isoformat())
+        _save(job)
+    finally:
+        db.close()
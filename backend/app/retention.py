@@ -0,0 +1,223 @@
+"""
+Chunked retention and archival for the notifications table.
+
+Old rows are removed in bounded keyset batches (the next expired ids after
+the last batch) with a short pause between batches so the purge never holds
+long locks and can run during school hours.
+Each batch can optionally be copied to the compressed ``notification_archives``
+table (in the delete's own transaction) or to an NDJSON.gz file. File batches
+are staged in a ``.part`` file and only appended to the archive once the
+delete has committed, so a failed batch never leaves rows both archived and
+still in the table.
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import shutil
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_MODES = (None, "table", "ndjson")
+
+ProgressCallback = Callable[[dict], None]
+
+
+def _row_to_dict(n: models.Notification) -> dict:
+    return {
+        "id": n.id,
+        "user_id": n.user_id,
+        "type": n.type.value if n.type is not None else None,
+        "title": n.title,
+        "message": n.message,
+        "data": n.data,
+        "is_read": n.is_read,
+        "created_at": n.created_at.isoformat() if n.created_at else None,
+    }
+
+
+def _ndjson(rows: list[dict]) -> bytes:
+    return "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in rows).encode("utf-8")
+
+
+def _archive_path(archive_dir: str, started: datetime) -> str:
+    os.makedirs(archive_dir, exist_ok=True)
+    return os.path.join(archive_dir, f"notifications-{started.strftime('%Y%m%d%H%M%S')}.ndjson.gz")
+
+
+def _append_part(part: str, path: str) -> None:
+    # Gzip members concatenate, so the archive reads as one continuous stream
+    with open(part, "rb") as src, open(path, "ab") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(part)
+
+
+def _discard_part(part: Optional[str]) -> None:
+    if part and os.path.exists(part):
+        os.remove(part)
+
+
+def purge_notifications(
+    db: Session,
+    days_old: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    pause_seconds: Optional[float] = None,
+    archive: Optional[str] = None,
+    archive_dir: Optional[str] = None,
+    on_progress: Optional[ProgressCallback] = None,
+) -> dict:
+    """
+    Delete (and optionally archive) notifications older than ``days_old`` days.
+
+    Rows are processed in keyset batches of ``batch_size`` ids (the next ids
+    above the last one processed); every batch is its own transaction. Returns a summary with the number of rows removed, batches run
+    and the archive destination, if any.
+    """
+    if archive not in ARCHIVE_MODES:
+        raise ValueError(f"archive must be one of {ARCHIVE_MODES}")
+    days_old = settings.NOTIFICATION_RETENTION_DAYS if days_old is None else days_old
+    batch_size = max(1, batch_size or settings.RETENTION_BATCH_SIZE)
+    pause_seconds = settings.RETENTION_PAUSE_SECONDS if pause_seconds is None else pause_seconds
+
+    started = datetime.now(timezone.utc)
+    cutoff = started - timedelta(days=days_old)
+    lo, hi = db.query(func.min(models.Notification.id), func.max(models.Notification.id)).filter(
+        models.Notification.created_at < cutoff
+    ).one()
+
+    summary = {
+        "cutoff": cutoff.isoformat(),
+        "deleted": 0,
+        "batches": 0,
+        "archive": archive,
+        "archive_path": None,
+        "first_id": lo,
+        "last_id": hi,
+    }
+    if lo is None:
+        return summary
+
+    path = None
+    if archive == "ndjson":
+        path = _archive_path(archive_dir or settings.ARCHIVE_DIR, started)
+        summary["archive_path"] = path
+
+    N = models.Notification
+    cursor = lo
+    while True:
+        # Keyset batch: the next batch_size expired ids, however sparse the id range is
+        ids = [
+            nid for (nid,) in db.query(N.id)
+            .filter(N.id >= cursor, N.created_at < cutoff)
+            .order_by(N.id.asc())
+            .limit(batch_size)
+        ]
+        if not ids:
+            break
+        in_batch = N.id.in_(ids)
+        part = None
+        try:
+            if archive:
+                rows = db.query(N).filter(in_batch).order_by(N.id.asc()).all()
+                if rows:
+                    payload = [_row_to_dict(r) for r in rows]
+                    if archive == "table":
+                        db.add(models.NotificationArchive(
+                            first_notification_id=rows[0].id,
+                            last_notification_id=rows[-1].id,
+                            row_count=len(rows),
+                            payload=zlib.compress(_ndjson(payload)),
+                        ))
+                    else:
+                        part = f"{path}.part"
+                        with gzip.open(part, "wb") as fh:
+                            fh.write(_ndjson(payload))
+            deleted = db.query(N).filter(in_batch).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            _discard_part(part)
+            logger.exception(f"Notification purge failed in batch [{ids[0]}, {ids[-1]}]")
+            raise
+        if part:
+            _append_part(part, path)
+
+        summary["batches"] += 1
+        summary["deleted"] += deleted
+        progress = {
+            "batch": summary["batches"],
+            "deleted": summary["deleted"],
+            "through_id": ids[-1],
+            "percent": round(min(1.0, (ids[-1] - lo + 1) / (hi - lo + 1)) * 100, 1),
+        }
+        logger.info(
+            f"Notification purge batch {progress['batch']}: {deleted} rows "
+            f"(total {progress['deleted']}, {progress['percent']}%)"
+        )
+        if on_progress:
+            on_progress(progress)
+
+        cursor = ids[-1] + 1
+        if len(ids) < batch_size:
+            break  # that was the tail
+        if pause_seconds:
+            time.sleep(pause_seconds)
+
+    return summary
+
+
+def read_archive(archive: models.NotificationArchive) -> list[dict]:
+    """Decode one archived batch back into notification dicts."""
+    raw = zlib.decompress(archive.payload).decode("utf-8")
+    return [json.loads(line) for line in raw.splitlines() if line]
+
+
+def read_archive_file(path: str) -> list[dict]:
+    """Decode an NDJSON.gz archive written by ``purge_notifications``."""
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Purge old notifications in bounded batches.")
+    parser.add_argument("--days", type=int, default=None, help="retention period in days")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--pause", type=float, default=None, help="seconds to sleep between batches")
+    parser.add_argument("--archive", choices=["table", "ndjson"], default=None)
+    parser.add_argument("--archive-dir", default=None)
+    args = parser.parse_args(argv)
+
+    from .db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        summary = purge_notifications(
+            db,
+            days_old=args.days,
+            batch_size=args.batch_size,
+            pause_seconds=args.pause,
+            archive=args.archive,
+            archive_dir=args.archive_dir,
+            on_progress=lambda p: print(f"batch {p['batch']}: {p['deleted']} deleted ({p['percent']}%)"),
+        )
+        print(json.dumps(summary))
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -7,6 +7,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
 from .. import models
+from ..analytics_service import results_changed
 from ..db import get_db
 from ..auth import require_roles
 
@@ -159,6 +160,7 @@ def create_scale(payload: dict, _: Annotated[models.User, Guard], db: Session =
     except Exception:
         db.rollback()
         raise HTTPException(status_code=400, detail="duplicate grading scale")
+    results_changed()
     db.refresh(gs)
     return {"id": gs.id, "name": gs.name, "items_json": gs.items_json}
 
@@ -178,6 +180,7 @@ def update_scale(scale_id: int, payload: dict, _: Annotated[models.User, Guard],
     except Exception:
         db.rollback()
         raise HTTPException(status_code=400, detail="duplicate grading scale")
+    results_changed()
     db.refresh(gs)
     return {"id": gs.id, "name": gs.name, "items_json": gs.items_json}
 
@@ -189,3 +192,4 @@ def delete_scale(scale_id: int, _: Annotated[models.User, Guard], db: Session =
         return
     db.delete(gs)
     db.commit()
+    results_changed()
@@ -1,69 +1,90 @@
 from __future__ import annotations
 
 from typing import Annotated, Optional
+import json
+import math
+
 from fastapi import APIRouter, Depends, HTTPException, Response, Query
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from .. import models
+from .. import analytics_cube, models
+from ..analytics_service import ANALYTICS_CACHE, DEFAULT_PERCENTILES, RANK_METHODS, class_rankings, compute_term_grades, results_changed, score_distribution
+from ..cache import cached
 from ..db import get_db
 from ..auth import require_roles
 
 router = APIRouter(prefix="/analytics", tags=["analytics"]) 
 
 Guard = Depends(require_roles("Teacher", "Headmaster", "Director", "Dean", "Director of Studies", "Registrar/Secretary", "IT Support"))
+AdminGuard = Depends(require_roles("IT Support", "Headmaster"))
+
+
+def _subject_cells(db: Session, term: Optional[str], class_name: Optional[str]):
+    """Per-subject n/total/total_sq/passed/min/max summed from the analytics cube."""
+    cube = models.AnalyticsCube
+    q = db.query(
+        cube.subject.label("subject"),
+        func.sum(cube.result_count).label("n"),
+        func.sum(cube.score_sum).label("total"),
+        func.sum(cube.score_sum_sq).label("total_sq"),
+        func.sum(cube.pass_count).label("passed"),
+        func.min(cube.min_score).label("lo"),
+        func.max(cube.max_score).label("hi"),
+    ).filter(cube.result_count > 0)
+    if term:
+        q = q.filter(cube.term == term)
+    if class_name:
+        q = q.filter(cube.class_name == class_name)
+    return q.group_by(cube.subject).order_by(cube.subject).all()
 
 
+@cached(ANALYTICS_CACHE)
 def _class_report(db: Session, term: Optional[str], class_name: Optional[str]):
-    # Collect assessments by filters
-    q = db.query(models.Assessment)
-    if term:
-        q = q.filter(models.Assessment.term == term)
-    if class_name:
-        q = q.filter(models.Assessment.class_name == class_name)
-    assessments = q.all()
-
-    # Aggregate by subject and overall
-    overall_scores: list[float] = []
-    subject_scores: dict[str, list[float]] = {}
-    count_students = 0
-
-    for a in assessments:
-        rows = (
-            db.query(models.ExamResult)
-            .filter(models.ExamResult.assessment_id == a.id)
-            .all()
-        )
-        # Approx class size by number of rows if we have class filter
-        if class_name and rows:
-            count_students = max(count_students, len(rows))
-        for r in rows:
-            if r.score is None:
-                continue
-            overall_scores.append(float(r.score))
-            key = a.subject or "(none)"
-            subject_scores.setdefault(key, []).append(float(r.score))
-
-    def _avg(vals: list[float]) -> float:
-        return round(sum(vals) / len(vals), 1) if vals else 0.0
-
-    overall_avg = _avg(overall_scores)
-    pass_rate = round((sum(1 for v in overall_scores if v >= 50) / len(overall_scores)) * 100, 1) if overall_scores else 0.0
+    rows = _subject_cells(db, term, class_name)
+
+    def _avg(total, n) -> float:
+        return round(float(total) / n, 1) if n else 0.0
+
+    def _rate(passed, n) -> float:
+        return round((float(passed) / n) * 100, 1) if n else 0.0
+
+    def _std(total, total_sq, n) -> float:
+        if not n:
+            return 0.0
+        mean = float(total) / n
+        return round(math.sqrt(max(0.0, float(total_sq) / n - mean * mean)), 2)
+
+    def _opt(v) -> Optional[float]:
+        return round(float(v), 1) if v is not None else None
+
+    n_all = sum(int(r.n or 0) for r in rows)
+    total_all = sum(float(r.total or 0) for r in rows)
+    passed_all = sum(int(r.passed or 0) for r in rows)
+    count_students = (
+        db.query(func.count(models.Student.id)).filter(models.Student.class_name == class_name).scalar()
+        if class_name
+        else 0
+    )
 
     subjects = [
         {
-            "subject": s,
-            "average": _avg(vals),
-            "count": len(vals),
-            "pass_rate": round((sum(1 for v in vals if v >= 50) / len(vals)) * 100, 1) if vals else 0.0,
+            "subject": r.subject,
+            "average": _avg(r.total or 0, r.n),
+            "count": int(r.n or 0),
+            "pass_rate": _rate(r.passed or 0, r.n),
+            "min": _opt(r.lo),
+            "max": _opt(r.hi),
+            "std_dev": _std(r.total or 0, r.total_sq or 0, r.n),
         }
-        for s, vals in sorted(subject_scores.items())
+        for r in rows
     ]
 
     return {
         "term": term,
         "class_name": class_name,
-        "overall_average": overall_avg,
-        "overall_pass_rate": pass_rate,
+        "overall_average": _avg(total_all, n_all),
+        "overall_pass_rate": _rate(passed_all, n_all),
         "approx_class_size": count_students or None,
         "subjects": subjects,
     }
@@ -111,3 +132,99 @@ def class_report_export(
         csv = "\n".join(lines)
         return Response(content=csv, media_type="text/csv")
     raise HTTPException(status_code=400, detail="unsupported format")
+
+
+@router.get("/term-grades")
+def term_grades(
+    _: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+    term: Optional[str] = Query(None),
+    class_name: Optional[str] = Query(None),
+    subject: Optional[str] = Query(None),
+    scale: Optional[str] = Query(None, description="GradingScale name; defaults to the configured scale"),
+):
+    return compute_term_grades(db, term, class_name, subject=subject, scale_name=scale)
+
+
+@router.get("/rankings")
+def rankings(
+    _: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+    term: Optional[str] = Query(None),
+    class_name: Optional[str] = Query(None),
+    method: str = Query("competition", description="competition (1,2,2,4) or dense (1,2,2,3)"),
+):
+    if method not in RANK_METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(RANK_METHODS)}")
+    return class_rankings(db, term, class_name, method)
+
+
+def _parse_percentiles(value: Optional[str]) -> tuple:
+    if not value:
+        return DEFAULT_PERCENTILES
+    try:
+        out = tuple(float(p) for p in value.split(",") if p.strip())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="percentiles must be comma-separated numbers")
+    if not out or any(p < 0 or p > 100 for p in out):
+        raise HTTPException(status_code=400, detail="percentiles must be between 0 and 100")
+    return out
+
+
+@router.get("/distribution")
+def distribution(
+    _: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+    term: Optional[str] = Query(None),
+    class_name: Optional[str] = Query(None),
+    bins: int = Query(10, ge=1, le=100),
+    percentiles: Optional[str] = Query(None, description="comma-separated, e.g. 10,25,50,75,90"),
+):
+    return score_distribution(db, term, class_name, bins=bins, percentiles=_parse_percentiles(percentiles))
+
+
+@router.get("/distribution/export")
+def distribution_export(
+    _: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+    term: Optional[str] = Query(None),
+    class_name: Optional[str] = Query(None),
+    bins: int = Query(10, ge=1, le=100),
+    percentiles: Optional[str] = Query(None),
+    format: str = Query("csv"),
+):
+    data = score_distribution(db, term, class_name, bins=bins, percentiles=_parse_percentiles(percentiles))
+    filename = f"score-distribution-{term or 'all'}-{class_name or 'all'}"
+    if format.lower() == "json":
+        return Response(
+            content=json.dumps(data),
+            media_type="application/json",
+            headers={"Content-Disposition": f"attachment; filename={filename}.json"},
+        )
+    if format.lower() == "csv":
+        edges = data["bin_edges"]
+        lines: list[str] = ["subject,kind,label,value"]
+        for s in [{"subject": "(overall)", **data["overall"]}] + data["subjects"]:
+            for metric in ("count", "mean", "min", "max"):
+                lines.append(f"{s['subject']},summary,{metric},{'' if s[metric] is None else s[metric]}")
+            for label, value in s["percentiles"].items():
+                lines.append(f"{s['subject']},percentile,{label},{'' if value is None else value}")
+            for i, n in enumerate(s["histogram"]):
+                lines.append(f"{s['subject']},histogram,{edges[i]:g}-{edges[i + 1]:g},{n}")
+        return Response(
+            content="\n".join(lines),
+            media_type="text/csv",
+            headers={"Content-Disposition": f"attachment; filename={filename}.csv"},
+        )
+    raise HTTPException(status_code=400, detail="unsupported format")
+
+
+@router.post("/cube/rebuild")
+def rebuild_cube(
+    _: Annotated[models.User, AdminGuard],
+    db: Session = Depends(get_db),
+    term: Optional[str] = Query(None, description="only rebuild this term"),
+):
+    cells = analytics_cube.rebuild(db, term)
+    results_changed()
+    return {"term": term, "cells": cells}
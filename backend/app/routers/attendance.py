@@ -1,14 +1,21 @@
 from __future__ import annotations
 
-from datetime import date
+import calendar
+import logging
+from datetime import date, timedelta
 from typing import Annotated, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import case, func
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
 
-from .. import models
-from ..db import get_db
+from .. import absence_monitor, attendance_bitmap, models, period_attendance
+from ..bulk import upsert
+from ..cache import cached, invalidate
+from ..db import SessionLocal, get_db
+from ..export_service import XLSX_MEDIA_TYPE, stream_and_remove, write_attendance_register
+from ..settings import settings
 from ..auth import require_roles, get_current_user
 
 router = APIRouter(prefix="/attendance", tags=["attendance"]) 
@@ -16,6 +23,9 @@ router = APIRouter(prefix="/attendance", tags=["attendance"])
 Guard = Depends(require_roles("Teacher", "Headmaster", "Director", "Registrar/Secretary", "Secretary", "IT Support"))
 StudentGuard = Depends(require_roles("Student"))
 
+# Cache namespace for aggregates derived from attendance marks
+ATTENDANCE_CACHE = "attendance"
+
 
 def _parse_date(value: str | None) -> date:
     if not value:
@@ -34,24 +44,22 @@ def get_attendance(
     date_str: Optional[str] = Query(None, alias="date"),
 ):
     d = _parse_date(date_str)
-    # Get students, optionally filter by class
-    q = db.query(models.Student)
+    # Roster and that day's marks in one query; marks outside the class are never read
+    q = db.query(models.Student, models.Attendance).outerjoin(
+        models.Attendance,
+        (models.Attendance.student_id == models.Student.id) & (models.Attendance.date == d),
+    )
     if class_name:
         q = q.filter(models.Student.class_name == class_name)
-    students = q.order_by(models.Student.id.asc()).all()
-
-    # Get existing marks for that date
-    marks = db.query(models.Attendance).filter(models.Attendance.date == d).all()
-    mark_map = {m.student_id: m for m in marks}
+    rows = q.order_by(models.Student.id.asc()).all()
 
     out = []
-    for s in students:
-        m = mark_map.get(s.id)
+    for s, m in rows:
         out.append(
             {
                 "student_id": s.id,
-                "admission_no": s.admission_no,
-                "full_name": f"{s.first_name} {s.last_name}",
+                "admission_no": s.admission_number,
+                "full_name": s.full_name,
                 "class_name": s.class_name,
                 "status": (m.status if m else None),
                 "remarks": (m.remarks if m else None),
@@ -78,59 +86,176 @@ class MarkItem(BaseException):
     remarks: Optional[str]
 
 
+def _notify_attendance(d: date, marks: list[tuple[int, str]], parent_marks: Optional[list[tuple[int, str]]] = None) -> None:
+    """
+    Post-commit stage: notify parents (for ``parent_marks``, default the whole
+    register), then advance the absence counters with every mark.
+    """
+    db = SessionLocal()
+    try:
+        from ..notification_service import NotificationService
+        NotificationService(db).notify_attendance_marked_bulk(d, marks if parent_marks is None else parent_marks)
+    except Exception as e:
+        # Log error but never fail the register that triggered it
+        logging.error(f"Failed to send attendance update notifications: {str(e)}")
+    try:
+        from ..notification_service import NotificationService
+        alerts = absence_monitor.process_marks(db, d, marks)
+        if alerts:
+            NotificationService(db).notify_absence_alerts(alerts, settings.ABSENCE_ALERT_ROLES)
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Failed to update absence counters: {str(e)}")
+    finally:
+        db.close()
+
+
 @router.post("/mark")
 def mark_attendance(
     payload: dict,
     _: Annotated[models.User, Guard],
+    background: BackgroundTasks,
     db: Session = Depends(get_db),
 ):
     # Expect payload: { date: YYYY-MM-DD, items: [{student_id, status, remarks?}] }
     if not isinstance(payload, dict):
         raise HTTPException(status_code=400, detail="invalid payload")
     d = _parse_date(payload.get("date"))
-    items = payload.get("items") or []
+    rows = {sid: {**r, "date": d} for sid, r in _parse_mark_items(payload.get("items") or []).items()}
+
+    # Single set-based upsert on uq_attendance_student_date
+    upsert(
+        db,
+        models.Attendance,
+        list(rows.values()),
+        index_elements=["student_id", "date"],
+        update_columns=["status", "remarks"],
+        constraint="uq_attendance_student_date",
+    )
+    _commit_marks(db, d, [(r["student_id"], r["status"]) for r in rows.values()], background)
+
+    return {"ok": True, "count": len(rows)}
+
+
+def _commit_marks(
+    db: Session,
+    d: date,
+    marks: list[tuple[int, str]],
+    background: BackgroundTasks,
+    parent_marks: Optional[list[tuple[int, str]]] = None,
+) -> None:
+    """Shared tail of the register writes: bitmaps, commit, cache, then post-commit notifications."""
+    attendance_bitmap.apply_marks(db, d, marks)
+    db.commit()
+    # Only ranges covering this day go stale; cached past ranges stay warm
+    invalidate(_day_scope(d))
+    if marks:
+        background.add_task(_notify_attendance, d, marks, parent_marks)
+
+
+def _parse_mark_items(items) -> dict[int, dict]:
     if not isinstance(items, list):
         raise HTTPException(status_code=400, detail="items must be a list")
-
     allowed = {"PRESENT", "LATE", "ABSENT"}
-    for it in items:
-        sid = it.get("student_id")
+    rows: dict[int, dict] = {}
+    for idx, it in enumerate(items):
+        if not isinstance(it, dict):
+            raise HTTPException(status_code=400, detail={"index": idx, "error": "item must be an object"})
         status = (it.get("status") or "").upper()
-        remarks = it.get("remarks")
+        try:
+            sid = int(it.get("student_id"))
+        except (TypeError, ValueError):
+            sid = None
         if not sid or status not in allowed:
-            raise HTTPException(status_code=400, detail="invalid mark item")
-        # upsert: try existing
-        m = (
-            db.query(models.Attendance)
-            .filter(and_(models.Attendance.student_id == sid, models.Attendance.date == d))
-            .first()
-        )
-        if m:
-            m.status = status
-            m.remarks = remarks
-            db.add(m)
-        else:
-            db.add(models.Attendance(student_id=sid, date=d, status=status, remarks=remarks))
-    
-    db.commit()
-    
-    # Send notifications to parents for attendance updates
+            raise HTTPException(status_code=400, detail={"index": idx, "error": "student_id and a status of PRESENT, LATE or ABSENT are required"})
+        # Last mark for a student wins; one statement cannot touch a row twice
+        rows[sid] = {"student_id": sid, "status": status, "remarks": it.get("remarks")}
+    return rows
+
+
+def _period_slot(db: Session, d: date, slot_id, period_index) -> tuple[models.TimetableSlot | None, int]:
+    if slot_id is not None:
+        try:
+            slot_id = int(slot_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="slot_id must be an integer")
+        slot = db.query(models.TimetableSlot).filter(models.TimetableSlot.id == slot_id).first()
+        if not slot:
+            raise HTTPException(status_code=404, detail="slot not found")
+        if (slot.day_of_week or "")[:3].lower() != d.strftime("%a").lower():
+            raise HTTPException(status_code=400, detail=f"slot is on {slot.day_of_week}, not {d.strftime('%a')}")
+        return slot, slot.period_index
     try:
-        from notification_service import NotificationService
-        notification_service = NotificationService(db)
-        
-        for it in items:
-            sid = it.get("student_id")
-            status = (it.get("status") or "").upper()
-            remarks = it.get("remarks")
-            if sid and status:
-                notification_service.notify_attendance_updated(sid, d, status, remarks)
-    except Exception as e:
-        # Log error but don't fail the request
-        import logging
-        logging.error(f"Failed to send attendance update notifications: {str(e)}")
-    
-    return {"ok": True, "count": len(items)}
+        period_index = int(period_index)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="slot_id or period_index is required")
+    if period_index < 1:
+        raise HTTPException(status_code=400, detail="period_index must be 1 or more")
+    return None, period_index
+
+
+@router.get("/periods")
+def get_period_attendance(
+    _: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+    date_str: str = Query(..., alias="date"),
+    slot_id: int = Query(...),
+):
+    """One lesson's register: the slot's class roster with any period marks for that date."""
+    d = _parse_date(date_str)
+    slot, period_index = _period_slot(db, d, slot_id, None)
+    PA = models.PeriodAttendance
+    rows = (
+        db.query(models.Student, PA)
+        .outerjoin(PA, (PA.student_id == models.Student.id) & (PA.date == d) & (PA.period_index == period_index))
+        .filter(models.Student.class_name == slot.class_name)
+        .order_by(models.Student.id.asc())
+        .all()
+    )
+    return {
+        "date": d.isoformat(),
+        "slot_id": slot.id,
+        "period_index": period_index,
+        "class_name": slot.class_name,
+        "subject": slot.subject,
+        "items": [
+            {
+                "student_id": s.id,
+                "admission_no": s.admission_number,
+                "full_name": s.full_name,
+                "status": (m.status if m else None),
+                "remarks": (m.remarks if m else None),
+            }
+            for s, m in rows
+        ],
+    }
+
+
+@router.post("/periods/mark")
+def mark_period_attendance(
+    payload: dict,
+    _: Annotated[models.User, Guard],
+    background: BackgroundTasks,
+    db: Session = Depends(get_db),
+):
+    # Expect payload: { date, slot_id | period_index, items: [{student_id, status, remarks?}] }
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="invalid payload")
+    d = _parse_date(payload.get("date"))
+    slot, period_index = _period_slot(db, d, payload.get("slot_id"), payload.get("period_index"))
+    rows = _parse_mark_items(payload.get("items") or [])
+
+    period_attendance.mark_periods(db, d, [
+        {**r, "period_index": period_index, "slot_id": slot.id if slot else None} for r in rows.values()
+    ])
+    # Daily rows follow from the period marks in one set-based statement
+    changed = period_attendance.rollup_daily(db, d, rows)
+    # Bitmaps and counters take every change; parents only the day's first absence or lateness
+    _commit_marks(
+        db, d, [(sid, status) for sid, _, status in changed], background, period_attendance.first_concerns(changed)
+    )
+
+    return {"ok": True, "count": len(rows), "daily_changed": len(changed)}
 
 
 def _current_student_id(db: Session, user: models.User) -> int | None:
@@ -164,3 +289,233 @@ def my_attendance(
         for r in rows
     ]
     return {"items": out}
+
+
+STATS_DIMENSIONS = ("student", "class", "month")
+
+
+def _month_col(db: Session):
+    if db.get_bind().dialect.name == "postgresql":
+        return func.to_char(models.Attendance.date, "YYYY-MM")
+    return func.strftime("%Y-%m", models.Attendance.date)
+
+
+def _day_scope(d: date) -> str:
+    return f"{ATTENDANCE_CACHE}:{d.isoformat()}"
+
+
+def _stats_days(args: dict) -> list[str]:
+    start, end = args["start"], args["end"]
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+
+@cached(ATTENDANCE_CACHE, scopes=_stats_days)
+def _attendance_stats(
+    db: Session,
+    start: date,
+    end: date,
+    group_by: tuple,
+    class_name: Optional[str] = None,
+) -> dict:
+    """Present/late/absent counts and rates over [start, end] in one grouped query."""
+    dims = {
+        "student": models.Attendance.student_id.label("student_id"),
+        "class": models.Student.class_name.label("class_name"),
+        "month": _month_col(db).label("month"),
+    }
+    keys = [dims[g] for g in group_by]
+    status = func.upper(models.Attendance.status)
+    q = (
+        db.query(
+            *keys,
+            func.count(models.Attendance.id).label("total"),
+            func.sum(case((status == "PRESENT", 1), else_=0)).label("present"),
+            func.sum(case((status == "LATE", 1), else_=0)).label("late"),
+            func.sum(case((status == "ABSENT", 1), else_=0)).label("absent"),
+        )
+        .join(models.Student, models.Student.id == models.Attendance.student_id)
+        .filter(models.Attendance.date >= start, models.Attendance.date <= end)
+    )
+    if class_name:
+        q = q.filter(models.Student.class_name == class_name)
+    if keys:
+        q = q.group_by(*keys).order_by(*keys)
+
+    def _rate(n, total) -> float:
+        return round(float(n) * 100 / total, 1) if total else 0.0
+
+    items = []
+    for r in q.all():
+        m = r._mapping
+        total = int(m["total"] or 0)
+        present, late, absent = int(m["present"] or 0), int(m["late"] or 0), int(m["absent"] or 0)
+        items.append({
+            **{k.key: m[k.key] for k in keys},
+            "total": total,
+            "present": present,
+            "late": late,
+            "absent": absent,
+            "present_rate": _rate(present, total),
+            "late_rate": _rate(late, total),
+            "absent_rate": _rate(absent, total),
+            "attendance_rate": _rate(present + late, total),
+        })
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "class_name": class_name,
+        "group_by": list(group_by),
+        "items": items,
+    }
+
+
+@router.get("/stats")
+def attendance_stats(
+    _: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+    start: str = Query(..., description="YYYY-MM-DD"),
+    end: str = Query(..., description="YYYY-MM-DD"),
+    group_by: str = Query("student", description="comma-separated: student, class, month"),
+    class_name: Optional[str] = Query(None),
+    format: str = Query("json"),
+):
+    d_start, d_end = _parse_date(start), _parse_date(end)
+    if d_end < d_start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    dims = tuple(dict.fromkeys(g.strip().lower() for g in group_by.split(",") if g.strip()))
+    if any(g not in STATS_DIMENSIONS for g in dims):
+        raise HTTPException(status_code=400, detail=f"group_by must be drawn from {', '.join(STATS_DIMENSIONS)}")
+    data = _attendance_stats(db, d_start, d_end, dims, class_name)
+    if format.lower() == "json":
+        return data
+    if format.lower() != "csv":
+        raise HTTPException(status_code=400, detail="unsupported format")
+    key_cols = [{"student": "student_id", "class": "class_name", "month": "month"}[g] for g in dims]
+    cols = key_cols + ["total", "present", "late", "absent", "present_rate", "late_rate", "absent_rate", "attendance_rate"]
+    lines = [",".join(cols)]
+    for item in data["items"]:
+        lines.append(",".join("" if item[c] is None else str(item[c]) for c in cols))
+    filename = f"attendance-stats-{d_start.isoformat()}-{d_end.isoformat()}.csv"
+    return Response(content="\n".join(lines), media_type="text/csv", headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
+# One register character per status; "." means not marked
+STATUS_CHARS = {"PRESENT": "P", "LATE": "L", "ABSENT": "A"}
+
+
+def _parse_month(value: str) -> tuple[date, date]:
+    try:
+        year, month = (int(p) for p in value.split("-"))
+        first = date(year, month, 1)
+    except Exception:
+        raise HTTPException(status_code=400, detail="invalid month; expected YYYY-MM")
+    return first, first.replace(day=calendar.monthrange(year, month)[1])
+
+
+@router.get("/register")
+def attendance_register(
+    _: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+    class_name: str = Query(...),
+    month: str = Query(..., description="YYYY-MM"),
+    format: str = Query("json"),
+):
+    """A month's register for one class: roster plus one status character per day."""
+    first, last = _parse_month(month)
+    days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+    students = (
+        db.query(models.Student)
+        .filter(models.Student.class_name == class_name)
+        .order_by(models.Student.id.asc())
+        .all()
+    )
+    marks = (
+        db.query(models.Attendance.student_id, models.Attendance.date, models.Attendance.status)
+        .join(models.Student, models.Student.id == models.Attendance.student_id)
+        .filter(models.Student.class_name == class_name)
+        .filter(models.Attendance.date >= first, models.Attendance.date <= last)
+        .all()
+    )
+    grid = {s.id: ["."] * len(days) for s in students}
+    for sid, day, status in marks:
+        row = grid.get(sid)
+        if row is not None:
+            row[(day - first).days] = STATUS_CHARS.get((status or "").upper(), "?")
+    items = [
+        {
+            "student_id": s.id,
+            "admission_no": s.admission_number,
+            "full_name": s.full_name,
+            "marks": "".join(grid[s.id]),
+        }
+        for s in students
+    ]
+    if format.lower() == "xlsx":
+        path = write_attendance_register(f"{class_name} {month}", days, items)
+        filename = f"attendance-register-{class_name}-{month}.xlsx"
+        return StreamingResponse(
+            stream_and_remove(path),
+            media_type=XLSX_MEDIA_TYPE,
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+        )
+    if format.lower() != "json":
+        raise HTTPException(status_code=400, detail="unsupported format")
+    return {
+        "class_name": class_name,
+        "month": first.strftime("%Y-%m"),
+        "start": first.isoformat(),
+        "end": last.isoformat(),
+        # ISO weekday per column (1 = Monday) so clients can shade weekends
+        "weekdays": "".join(str(d.isoweekday()) for d in days),
+        "legend": {v: k for k, v in STATUS_CHARS.items()} | {".": None},
+        "items": items,
+    }
+
+
+@router.get("/term-stats")
+def attendance_term_stats(
+    _: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+    term_id: int = Query(...),
+    class_name: Optional[str] = Query(None),
+    student_id: Optional[int] = Query(None),
+):
+    """Term rates, absence streaks and weekday patterns per student, read from the attendance bitmaps."""
+    term = db.query(models.Term).filter(models.Term.id == term_id).first()
+    if not term:
+        raise HTTPException(status_code=404, detail="term not found")
+    return {
+        "term_id": term.id,
+        "term": term.name,
+        "class_name": class_name,
+        "items": attendance_bitmap.term_stats(db, term.id, class_name=class_name, student_id=student_id),
+    }
+
+
+@router.get("/at-risk")
+def attendance_at_risk(
+    _: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+    class_name: Optional[str] = Query(None),
+):
+    """Students currently over an absence threshold, from the rolling absence counters."""
+    q = db.query(models.AbsenceCounter, models.Student).join(
+        models.Student, models.Student.id == models.AbsenceCounter.student_id
+    ).filter(models.AbsenceCounter.rate_alerted.is_(True) | models.AbsenceCounter.streak_alerted.is_(True))
+    if class_name:
+        q = q.filter(models.Student.class_name == class_name)
+    items = [
+        {
+            "student_id": st.id,
+            "admission_no": st.admission_number,
+            "full_name": st.full_name,
+            "class_name": st.class_name,
+            "as_of": c.window_end.isoformat() if c.window_end else None,
+            "absence_rate": absence_monitor.absence_rate(c),
+            "consecutive_absences": c.consecutive_absences,
+            "chronic": bool(c.rate_alerted),
+            "consecutive": bool(c.streak_alerted),
+        }
+        for c, st in q.order_by(models.Student.class_name, models.Student.id).all()
+    ]
+    return {"window_days": absence_monitor.window_days(), "items": items}
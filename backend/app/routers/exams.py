@@ -1,14 +1,20 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import logging
 from datetime import date
 from typing import Annotated, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
 
-from .. import models
-from ..db import get_db
+from .. import analytics_cube, models
+from ..analytics_service import results_changed
+from ..bulk import upsert
+from ..db import SessionLocal, get_db
+from ..export_service import XLSX_MEDIA_TYPE, read_mark_sheets, stream_and_remove, write_mark_sheets
 from ..auth import require_roles
 
 router = APIRouter(prefix="/exams", tags=["exams"]) 
@@ -42,7 +48,7 @@ def list_assessments(
         q = q.filter(models.Assessment.subject == subject)
 
     # If Teacher, limit to their assignments (class_name+subject)
-    if any(r.name == "Teacher" or r == "Teacher" for r in getattr(user, "roles", []) or []):
+    if _is_teacher(user):
         # Map teacher by email to Teacher entity
         t = db.query(models.Teacher).filter(models.Teacher.email == user.email).first()
         if t:
@@ -122,9 +128,40 @@ def delete_assessment(
     if not a:
         return
     # Also delete results for this assessment
+    analytics_cube.remove_assessment(db, a)
     db.query(models.ExamResult).filter(models.ExamResult.assessment_id == assessment_id).delete()
     db.delete(a)
     db.commit()
+    results_changed()
+
+
+def _is_teacher(user: models.User) -> bool:
+    return any(r.name == "Teacher" or r == "Teacher" for r in getattr(user, "roles", []) or [])
+
+
+def _assigned_pairs(db: Session, user: models.User) -> set[tuple[str, str]] | None:
+    """(class_name, subject) pairs a teacher may access; None when unrestricted."""
+    if not _is_teacher(user):
+        return None
+    t = db.query(models.Teacher).filter(models.Teacher.email == user.email).first()
+    if not t:
+        return set()
+    return {
+        (ta.class_name, ta.subject)
+        for ta in db.query(models.TeacherAssignment).filter(models.TeacherAssignment.teacher_id == t.id).all()
+    }
+
+
+def _ensure_assigned(db: Session, user: models.User, assessments: list[models.Assessment]) -> None:
+    """Teachers may only touch assessments for their own class/subject assignments."""
+    allowed = _assigned_pairs(db, user)
+    if allowed is None:
+        return
+    if not allowed:
+        raise HTTPException(status_code=403, detail="not assigned")
+    for a in assessments:
+        if ((a.class_name or ""), (a.subject or "")) not in allowed:
+            raise HTTPException(status_code=403, detail="not assigned")
 
 
 @router.get("/results")
@@ -138,21 +175,7 @@ def list_results(
         raise HTTPException(status_code=404, detail="assessment not found")
 
     # If Teacher, ensure assessment is in their assignments
-    if any(r.name == "Teacher" or r == "Teacher" for r in getattr(user, "roles", []) or []):
-        t = db.query(models.Teacher).filter(models.Teacher.email == user.email).first()
-        if not t:
-            raise HTTPException(status_code=403, detail="not assigned")
-        ok = (
-            db.query(models.TeacherAssignment)
-            .filter(
-                (models.TeacherAssignment.teacher_id == t.id)
-                & (models.TeacherAssignment.class_name == (a.class_name or ""))
-                & (models.TeacherAssignment.subject == (a.subject or ""))
-            )
-            .first()
-        )
-        if not ok:
-            raise HTTPException(status_code=403, detail="not assigned")
+    _ensure_assigned(db, user, [a])
 
     # join to students in same class if provided, else all students
     q = db.query(models.Student)
@@ -168,8 +191,8 @@ def list_results(
         r = rmap.get(s.id)
         out.append({
             "student_id": s.id,
-            "admission_no": s.admission_no,
-            "full_name": f"{s.first_name} {s.last_name}",
+            "admission_no": s.admission_number,
+            "full_name": s.full_name,
             "score": (r.score if r else None),
         })
     return {"assessment": {
@@ -183,10 +206,100 @@ def list_results(
     }, "items": out}
 
 
+def _validate_result_items(items: list) -> list[dict]:
+    """Validate every item up front; returns de-duplicated rows (last item wins)."""
+    errors = []
+    rows: dict[int, dict] = {}
+    for idx, it in enumerate(items):
+        if not isinstance(it, dict):
+            errors.append({"index": idx, "error": "item must be an object"})
+            continue
+        sid = it.get("student_id")
+        score = it.get("score")
+        try:
+            sid = int(sid)
+            score = float(score)
+        except (TypeError, ValueError):
+            errors.append({"index": idx, "student_id": it.get("student_id"), "error": "student_id and numeric score are required"})
+            continue
+        if score < 0:
+            errors.append({"index": idx, "student_id": sid, "error": "score must not be negative"})
+            continue
+        rows[sid] = {"student_id": sid, "score": score}
+    if errors:
+        raise HTTPException(status_code=400, detail={"message": "invalid items", "errors": errors})
+    return list(rows.values())
+
+
+def _check_roster(db: Session, assessments: dict[int, models.Assessment], rows: list[dict]) -> None:
+    """400 unless every row's student exists and sits in its assessment's class (one query)."""
+    sids = {r["student_id"] for r in rows}
+    classes = dict(db.query(models.Student.id, models.Student.class_name).filter(models.Student.id.in_(sids)).all())
+    offending = sorted({
+        r["student_id"]
+        for r in rows
+        if r["student_id"] not in classes
+        or (assessments[r["assessment_id"]].class_name and classes[r["student_id"]] != assessments[r["assessment_id"]].class_name)
+    })
+    if offending:
+        raise HTTPException(status_code=400, detail={"message": "students not on the class roster", "student_ids": offending})
+
+
+def _upsert_result_rows(db: Session, rows: list[dict]) -> dict[tuple[int, int], str]:
+    """
+    Write ``rows`` ({assessment_id, student_id, score}) with one set-based upsert
+    on uq_results_assessment_student. Returns "inserted"/"updated" per key.
+    Does not commit.
+    """
+    if not rows:
+        return {}
+    aids = {r["assessment_id"] for r in rows}
+    sids = {r["student_id"] for r in rows}
+    # Held to commit: a concurrent writer would otherwise subtract the same old scores
+    analytics_cube.lock_for_write(db, aids)
+    existing = {
+        (aid, sid): score
+        for aid, sid, score in db.query(models.ExamResult.assessment_id, models.ExamResult.student_id, models.ExamResult.score)
+        .filter(models.ExamResult.assessment_id.in_(aids), models.ExamResult.student_id.in_(sids))
+        .all()
+    }
+    upsert(
+        db,
+        models.ExamResult,
+        rows,
+        index_elements=["assessment_id", "student_id"],
+        update_columns=["score"],
+        constraint="uq_results_assessment_student",
+    )
+    analytics_cube.apply_result_changes(
+        db,
+        ((r["assessment_id"], existing.get((r["assessment_id"], r["student_id"])), r["score"]) for r in rows),
+    )
+    return {
+        (r["assessment_id"], r["student_id"]): ("updated" if (r["assessment_id"], r["student_id"]) in existing else "inserted")
+        for r in rows
+    }
+
+
+def _notify_grades(assessment_name: str, scores: list[tuple[int, float]]) -> None:
+    db = SessionLocal()
+    try:
+        from ..notification_service import NotificationService
+        notification_service = NotificationService(db)
+        for sid, score in scores:
+            notification_service.notify_grade_updated(sid, assessment_name, score)
+    except Exception as e:
+        # Log error but never fail the write that triggered it
+        logging.error(f"Failed to send grade update notifications: {str(e)}")
+    finally:
+        db.close()
+
+
 @router.post("/results", status_code=200)
 def upsert_results(
     payload: dict,
     _: Annotated[models.User, Guard],
+    background: BackgroundTasks,
     db: Session = Depends(get_db),
 ):
     # payload: { assessment_id, items: [{student_id, score}] }
@@ -198,41 +311,213 @@ def upsert_results(
     if not isinstance(items, list):
         raise HTTPException(status_code=400, detail="items must be a list")
 
-    # Get assessment details for notifications
     assessment = db.query(models.Assessment).filter(models.Assessment.id == aid).first()
-    assessment_name = assessment.name if assessment else "Assessment"
+    if not assessment:
+        raise HTTPException(status_code=404, detail="assessment not found")
 
-    for it in items:
-        sid = it.get("student_id")
-        score = it.get("score")
-        if sid is None or score is None:
-            raise HTTPException(status_code=400, detail="invalid item")
-        existing = (
-            db.query(models.ExamResult)
-            .filter(and_(models.ExamResult.assessment_id == aid, models.ExamResult.student_id == sid))
-            .first()
-        )
-        if existing:
-            existing.score = float(score)
-            db.add(existing)
-        else:
-            db.add(models.ExamResult(assessment_id=aid, student_id=sid, score=float(score)))
-    
+    rows = [{"assessment_id": aid, **r} for r in _validate_result_items(items)]
+    _check_roster(db, {aid: assessment}, rows)
+    outcomes = _upsert_result_rows(db, rows)
     db.commit()
-    
-    # Send notifications to parents for grade updates
+    results_changed()
+
+    # Notify parents after the response has been sent
+    background.add_task(_notify_grades, assessment.name, [(r["student_id"], r["score"]) for r in rows])
+
+    results = [
+        {"student_id": r["student_id"], "score": r["score"], "outcome": outcomes[(aid, r["student_id"])]}
+        for r in rows
+    ]
+    return {
+        "ok": True,
+        "count": len(results),
+        "inserted": sum(1 for r in results if r["outcome"] == "inserted"),
+        "updated": sum(1 for r in results if r["outcome"] == "updated"),
+        "items": results,
+    }
+
+
+def _roster(db: Session, class_name: Optional[str]):
+    q = db.query(models.Student)
+    if class_name:
+        q = q.filter(models.Student.class_name == class_name)
+    return q.order_by(models.Student.id.asc())
+
+
+@router.get("/assessments/{assessment_id}/sheet.xlsx")
+def download_mark_sheet(
+    assessment_id: int,
+    user: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+):
+    a = db.query(models.Assessment).filter(models.Assessment.id == assessment_id).first()
+    if not a:
+        raise HTTPException(status_code=404, detail="assessment not found")
+    _ensure_assigned(db, user, [a])
+
+    scores = dict(
+        db.query(models.ExamResult.student_id, models.ExamResult.score)
+        .filter(models.ExamResult.assessment_id == assessment_id)
+        .all()
+    )
+    rows = (
+        (s.id, s.admission_number, s.full_name, scores.get(s.id))
+        for s in _roster(db, a.class_name).yield_per(1000)
+    )
+    meta = {"id": a.id, "name": a.name, "class_name": a.class_name, "subject": a.subject, "term": a.term}
     try:
-        from notification_service import NotificationService
-        notification_service = NotificationService(db)
-        
-        for it in items:
-            sid = it.get("student_id")
-            score = it.get("score")
-            if sid and score is not None:
-                notification_service.notify_grade_updated(sid, assessment_name, float(score))
-    except Exception as e:
-        # Log error but don't fail the request
-        import logging
-        logging.error(f"Failed to send grade update notifications: {str(e)}")
-    
-    return {"ok": True, "count": len(items)}
+        path = write_mark_sheets([(meta, rows)])
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    filename = f"marks-{a.class_name or 'all'}-{a.subject or 'all'}-{a.id}.xlsx"
+    return StreamingResponse(
+        stream_and_remove(path),
+        media_type=XLSX_MEDIA_TYPE,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
+def _import_mark_sheets(db: Session, user: models.User, file: UploadFile, default_assessment_id: Optional[int], background: BackgroundTasks):
+    try:
+        rows, errors = read_mark_sheets(file.file, default_assessment_id=default_assessment_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if errors:
+        raise HTTPException(status_code=400, detail={"message": "invalid sheet", "errors": errors})
+    if not rows:
+        return {"ok": True, "count": 0, "inserted": 0, "updated": 0, "assessments": []}
+
+    aids = {r["assessment_id"] for r in rows}
+    assessments = {a.id: a for a in db.query(models.Assessment).filter(models.Assessment.id.in_(aids)).all()}
+    missing = sorted(aids - set(assessments))
+    if missing:
+        raise HTTPException(status_code=404, detail={"message": "assessment not found", "assessment_ids": missing})
+    _ensure_assigned(db, user, list(assessments.values()))
+
+    # Last row wins per (assessment, student); the upsert cannot touch a row twice
+    deduped = list({(r["assessment_id"], r["student_id"]): r for r in rows}.values())
+    _check_roster(db, assessments, deduped)
+    outcomes = _upsert_result_rows(db, deduped)
+    db.commit()
+    results_changed()
+
+    per_assessment: dict[int, dict] = {}
+    for r in deduped:
+        entry = per_assessment.setdefault(r["assessment_id"], {"assessment_id": r["assessment_id"], "inserted": 0, "updated": 0, "scores": []})
+        entry[outcomes[(r["assessment_id"], r["student_id"])]] += 1
+        entry["scores"].append((r["student_id"], r["score"]))
+    for aid, entry in per_assessment.items():
+        background.add_task(_notify_grades, assessments[aid].name, entry.pop("scores"))
+
+    return {
+        "ok": True,
+        "count": len(deduped),
+        "inserted": sum(e["inserted"] for e in per_assessment.values()),
+        "updated": sum(e["updated"] for e in per_assessment.values()),
+        "assessments": sorted(per_assessment.values(), key=lambda e: e["assessment_id"]),
+    }
+
+
+@router.post("/assessments/{assessment_id}/sheet.xlsx")
+def upload_mark_sheet(
+    assessment_id: int,
+    user: Annotated[models.User, Guard],
+    background: BackgroundTasks,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+):
+    return _import_mark_sheets(db, user, file, assessment_id, background)
+
+
+@router.post("/sheets")
+def upload_mark_sheets(
+    user: Annotated[models.User, Guard],
+    background: BackgroundTasks,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+):
+    """Import a workbook with one sheet per assessment (e.g. a whole grade)."""
+    return _import_mark_sheets(db, user, file, None, background)
+
+
+@router.get("/gradebook")
+def gradebook(
+    request: Request,
+    user: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+    class_name: str = Query(...),
+    term: Optional[str] = Query(None),
+    subject: Optional[str] = Query(None),
+):
+    """Students x assessments score matrix for a class, built from two queries."""
+    allowed = _assigned_pairs(db, user)
+    if allowed is not None and not any(c == class_name and (subject is None or sub == subject) for c, sub in allowed):
+        raise HTTPException(status_code=403, detail="not assigned")
+
+    students = _roster(db, class_name).all()
+
+    q = (
+        db.query(models.Assessment, models.ExamResult.student_id, models.ExamResult.score)
+        .outerjoin(models.ExamResult, models.ExamResult.assessment_id == models.Assessment.id)
+        .filter(models.Assessment.class_name == class_name)
+    )
+    if term:
+        q = q.filter(models.Assessment.term == term)
+    if subject:
+        q = q.filter(models.Assessment.subject == subject)
+    q = q.order_by(models.Assessment.subject.asc(), models.Assessment.date.asc(), models.Assessment.id.asc())
+
+    # Pivot in memory: column per assessment, row per student
+    columns: dict[int, models.Assessment] = {}
+    cells: dict[tuple[int, int], float] = {}
+    for a, sid, score in q.all():
+        if allowed is not None and (a.class_name, a.subject) not in allowed:
+            continue
+        columns.setdefault(a.id, a)
+        if sid is not None and score is not None:
+            cells[(sid, a.id)] = float(score)
+    assessments = list(columns.values())
+
+    rows = []
+    for s in students:
+        scores = [cells.get((s.id, a.id)) for a in assessments]
+        weighted = 0.0
+        weight_sum = 0.0
+        for a, score in zip(assessments, scores):
+            if score is None:
+                continue
+            w = 1.0 if a.weight is None else float(a.weight)
+            weighted += w * (score / float(a.total_score or 100.0)) * 100.0
+            weight_sum += w
+        rows.append({
+            "student_id": s.id,
+            "admission_no": s.admission_number,
+            "full_name": s.full_name,
+            "scores": scores,
+            "completed": sum(1 for v in scores if v is not None),
+            "weighted_total": round(weighted / weight_sum, 2) if weight_sum else None,
+        })
+
+    body = {
+        "class_name": class_name,
+        "term": term,
+        "subject": subject,
+        "assessments": [
+            {
+                "id": a.id,
+                "name": a.name,
+                "term": a.term,
+                "subject": a.subject,
+                "weight": a.weight,
+                "total_score": a.total_score,
+                "date": a.date.isoformat() if a.date else None,
+            }
+            for a in assessments
+        ],
+        "rows": rows,
+    }
+    raw = json.dumps(body, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    etag = f'"{hashlib.sha1(raw).hexdigest()}"'
+    if etag in [t.strip() for t in (request.headers.get("if-none-match") or "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=raw, media_type="application/json", headers={"ETag": etag})
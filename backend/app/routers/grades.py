@@ -5,6 +5,7 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 
 from .. import models
+from ..analytics_service import load_scale, weighted_totals
 from ..db import get_db
 from ..auth import require_roles, get_current_user
 
@@ -70,13 +71,18 @@ def my_progress(
     if subject:
         q = q.filter(models.Assessment.subject == subject)
     rows = q.all()
-    # Aggregate by term
-    agg: dict[str, list[float]] = {}
-    for r, a in rows:
-        term = a.term or ""
-        agg.setdefault(term, []).append(r.score)
-    series = [
-        {"term": term, "average": (sum(scores) / len(scores) if scores else 0.0)}
-        for term, scores in sorted(agg.items())
-    ]
-    return {"series": series}
+    # Weighted subject totals per term, then the mean across subjects
+    totals = weighted_totals(
+        ((a.term or "", a.subject or ""), r.score, a.total_score, a.weight) for r, a in rows
+    )
+    by_term: dict[str, list[float]] = {}
+    for (term, _subject), total in totals.items():
+        if total is not None:
+            by_term.setdefault(term, []).append(total)
+    scale = load_scale(db)
+    series = []
+    for term, vals in sorted(by_term.items()):
+        average = sum(vals) / len(vals) if vals else 0.0
+        grade, points = scale.lookup(average)
+        series.append({"term": term, "average": round(average, 2), "grade": grade, "points": points})
+    return {"series": series, "scale": scale.name}
@@ -1,61 +1,86 @@
 from __future__ import annotations
 
 from typing import Annotated, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
 
-from .. import models
-from ..db import get_db
+from .. import models, report_card_jobs, transcripts
+from ..analytics_service import RANK_METHODS, class_rankings
+from ..db import SessionLocal, get_db
+from ..export_service import stream_and_remove
 from ..auth import require_roles, get_current_user
 
 router = APIRouter(prefix="/report-cards", tags=["report-cards"]) 
 
 Guard = Depends(require_roles("Teacher", "Headmaster", "Director", "Dean", "Director of Studies", "Registrar/Secretary", "IT Support", "Student"))
+StaffGuard = Depends(require_roles("Teacher", "Headmaster", "Director", "Dean", "Director of Studies", "Registrar/Secretary", "IT Support"))
 
 
-def _results_for_term(db: Session, term: Optional[str]):
-    q = db.query(models.Assessment)
+def _results_for_term(
+    db: Session,
+    term: Optional[str],
+    student_id: Optional[int] = None,
+    class_name: Optional[str] = None,
+):
+    """(student_id, assessment_id, subject, score) rows, filtered in SQL."""
+    q = (
+        db.query(
+            models.ExamResult.student_id,
+            models.ExamResult.assessment_id,
+            models.Assessment.subject,
+            models.ExamResult.score,
+        )
+        .join(models.Assessment, models.ExamResult.assessment_id == models.Assessment.id)
+    )
     if term:
         q = q.filter(models.Assessment.term == term)
-    assessments = q.all()
-    if not assessments:
-        return [], []
-    asses_ids = [a.id for a in assessments]
-    res = db.query(models.ExamResult).filter(models.ExamResult.assessment_id.in_(asses_ids)).all()
-    return assessments, res
+    if student_id is not None:
+        q = q.filter(models.ExamResult.student_id == student_id)
+    if class_name:
+        q = q.join(models.Student, models.Student.id == models.ExamResult.student_id).filter(
+            models.Student.class_name == class_name
+        )
+    return q.order_by(models.ExamResult.student_id, models.ExamResult.assessment_id)
+
+
+def _stream_csv(header: str, build_query, fmt, chunk_rows: int = 1000):
+    # Own session: the request session may be closed before the body is sent
+    db = SessionLocal()
+    try:
+        yield header + "\n"
+        buf: list[str] = []
+        for row in build_query(db).yield_per(chunk_rows):
+            buf.append(fmt(row))
+            if len(buf) >= chunk_rows:
+                yield "".join(buf)
+                buf.clear()
+        if buf:
+            yield "".join(buf)
+    finally:
+        db.close()
 
 
-def _students_by_class(db: Session, class_name: Optional[str]):
-    if not class_name:
-        return None
-    rows = db.query(models.Student).filter(models.Student.class_name == class_name).all()
-    return set(s.id for s in rows)
+def _score(value) -> str:
+    return "" if value is None else str(value)
 
 
 @router.get("/class")
 def class_report_cards_csv(
     _: Annotated[models.User, Guard],
-    db: Session = Depends(get_db),
     term: Optional[str] = Query(None),
     class_name: Optional[str] = Query(None),
 ):
-    assessments, results = _results_for_term(db, term)
-    if not assessments:
-        return Response(content="student_id,assessment_id,subject,score\n", media_type="text/csv")
-
-    student_filter = _students_by_class(db, class_name)
-
-    # Build CSV rows: student_id, assessment_id, subject, score
-    lines = ["student_id,assessment_id,subject,score"]
-    subj_map = {a.id: (a.subject or "") for a in assessments}
-    for r in results:
-        if student_filter is not None and r.student_id not in student_filter:
-            continue
-        score = "" if r.score is None else str(r.score)
-        lines.append(f"{r.student_id},{r.assessment_id},{subj_map.get(r.assessment_id,'')},{score}")
-    csv = "\n".join(lines)
     filename = f"class-report-cards-{term or 'all'}-{class_name or 'all'}.csv"
-    return Response(content=csv, media_type="text/csv", headers={"Content-Disposition": f"attachment; filename={filename}"})
+    return StreamingResponse(
+        _stream_csv(
+            "student_id,assessment_id,subject,score",
+            lambda db: _results_for_term(db, term, class_name=class_name),
+            lambda r: f"{r.student_id},{r.assessment_id},{r.subject or ''},{_score(r.score)}\n",
+        ),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
 
 
 def _current_student_id(db: Session, user: models.User) -> int | None:
@@ -78,18 +103,16 @@ def student_report_card_csv(
             raise HTTPException(status_code=403, detail="Student link not configured")
         # Force to own student_id regardless of provided value
         student_id = my_sid
-    assessments, results = _results_for_term(db, term)
-    if not assessments:
-        return Response(content="assessment_id,subject,score\n", media_type="text/csv")
-    by_student = [r for r in results if r.student_id == student_id]
-    subj_map = {a.id: (a.subject or "") for a in assessments}
-    lines = ["assessment_id,subject,score"]
-    for r in by_student:
-        score = "" if r.score is None else str(r.score)
-        lines.append(f"{r.assessment_id},{subj_map.get(r.assessment_id,'')},{score}")
-    csv = "\n".join(lines)
     filename = f"student-report-card-{student_id}-{term or 'all'}.csv"
-    return Response(content=csv, media_type="text/csv", headers={"Content-Disposition": f"attachment; filename={filename}"})
+    return StreamingResponse(
+        _stream_csv(
+            "assessment_id,subject,score",
+            lambda db: _results_for_term(db, term, student_id=student_id),
+            lambda r: f"{r.assessment_id},{r.subject or ''},{_score(r.score)}\n",
+        ),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
 
 
 @router.get("/my")
@@ -107,3 +130,161 @@ def my_report_card_csv(
         raise HTTPException(status_code=403, detail="Student link not configured")
     # Delegate to student-specific logic
     return student_report_card_csv(current_user, current_user, db, sid, term)
+
+
+@router.get("/positions")
+def report_card_positions(
+    current_user: Annotated[models.User, Depends(get_current_user)],
+    _: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+    class_name: str = Query(...),
+    term: Optional[str] = Query(None),
+    student_id: Optional[int] = Query(None),
+    method: str = Query("competition"),
+):
+    """Class and subject positions for report cards; students only see their own."""
+    if method not in RANK_METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(RANK_METHODS)}")
+    roles = {r.name for r in (current_user.roles or [])}
+    if "Student" in roles:
+        my_sid = _current_student_id(db, current_user)
+        if not my_sid:
+            raise HTTPException(status_code=403, detail="Student link not configured")
+        student_id = my_sid
+    data = class_rankings(db, term, class_name, method)
+    if student_id is None:
+        return data
+    row = next((s for s in data["students"] if s["student_id"] == student_id), None)
+    if row is None:
+        raise HTTPException(status_code=404, detail="no results for student")
+    return {
+        "term": term,
+        "class_name": class_name,
+        "method": method,
+        "out_of": data["out_of"],
+        "subjects": data["subjects"],
+        **row,
+    }
+
+
+@router.post("/batch", status_code=202)
+def start_report_card_batch(
+    payload: dict,
+    current_user: Annotated[models.User, StaffGuard],
+    background: BackgroundTasks,
+):
+    """Queue PDF report cards for a class (class_name) or every class in a grade (grade prefix)."""
+    class_name = (payload.get("class_name") or "").strip() or None
+    grade = (payload.get("grade") or "").strip() or None
+    if not class_name and not grade:
+        raise HTTPException(status_code=400, detail="class_name or grade is required")
+    job = report_card_jobs.start_job(payload.get("term"), class_name=class_name, grade=grade, requested_by=current_user.id)
+    background.add_task(report_card_jobs.run_job, job["id"])
+    return job
+
+
+@router.get("/batch/{job_id}")
+def report_card_batch_status(job_id: str, _: Annotated[models.User, StaffGuard]):
+    job = report_card_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+
+@router.get("/batch/{job_id}/download")
+def report_card_batch_download(job_id: str, _: Annotated[models.User, StaffGuard]):
+    job = report_card_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"job is {job['status']}")
+    if job.get("kind") == "transcripts":
+        name = f"transcripts-{job['class_name'] or 'selection'}.zip"
+    else:
+        name = f"report-cards-{job['term'] or 'all'}-{job['class_name'] or job['grade']}.zip"
+    return FileResponse(report_card_jobs.zip_path(job_id), media_type="application/zip", filename=name)
+
+
+TRANSCRIPT_FORMATS = ("json", "csv", "pdf")
+
+
+@router.get("/transcript")
+def student_transcript(
+    current_user: Annotated[models.User, Depends(get_current_user)],
+    _: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+    student_id: int = Query(...),
+    format: str = Query("json"),
+    scale: Optional[str] = Query(None, description="GradingScale name; defaults to the configured scale"),
+):
+    """All terms for one student; students only get their own."""
+    fmt = format.lower()
+    if fmt not in TRANSCRIPT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(TRANSCRIPT_FORMATS)}")
+    roles = {r.name for r in (current_user.roles or [])}
+    if "Student" in roles:
+        my_sid = _current_student_id(db, current_user)
+        if not my_sid:
+            raise HTTPException(status_code=403, detail="Student link not configured")
+        student_id = my_sid
+    t = next(transcripts.build_transcripts(db, [student_id], scale_name=scale), None)
+    if t is None:
+        raise HTTPException(status_code=404, detail="student not found")
+    if fmt == "json":
+        return t
+    filename = f"transcript-{student_id}.{fmt}"
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    if fmt == "csv":
+        return Response(content=transcripts.to_csv([t]), media_type="text/csv", headers=headers)
+    from ..pdf import render_transcript
+
+    try:
+        pdf = render_transcript(t)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return Response(content=pdf, media_type="application/pdf", headers=headers)
+
+
+@router.post("/transcripts")
+def batch_transcripts(
+    payload: dict,
+    current_user: Annotated[models.User, StaffGuard],
+    background: BackgroundTasks,
+    response: Response,
+    db: Session = Depends(get_db),
+):
+    """
+    Zip of transcripts for a class (class_name) or an explicit student_ids list.
+    json and csv come back directly; pdf is queued as a batch job (202) to poll
+    at /report-cards/batch/{id} and fetch from its /download.
+    """
+    fmt = (payload.get("format") or "pdf").lower()
+    if fmt not in TRANSCRIPT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(TRANSCRIPT_FORMATS)}")
+    class_name = (payload.get("class_name") or "").strip() or None
+    ids = payload.get("student_ids")
+    if ids is not None:
+        if not isinstance(ids, list):
+            raise HTTPException(status_code=400, detail="student_ids must be a list")
+        try:
+            ids = [int(i) for i in ids]
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="student_ids must be integers")
+    elif class_name:
+        ids = transcripts.class_student_ids(db, class_name)
+    else:
+        raise HTTPException(status_code=400, detail="class_name or student_ids is required")
+    if fmt == "pdf":
+        job = report_card_jobs.start_job(
+            None, class_name=class_name, requested_by=current_user.id, kind="transcripts", student_ids=ids, scale=payload.get("scale")
+        )
+        background.add_task(report_card_jobs.run_job, job["id"])
+        response.status_code = 202
+        return job
+    path = transcripts.write_zip(transcripts.build_transcripts(db, ids, scale_name=payload.get("scale")), fmt)
+    filename = f"transcripts-{class_name or 'selection'}.zip"
+    return StreamingResponse(
+        stream_and_remove(path),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
@@ -1,28 +1,39 @@
 from __future__ import annotations
 
+from collections import Counter
 from typing import Annotated, Optional
+import hashlib
 import json
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from .. import models
+from .. import models, timetable_generator
+from ..cache import cached, invalidate
 from ..db import get_db
 from ..auth import require_roles, get_current_user
+from ..settings import settings
 
 router = APIRouter(prefix="/timetable", tags=["timetable"]) 
 
-Guard = Depends(require_roles("Headmaster", "Dean", "Director of Studies", "IT Support"))
+MANAGER_ROLES = ("Headmaster", "Dean", "Director of Studies", "IT Support")
+Guard = Depends(require_roles(*MANAGER_ROLES))
 StudentGuard = Depends(require_roles("Student"))
+TeacherGuard = Depends(require_roles("Teacher", *MANAGER_ROLES))
 
+# Cache namespace for published timetables and parsed configs; bumped on every timetable write.
+# With the memory backend the bump is per process, which is why cache.get_backend
+# refuses it when more than one worker is configured.
+TIMETABLE_CACHE = "timetable"
 
-# Config
-@router.get("/config")
-def get_config(
-    _: Annotated[models.User, Guard],
-    db: Session = Depends(get_db),
-    term: str = Query(...),
-):
+
+def _timetable_changed() -> None:
+    invalidate(TIMETABLE_CACHE)
+
+
+@cached(TIMETABLE_CACHE)
+def _config(db: Session, term: str) -> dict | None:
     cfg = db.query(models.TimetableConfig).filter(models.TimetableConfig.term == term).first()
     if not cfg:
         return None
@@ -35,6 +46,16 @@ def get_config(
     }
 
 
+# Config
+@router.get("/config")
+def get_config(
+    _: Annotated[models.User, Guard],
+    db: Session = Depends(get_db),
+    term: str = Query(...),
+):
+    return _config(db, term)
+
+
 @router.put("/config")
 def upsert_config(
     payload: dict,
@@ -59,6 +80,7 @@ def upsert_config(
         cfg.blocks_json = json.dumps(blocks)
     db.add(cfg)
     db.commit()
+    _timetable_changed()
     return {"ok": True}
 
 
@@ -102,6 +124,7 @@ def create_allocation(
     except Exception:
         db.rollback()
         raise HTTPException(status_code=400, detail="duplicate allocation")
+    _timetable_changed()
     db.refresh(a)
     return {"id": a.id}
 
@@ -129,6 +152,7 @@ def update_allocation(
     except Exception:
         db.rollback()
         raise HTTPException(status_code=400, detail="duplicate allocation")
+    _timetable_changed()
     return {"ok": True}
 
 
@@ -143,9 +167,72 @@ def delete_allocation(
         return
     db.delete(a)
     db.commit()
+    _timetable_changed()
 
 
 # Slots CRUD
+def _slot_clashes(db: Session, slot: models.TimetableSlot) -> list[dict]:
+    """
+    Other slots in the same term/day/period that share the class, teacher or
+    room. One indexed lookup, run before every slot write; the unique indexes
+    on TimetableSlot back it up against concurrent writers.
+    """
+    T = models.TimetableSlot
+    clash = T.class_name == slot.class_name
+    if slot.teacher_id:
+        clash = clash | (T.teacher_id == slot.teacher_id)
+    if slot.room:
+        clash = clash | (T.room == slot.room)
+    q = db.query(T).filter(
+        T.term == slot.term, T.day_of_week == slot.day_of_week, T.period_index == slot.period_index, clash
+    )
+    if slot.id is not None:
+        q = q.filter(T.id != slot.id)
+    out = []
+    for other in q.all():
+        for kind, field in (("class_double_book", "class_name"), ("teacher_double_book", "teacher_id"), ("room_double_book", "room")):
+            value = getattr(slot, field)
+            if value and getattr(other, field) == value:
+                out.append({"type": kind, field: value, "slot_id": other.id, "class_name": other.class_name, "subject": other.subject})
+    return out
+
+
+def _reject_clashes(db: Session, slot: models.TimetableSlot) -> None:
+    with db.no_autoflush:
+        clashes = _slot_clashes(db, slot)
+    if clashes:
+        db.rollback()
+        raise HTTPException(status_code=409, detail={"message": "slot conflicts with existing timetable", "conflicts": clashes})
+
+
+SLOT_FIELDS = ("id", "term", "day_of_week", "period_index", "class_name", "subject", "room", "teacher_id")
+
+
+def _commit_slot(db: Session, slot: models.TimetableSlot) -> None:
+    """Commit a slot write; a unique-index hit means a concurrent writer took the class, teacher or room first."""
+    probe = models.TimetableSlot(**{f: getattr(slot, f) for f in SLOT_FIELDS})
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        _reject_clashes(db, probe)
+        raise HTTPException(status_code=409, detail={"message": "slot conflicts with existing timetable", "conflicts": []})
+
+
+def _slot_room(value) -> Optional[str]:
+    # Blank rooms are unassigned, not a room called "" that every other blank slot clashes with
+    return (str(value).strip() or None) if value is not None else None
+
+
+def _slot_teacher(value) -> Optional[int]:
+    if value is None or str(value).strip() == "":
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="teacher_id must be an integer")
+
+
 @router.get("/slots")
 def list_slots(
     _: Annotated[models.User, Guard],
@@ -177,16 +264,14 @@ def create_slot(
         subject = str(payload["subject"]).strip()
     except Exception:
         raise HTTPException(status_code=400, detail="term, day_of_week, period_index, class_name, subject are required")
-    room = payload.get("room")
-    teacher_id = payload.get("teacher_id")
+    room = _slot_room(payload.get("room"))
+    teacher_id = _slot_teacher(payload.get("teacher_id"))
 
     slot = models.TimetableSlot(term=term, day_of_week=day_of_week, period_index=period_index, class_name=class_name, subject=subject, room=room, teacher_id=teacher_id)
+    _reject_clashes(db, slot)
     db.add(slot)
-    try:
-        db.commit()
-    except Exception:
-        db.rollback()
-        raise HTTPException(status_code=400, detail="duplicate slot or constraint error")
+    _commit_slot(db, slot)
+    _timetable_changed()
     db.refresh(slot)
     return {"id": slot.id}
 
@@ -201,19 +286,19 @@ def update_slot(
     s = db.query(models.TimetableSlot).filter(models.TimetableSlot.id == slot_id).first()
     if not s:
         raise HTTPException(status_code=404, detail="not found")
-    for key in ["term", "day_of_week", "class_name", "subject", "room"]:
+    for key in ["term", "day_of_week", "class_name", "subject"]:
         if key in payload and payload[key] is not None:
             setattr(s, key, payload[key])
     if payload.get("period_index") is not None:
         s.period_index = int(payload.get("period_index"))
+    if "room" in payload:
+        s.room = _slot_room(payload["room"])
     if "teacher_id" in payload:
-        s.teacher_id = payload.get("teacher_id")
+        s.teacher_id = _slot_teacher(payload["teacher_id"])
+    _reject_clashes(db, s)
     db.add(s)
-    try:
-        db.commit()
-    except Exception:
-        db.rollback()
-        raise HTTPException(status_code=400, detail="duplicate slot or constraint error")
+    _commit_slot(db, s)
+    _timetable_changed()
     return {"ok": True}
 
 
@@ -228,6 +313,7 @@ def delete_slot(
         return
     db.delete(s)
     db.commit()
+    _timetable_changed()
 
 
 # Conflicts
@@ -238,19 +324,19 @@ def conflicts(
     term: str = Query(...),
 ):
     rows = db.query(models.TimetableSlot).filter(models.TimetableSlot.term == term).all()
-    teacher_map: dict[tuple[str,int,int], list[models.TimetableSlot]] = {}
-    class_map: dict[tuple[str,int,int], list[models.TimetableSlot]] = {}
-    room_map: dict[tuple[str,int,int], list[models.TimetableSlot]] = {}
+    class_map: dict[tuple[str, int, str], list[models.TimetableSlot]] = {}
+    teacher_map: dict[tuple[str, int, int], list[models.TimetableSlot]] = {}
+    room_map: dict[tuple[str, int, str], list[models.TimetableSlot]] = {}
+    # Periods per week for each (class, subject), counted from the slots already loaded
+    assigned: Counter[tuple[str, str]] = Counter()
 
     for r in rows:
-        key_c = (r.day_of_week, r.period_index, hash(r.class_name))
-        class_map.setdefault(key_c, []).append(r)
+        class_map.setdefault((r.day_of_week, r.period_index, r.class_name), []).append(r)
         if r.teacher_id:
-            key_t = (r.day_of_week, r.period_index, int(r.teacher_id))
-            teacher_map.setdefault(key_t, []).append(r)
+            teacher_map.setdefault((r.day_of_week, r.period_index, int(r.teacher_id)), []).append(r)
         if r.room:
-            key_r = (r.day_of_week, r.period_index, hash(r.room))
-            room_map.setdefault(key_r, []).append(r)
+            room_map.setdefault((r.day_of_week, r.period_index, r.room), []).append(r)
+        assigned[(r.class_name, r.subject)] += 1
 
     conflicts = []
     for _, lst in class_map.items():
@@ -281,15 +367,10 @@ def conflicts(
                 "slots": [s.id for s in lst],
             })
 
-    # Allocation deficits/excess
-    # For each allocation, count assigned per week and compare to required_per_week
+    # Allocation deficits/excess against the counts above
     allocs = db.query(models.SubjectAllocation).filter(models.SubjectAllocation.term == term).all()
     for a in allocs:
-        count_assigned = db.query(models.TimetableSlot).filter(
-            models.TimetableSlot.term == term,
-            models.TimetableSlot.class_name == a.class_name,
-            models.TimetableSlot.subject == a.subject,
-        ).count()
+        count_assigned = assigned[(a.class_name, a.subject)]
         if count_assigned < a.required_per_week:
             conflicts.append({
                 "type": "allocation_deficit",
@@ -310,27 +391,98 @@ def conflicts(
     return {"conflicts": conflicts}
 
 
-def _current_student(db: Session, user: models.User) -> models.Student | None:
-    link = db.query(models.UserStudentLink).filter(models.UserStudentLink.user_id == user.id).first()
-    if not link:
-        return None
-    s = db.query(models.Student).filter(models.Student.id == link.student_id).first()
-    return s
-
-
-@router.get("/my")
-def my_timetable(
-    current_user: Annotated[models.User, Depends(get_current_user)],
-    _: Annotated[models.User, StudentGuard],
+# Generation
+@router.post("/generate")
+def generate_timetable(
+    payload: dict,
+    _: Annotated[models.User, Guard],
     db: Session = Depends(get_db),
-    term: str = Query(...),
 ):
-    s = _current_student(db, current_user)
-    if not s or not s.class_name:
-        raise HTTPException(status_code=403, detail="Student link or class not configured")
+    # Expect payload: { term, dry_run?: true, keep_existing?: false, time_budget?: seconds, seed?: 0, allow_partial?: false }
+    term = (payload.get("term") or "").strip()
+    if not term:
+        raise HTTPException(status_code=400, detail="term is required")
+    try:
+        budget = payload.get("time_budget")
+        # Capped well below proxy timeouts; longer searches go through python -m app.timetable_generator
+        budget = min(max(float(budget), 1.0), settings.TIMETABLE_GENERATOR_SECONDS) if budget is not None else None
+        seed = int(payload.get("seed") or 0)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="invalid time_budget or seed")
+    dry_run = payload.get("dry_run", True) is not False
+    keep_existing = bool(payload.get("keep_existing"))
+
+    result = timetable_generator.generate(db, term, keep_existing=keep_existing, time_budget=budget, seed=seed)
+    if dry_run:
+        return {"dry_run": True, "written": 0, **result}
+    if result["unplaced"] and not payload.get("allow_partial"):
+        raise HTTPException(status_code=409, detail={"message": "some lessons could not be placed", "unplaced": result["unplaced"]})
+    try:
+        written = timetable_generator.apply(db, term, result["slots"], keep_existing=keep_existing)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="timetable slots changed while generating; run it again")
+    _timetable_changed()
+    return {"dry_run": False, "written": written, **result}
+
+
+# Published timetables
+@cached(TIMETABLE_CACHE, ttl=60)
+def _student_class(db: Session, user_id: int) -> str | None:
+    # Short TTL: class moves are not timetable writes
+    row = (
+        db.query(models.Student.class_name)
+        .join(models.UserStudentLink, models.UserStudentLink.student_id == models.Student.id)
+        .filter(models.UserStudentLink.user_id == user_id)
+        .first()
+    )
+    return row[0] if row else None
+
+
+def _published(body: dict) -> dict:
+    # Serialised once here; the cached entry stays plain JSON for the Redis backend
+    raw = json.dumps(body, separators=(",", ":"), sort_keys=True)
+    return {"etag": f'"{hashlib.sha1(raw.encode("utf-8")).hexdigest()}"', "raw": raw}
+
+
+def _etag_response(request: Request, entry: dict) -> Response:
+    etag = entry["etag"]
+    if etag in [t.strip() for t in (request.headers.get("if-none-match") or "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=entry["raw"], media_type="application/json", headers={"ETag": etag})
+
+
+@cached(TIMETABLE_CACHE)
+def _class_timetable(db: Session, term: str, class_name: str) -> dict:
+    rows = (
+        db.query(models.TimetableSlot)
+        .filter(models.TimetableSlot.term == term, models.TimetableSlot.class_name == class_name)
+        .order_by(models.TimetableSlot.day_of_week.asc(), models.TimetableSlot.period_index.asc())
+        .all()
+    )
+    out = [
+        {
+            "day_of_week": r.day_of_week,
+            "period_index": r.period_index,
+            "subject": r.subject,
+            "room": r.room,
+        }
+        for r in rows
+    ]
+    subjects = [
+        {"subject": a.subject, "teacher_id": a.teacher_id, "required_per_week": a.required_per_week}
+        for a in db.query(models.SubjectAllocation)
+        .filter(models.SubjectAllocation.term == term, models.SubjectAllocation.class_name == class_name)
+        .order_by(models.SubjectAllocation.subject.asc())
+    ]
+    # Config and allocations are part of the body, so their writes change the ETag too
+    return _published({"class_name": class_name, "term": term, "config": _config(db, term), "subjects": subjects, "items": out})
+
+
+@cached(TIMETABLE_CACHE)
+def _teacher_timetable(db: Session, term: str, teacher_id: int) -> dict:
     rows = (
         db.query(models.TimetableSlot)
-        .filter(models.TimetableSlot.term == term, models.TimetableSlot.class_name == s.class_name)
+        .filter(models.TimetableSlot.term == term, models.TimetableSlot.teacher_id == teacher_id)
         .order_by(models.TimetableSlot.day_of_week.asc(), models.TimetableSlot.period_index.asc())
         .all()
     )
@@ -338,9 +490,49 @@ def my_timetable(
         {
             "day_of_week": r.day_of_week,
             "period_index": r.period_index,
+            "class_name": r.class_name,
             "subject": r.subject,
             "room": r.room,
         }
         for r in rows
     ]
-    return {"class_name": s.class_name, "term": term, "items": out}
+    allocations = [
+        {"class_name": a.class_name, "subject": a.subject, "required_per_week": a.required_per_week}
+        for a in db.query(models.SubjectAllocation)
+        .filter(models.SubjectAllocation.term == term, models.SubjectAllocation.teacher_id == teacher_id)
+        .order_by(models.SubjectAllocation.class_name.asc(), models.SubjectAllocation.subject.asc())
+    ]
+    return _published({"teacher_id": teacher_id, "term": term, "config": _config(db, term), "allocations": allocations, "items": out})
+
+
+@router.get("/my")
+def my_timetable(
+    request: Request,
+    current_user: Annotated[models.User, Depends(get_current_user)],
+    _: Annotated[models.User, StudentGuard],
+    db: Session = Depends(get_db),
+    term: str = Query(...),
+):
+    class_name = _student_class(db, current_user.id)
+    if not class_name:
+        raise HTTPException(status_code=403, detail="Student link or class not configured")
+    return _etag_response(request, _class_timetable(db, term, class_name))
+
+
+@router.get("/teacher")
+def teacher_timetable(
+    request: Request,
+    current_user: Annotated[models.User, TeacherGuard],
+    db: Session = Depends(get_db),
+    term: str = Query(...),
+    teacher_id: Optional[int] = Query(None),
+):
+    """A teacher's week; teachers see their own, timetable managers may pass teacher_id."""
+    roles = {r.name for r in (current_user.roles or [])}
+    if teacher_id is None or not roles.intersection(MANAGER_ROLES):
+        # Slots reference Teacher rows, which are matched to users by email
+        t = db.query(models.Teacher).filter(models.Teacher.email == current_user.email).first()
+        if not t:
+            raise HTTPException(status_code=404, detail="no teacher profile for this user")
+        teacher_id = t.id
+    return _etag_response(request, _teacher_timetable(db, term, teacher_id))
@@ -0,0 +1,44 @@
+"""
+Indexes added to tables that existing databases already have.
+
+``create_all`` only creates an index together with its table, so indexes
+added to a model later never reach databases that predate them.
+``ensure_indexes`` creates whichever of ADDED_INDEXES is missing; startup
+runs it. Unique indexes that existing rows could violate need a conflict
+report first and live in their own module (see timetable_integrity).
+"""
+from __future__ import annotations
+
+import logging
+
+from sqlalchemy import Index
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# model -> names of non-unique indexes added after its table shipped
+ADDED_INDEXES = {
+    models.Attendance: ("ix_attendance_date_student",),
+}
+
+
+def _index(model, name: str) -> Index:
+    return next(ix for ix in model.__table__.indexes if ix.name == name)
+
+
+def ensure_indexes(db: Session) -> dict:
+    """Create missing ADDED_INDEXES (commits). Returns {index: "present" | "created"}."""
+    report = {}
+    for model, names in ADDED_INDEXES.items():
+        for name in names:
+            conn = db.connection()
+            if conn.dialect.has_index(conn, model.__tablename__, name):
+                report[name] = "present"
+                continue
+            _index(model, name).create(conn)
+            db.commit()
+            logger.info(f"Created index {name} on {model.__tablename__}")
+            report[name] = "created"
+    return report
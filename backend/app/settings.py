@@ -21,6 +21,25 @@ class Settings(BaseSettings):
     UPLOAD_DIR: str = "uploads"
     ADMIN_EMAIL: str | None = None
     ADMIN_PASSWORD: str | None = None
+    NOTIFICATION_RETENTION_DAYS: int = 90
+    RETENTION_BATCH_SIZE: int = 1000
+    RETENTION_PAUSE_SECONDS: float = 0.25
+    ARCHIVE_DIR: str = "archives"
+    PASS_MARK: float = 50.0
+    DEFAULT_GRADING_SCALE: str | None = None
+    CACHE_BACKEND: str = "memory"  # memory | redis | none
+    CACHE_TTL_SECONDS: float = 300
+    CACHE_WAIT_SECONDS: float = 30
+    WEB_CONCURRENCY: int = 1  # worker processes; the memory cache is only safe with one
+    REPORT_CARD_DIR: str = "report_cards"
+    REPORT_CARD_WORKERS: int | None = None  # defaults to the CPU count
+    REPORT_CARD_JOB_TIMEOUT_SECONDS: float = 900  # unfinished jobs without a heartbeat this long are failed
+    ABSENCE_WINDOW_DAYS: int = 30  # rolling window, at most 62 days
+    ABSENCE_RATE_THRESHOLD: float = 20.0  # percent of marked days in the window
+    ABSENCE_MIN_MARKED_DAYS: int = 5  # before the rate is trusted
+    ABSENCE_CONSECUTIVE_THRESHOLD: int = 3
+    ABSENCE_ALERT_ROLES: list[str] = ["Director of Studies"]
+    TIMETABLE_GENERATOR_SECONDS: float = 20  # default and, over HTTP, maximum wall-clock budget per run
 
     model_config = ConfigDict(env_file=".env")
 
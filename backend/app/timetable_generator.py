@@ -0,0 +1,376 @@
+"""
+Timetable generation from SubjectAllocation and TimetableConfig.
+
+Every allocation expands into ``required_per_week`` lesson units that must
+go into a (day, period) cell with no class or teacher double-booking. The
+solver works in three phases under one wall-clock budget:
+
+1. greedy placement, hardest units first (busiest teacher, then busiest
+   class), each into the cheapest feasible cell;
+2. a bounded repair when a unit has no feasible cell: a blocking lesson is
+   moved elsewhere (recursively, a couple of levels deep) to make room;
+3. local search over single moves and same-class swaps that lowers the soft
+   cost.
+
+Soft cost penalises a subject repeated on the same day for a class and idle
+periods between a teacher's first and last lesson of a day. Rooms are not
+assigned. ``python -m app.timetable_generator --term T1`` prints a preview.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from collections import Counter
+from typing import Iterable, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+from .settings import settings
+
+DEFAULT_DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri"]
+DEFAULT_PERIODS = 10
+
+# Soft-constraint weights
+SAME_DAY_PENALTY = 10  # per extra lesson of a subject on one day for a class
+TEACHER_GAP_PENALTY = 3  # per idle period inside a teacher's day
+
+_REPAIR_DEPTH = 2
+
+
+def periods_per_day(blocks: list) -> int:
+    """Teaching periods in a day: the ``periods`` blocks of the config (breaks are ``minutes`` blocks)."""
+    total = sum(int(b.get("periods") or 0) for b in blocks or [] if isinstance(b, dict))
+    return total or DEFAULT_PERIODS
+
+
+class _Solver:
+    def __init__(self, days: int, periods: int, units: list[tuple[str, str, Optional[int]]], fixed: set[int], seed: int):
+        self.days, self.periods = days, periods
+        self.units = units
+        self.fixed = fixed
+        self.rng = random.Random(seed)
+        self.cells = [(d, p) for d in range(days) for p in range(periods)]
+        self.pos: list[Optional[tuple[int, int]]] = [None] * len(units)
+        self.class_at: dict[tuple[str, int, int], int] = {}
+        self.teacher_at: dict[tuple[int, int, int], int] = {}
+        self.subject_day: Counter[tuple[str, str, int]] = Counter()
+        self.teacher_day: dict[tuple[int, int], set[int]] = {}
+
+    # Occupancy
+
+    def free(self, u: int, cell: tuple[int, int], ignore: tuple[int, ...] = ()) -> bool:
+        cls, _, teacher = self.units[u]
+        d, p = cell
+        other = self.class_at.get((cls, d, p))
+        if other is not None and other not in ignore:
+            return False
+        if teacher is not None:
+            other = self.teacher_at.get((teacher, d, p))
+            if other is not None and other not in ignore:
+                return False
+        return True
+
+    def put(self, u: int, cell: tuple[int, int]) -> None:
+        cls, subject, teacher = self.units[u]
+        d, p = cell
+        self.pos[u] = cell
+        self.class_at[(cls, d, p)] = u
+        self.subject_day[(cls, subject, d)] += 1
+        if teacher is not None:
+            self.teacher_at[(teacher, d, p)] = u
+            self.teacher_day.setdefault((teacher, d), set()).add(p)
+
+    def take(self, u: int) -> tuple[int, int]:
+        cls, subject, teacher = self.units[u]
+        d, p = cell = self.pos[u]
+        self.pos[u] = None
+        del self.class_at[(cls, d, p)]
+        self.subject_day[(cls, subject, d)] -= 1
+        if teacher is not None:
+            del self.teacher_at[(teacher, d, p)]
+            self.teacher_day[(teacher, d)].discard(p)
+        return cell
+
+    # Soft cost
+
+    def _gap(self, periods: set[int]) -> int:
+        return max(periods) - min(periods) + 1 - len(periods) if periods else 0
+
+    def _local_cost(self, touched: Iterable[int]) -> int:
+        """Soft cost of the (class, subject, day) and (teacher, day) groups the units touch."""
+        subj, teach = set(), set()
+        for u in touched:
+            cls, subject, teacher = self.units[u]
+            for d in range(self.days):
+                subj.add((cls, subject, d))
+                if teacher is not None:
+                    teach.add((teacher, d))
+        return (
+            SAME_DAY_PENALTY * sum(max(0, self.subject_day[k] - 1) for k in subj)
+            + TEACHER_GAP_PENALTY * sum(self._gap(self.teacher_day.get(k, set())) for k in teach)
+        )
+
+    def cost(self) -> int:
+        return (
+            SAME_DAY_PENALTY * sum(max(0, n - 1) for n in self.subject_day.values())
+            + TEACHER_GAP_PENALTY * sum(self._gap(s) for s in self.teacher_day.values())
+        )
+
+    def _placement_cost(self, u: int, cell: tuple[int, int]) -> int:
+        cls, subject, teacher = self.units[u]
+        d, p = cell
+        cost = SAME_DAY_PENALTY * self.subject_day[(cls, subject, d)]
+        if teacher is not None:
+            taught = self.teacher_day.get((teacher, d))
+            if taught:
+                before = self._gap(taught)
+                cost += TEACHER_GAP_PENALTY * (self._gap(taught | {p}) - before)
+        return cost
+
+    # Phases
+
+    def _best_cell(self, u: int, ignore: tuple[int, ...] = ()) -> Optional[tuple[int, int]]:
+        best, best_cost = None, None
+        for cell in self.cells:
+            if self.free(u, cell, ignore):
+                c = self._placement_cost(u, cell)
+                if best_cost is None or c < best_cost:
+                    best, best_cost = cell, c
+                    if c == 0:
+                        break
+        return best
+
+    def _repair(self, u: int, depth: int, moving: set[int]) -> bool:
+        """Make room for ``u`` by relocating the (non-fixed) lessons blocking one of its cells."""
+        cls, _, teacher = self.units[u]
+        cells = self.cells[:]
+        self.rng.shuffle(cells)
+        for d, p in cells:
+            blockers = {self.class_at.get((cls, d, p))}
+            if teacher is not None:
+                blockers.add(self.teacher_at.get((teacher, d, p)))
+            blockers.discard(None)
+            if len(blockers) != 1:
+                continue
+            (v,) = blockers
+            if v in self.fixed or v in moving:
+                continue
+            old = self.take(v)
+            self.put(u, (d, p))
+            target = self._best_cell(v)
+            if target is not None:
+                self.put(v, target)
+                return True
+            if depth > 1 and self._repair(v, depth - 1, moving | {u, v}):
+                return True
+            self.take(u)
+            self.put(v, old)
+        return False
+
+    def place_all(self, order: list[int], deadline: float) -> list[int]:
+        unplaced = []
+        for u in order:
+            cell = self._best_cell(u)
+            if cell is not None:
+                self.put(u, cell)
+            elif time.monotonic() >= deadline or not self._repair(u, _REPAIR_DEPTH, {u}):
+                unplaced.append(u)
+        return unplaced
+
+    def improve(self, deadline: float, max_stale: Optional[int] = None) -> int:
+        movable = [u for u in range(len(self.units)) if u not in self.fixed and self.pos[u] is not None]
+        current = self.cost()
+        max_stale = max_stale or max(20000, 100 * len(movable))
+        stale = 0
+        while movable and current > 0 and stale < max_stale and time.monotonic() < deadline:
+            stale += 1
+            u = self.rng.choice(movable)
+            cell = self.rng.choice(self.cells)
+            if cell == self.pos[u]:
+                continue
+            cls = self.units[u][0]
+            w = self.class_at.get((cls, *cell))
+            if w is not None and w in self.fixed:
+                continue
+            touched = (u,) if w is None else (u, w)
+            if not self.free(u, cell, ignore=touched):
+                continue
+            if w is not None and not self.free(w, self.pos[u], ignore=touched):
+                continue
+            before = self._local_cost(touched)
+            old = self.take(u)
+            if w is not None:
+                self.take(w)
+                self.put(w, old)
+            self.put(u, cell)
+            delta = self._local_cost(touched) - before
+            if delta <= 0:
+                # Sideways moves are kept so the search can cross plateaus
+                current += delta
+                if delta < 0:
+                    stale = 0
+                continue
+            self.take(u)
+            if w is not None:
+                self.take(w)
+                self.put(w, cell)
+            self.put(u, old)
+        return current
+
+
+def solve(
+    days: list[str],
+    periods: int,
+    requirements: list[dict],
+    fixed: Iterable[dict] = (),
+    time_budget: float = 20.0,
+    seed: int = 0,
+) -> dict:
+    """
+    Place lessons on a ``days`` x ``periods`` grid.
+
+    ``requirements`` are dicts of class_name, subject, teacher_id and count;
+    ``fixed`` are existing slots (class_name, subject, teacher_id, day_of_week,
+    period_index) that stay where they are and count towards requirements.
+    Returns {"slots", "unplaced", "cost", "stats"}; slots use day names and
+    1-based period indexes like TimetableSlot.
+    """
+    started = time.monotonic()
+    deadline = started + max(0.1, time_budget)
+    day_index = {name: i for i, name in enumerate(days)}
+    units: list[tuple[str, str, Optional[int]]] = []
+    fixed_ids: set[int] = set()
+    fixed_cells: list[tuple[int, tuple[int, int]]] = []
+    already: Counter[tuple[str, str]] = Counter()
+    for s in fixed:
+        d = day_index.get(s["day_of_week"])
+        p = int(s["period_index"]) - 1
+        if d is None or not 0 <= p < periods:
+            continue
+        fixed_ids.add(len(units))
+        fixed_cells.append((len(units), (d, p)))
+        units.append((s["class_name"], s["subject"], s.get("teacher_id")))
+        already[(s["class_name"], s["subject"])] += 1
+    for r in requirements:
+        missing = int(r["count"]) - already[(r["class_name"], r["subject"])]
+        units.extend([(r["class_name"], r["subject"], r.get("teacher_id"))] * max(0, missing))
+
+    solver = _Solver(len(days), periods, units, fixed_ids, seed)
+    for u, cell in fixed_cells:
+        if solver.free(u, cell):
+            solver.put(u, cell)
+
+    teacher_load = Counter(t for _, _, t in units if t is not None)
+    class_load = Counter(c for c, _, _ in units)
+    order = sorted(
+        (u for u in range(len(units)) if u not in fixed_ids),
+        key=lambda u: (-teacher_load.get(units[u][2], 0), -class_load[units[u][0]], units[u]),
+    )
+    unplaced = solver.place_all(order, deadline)
+    greedy_cost = solver.cost()
+    cost = solver.improve(deadline)
+
+    slots = [
+        {
+            "day_of_week": days[solver.pos[u][0]],
+            "period_index": solver.pos[u][1] + 1,
+            "class_name": cls,
+            "subject": subject,
+            "teacher_id": teacher,
+        }
+        for u, (cls, subject, teacher) in enumerate(units)
+        if u not in fixed_ids and solver.pos[u] is not None
+    ]
+    slots.sort(key=lambda s: (s["class_name"], day_index[s["day_of_week"]], s["period_index"]))
+    missing = Counter((units[u][0], units[u][1], units[u][2]) for u in unplaced)
+    return {
+        "slots": slots,
+        "unplaced": [
+            {"class_name": c, "subject": s, "teacher_id": t, "count": n} for (c, s, t), n in sorted(missing.items(), key=str)
+        ],
+        "cost": cost,
+        "stats": {
+            "lessons": len(units) - len(fixed_ids),
+            "fixed": len(fixed_ids),
+            "greedy_cost": greedy_cost,
+            "seconds": round(time.monotonic() - started, 3),
+        },
+    }
+
+
+def generate(
+    db: Session,
+    term: str,
+    keep_existing: bool = False,
+    time_budget: Optional[float] = None,
+    seed: int = 0,
+) -> dict:
+    """Solve a term from its TimetableConfig and SubjectAllocations (nothing is written)."""
+    cfg = db.query(models.TimetableConfig).filter(models.TimetableConfig.term == term).first()
+    days = (json.loads(cfg.days_json or "[]") if cfg else None) or DEFAULT_DAYS
+    periods = periods_per_day(json.loads(cfg.blocks_json or "[]") if cfg else [])
+    allocs = db.query(models.SubjectAllocation).filter(models.SubjectAllocation.term == term).all()
+    requirements = [
+        {"class_name": a.class_name, "subject": a.subject, "teacher_id": a.teacher_id, "count": a.required_per_week}
+        for a in allocs
+    ]
+    fixed = []
+    if keep_existing:
+        fixed = [
+            {"class_name": s.class_name, "subject": s.subject, "teacher_id": s.teacher_id,
+             "day_of_week": s.day_of_week, "period_index": s.period_index}
+            for s in db.query(models.TimetableSlot).filter(models.TimetableSlot.term == term).all()
+        ]
+    budget = settings.TIMETABLE_GENERATOR_SECONDS if time_budget is None else time_budget
+    result = solve(days, periods, requirements, fixed, time_budget=budget, seed=seed)
+    return {"term": term, "days": days, "periods_per_day": periods, **result}
+
+
+def apply(db: Session, term: str, slots: list[dict], keep_existing: bool = False) -> int:
+    """
+    Write generated slots in one bulk insert, replacing the term's slots unless
+    ``keep_existing``. Commits; on IntegrityError (slots written since the
+    run was generated) rolls back and re-raises, leaving the term unchanged.
+    """
+    try:
+        if not keep_existing:
+            db.query(models.TimetableSlot).filter(models.TimetableSlot.term == term).delete(synchronize_session=False)
+        db.bulk_insert_mappings(models.TimetableSlot, [{"term": term, "room": None, **s} for s in slots])
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise
+    return len(slots)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate a term timetable from subject allocations.")
+    parser.add_argument("--term", required=True)
+    parser.add_argument("--keep-existing", action="store_true", help="keep current slots and fill around them")
+    parser.add_argument("--budget", type=float, default=None, help="wall-clock seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--apply", action="store_true", help="write the result (default is a dry run)")
+    args = parser.parse_args(argv)
+
+    from .db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        result = generate(db, args.term, args.keep_existing, args.budget, args.seed)
+        try:
+            written = apply(db, args.term, result["slots"], args.keep_existing) if args.apply and not result["unplaced"] else 0
+        except IntegrityError as e:
+            print(json.dumps({"written": 0, "error": f"slots changed while generating: {e.orig}"}))
+            return 2
+        print(json.dumps({"written": written, "unplaced": result["unplaced"], "cost": result["cost"], **result["stats"]}))
+        return 0 if not result["unplaced"] else 1
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
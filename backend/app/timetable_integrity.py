@@ -0,0 +1,101 @@
+"""
+Teacher and room double-booking guards for timetable slots on existing databases.
+
+``create_all`` only adds the partial unique indexes uq_slot_teacher and
+uq_slot_room when it creates the timetable_slots table, so databases that
+predate them rely on the application-level clash check alone.
+``ensure_unique_indexes`` reports the double-bookings that would block each
+missing index, optionally clears them (the lowest slot id keeps the teacher
+or room; later slots are left unassigned rather than deleted) and then
+creates the index. Startup runs it in report-only mode; run
+``python -m app.timetable_integrity --fix`` to clear conflicts.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+from typing import Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+S = models.TimetableSlot
+
+# index name -> slot column it keeps unique per (term, day, period)
+GUARDED = {"uq_slot_teacher": "teacher_id", "uq_slot_room": "room"}
+
+
+def _index(name: str):
+    return next(ix for ix in S.__table__.indexes if ix.name == name)
+
+
+def double_bookings(db: Session, column: str) -> list[dict]:
+    """Groups of slots sharing a teacher (or room) in the same term, day and period."""
+    col = getattr(S, column)
+    keys = (S.term, S.day_of_week, S.period_index, col)
+    groups = db.query(*keys).filter(col.isnot(None)).group_by(*keys).having(func.count(S.id) > 1).all()
+    out = []
+    for term, day, period, value in groups:
+        ids = [
+            sid for (sid,) in db.query(S.id)
+            .filter(S.term == term, S.day_of_week == day, S.period_index == period, col == value)
+            .order_by(S.id)
+        ]
+        out.append({"term": term, "day_of_week": day, "period_index": period, column: value, "slot_ids": ids})
+    return out
+
+
+def ensure_unique_indexes(db: Session, fix: bool = False) -> dict:
+    """
+    Create whichever of uq_slot_teacher / uq_slot_room is missing. Conflicting
+    rows block an index unless ``fix`` clears them first (commits). Returns
+    {index: {"status": "present" | "created" | "blocked", "conflicts": [...]}}.
+    """
+    report = {}
+    for name, column in GUARDED.items():
+        conn = db.connection()
+        if conn.dialect.has_index(conn, S.__tablename__, name):
+            report[name] = {"status": "present", "conflicts": []}
+            continue
+        conflicts = double_bookings(db, column)
+        if conflicts and fix:
+            clear = [sid for c in conflicts for sid in c["slot_ids"][1:]]
+            db.query(S).filter(S.id.in_(clear)).update({column: None}, synchronize_session=False)
+            db.commit()
+            logger.warning(f"Cleared {column} on {len(clear)} double-booked timetable slots: {clear}")
+        elif conflicts:
+            logger.warning(
+                f"{name} not created: {len(conflicts)} double-bookings in timetable_slots "
+                "(python -m app.timetable_integrity --fix clears them)"
+            )
+            report[name] = {"status": "blocked", "conflicts": conflicts}
+            continue
+        _index(name).create(db.connection())
+        db.commit()
+        report[name] = {"status": "created", "conflicts": conflicts}
+    return report
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Report or clear timetable double-bookings and add the unique indexes.")
+    parser.add_argument("--fix", action="store_true", help="unassign the later slot of each double-booking")
+    args = parser.parse_args(argv)
+
+    from .db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        report = ensure_unique_indexes(db, fix=args.fix)
+        print(json.dumps(report, default=str))
+        return 1 if any(r["status"] == "blocked" for r in report.values()) else 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
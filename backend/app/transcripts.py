@@ -0,0 +1,154 @@
+"""
+Multi-term academic transcripts.
+
+Results for a batch of students are read with one ExamResult/Assessment join,
+grouped by (student, term, subject) in memory and graded with the configured
+GradingScale. Terms are ordered by their earliest assessment date. PDF
+batches are rendered by report_card_jobs, not inside a request.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+import tempfile
+import zipfile
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+from .analytics_service import load_scale, weighted_totals
+
+BATCH_SIZE = 500
+
+CSV_HEADER = ["student_id", "admission_no", "full_name", "class_name", "term", "subject", "total", "grade", "points"]
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 2) if value is not None else None
+
+
+def term_starts(db: Session) -> dict[str, object]:
+    """Earliest assessment date per term ("" for no term), so every batch orders terms alike."""
+    rows = db.query(models.Assessment.term, func.min(models.Assessment.date)).group_by(models.Assessment.term).all()
+    return {term or "": day for term, day in rows}
+
+
+def build_transcripts(
+    db: Session,
+    student_ids: Iterable[int],
+    scale_name: Optional[str] = None,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[dict]:
+    """Yield one transcript dict per known student id, in the order given."""
+    scale = load_scale(db, scale_name)
+    ids = list(dict.fromkeys(student_ids))
+    term_start = term_starts(db)
+
+    def term_order(term: str):
+        day = term_start.get(term)
+        return (day is None, day.isoformat() if day else "", term)
+
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        students = {s.id: s for s in db.query(models.Student).filter(models.Student.id.in_(batch)).all()}
+        rows = (
+            db.query(
+                models.ExamResult.student_id,
+                models.Assessment.term,
+                models.Assessment.subject,
+                models.ExamResult.score,
+                models.Assessment.total_score,
+                models.Assessment.weight,
+            )
+            .join(models.Assessment, models.ExamResult.assessment_id == models.Assessment.id)
+            .filter(models.ExamResult.student_id.in_(batch))
+            .all()
+        )
+        totals = weighted_totals(
+            ((sid, term or "", subj or "(none)"), score, total_score, weight)
+            for sid, term, subj, score, total_score, weight in rows
+        )
+        by_student: dict[int, dict[str, dict[str, float]]] = {}
+        for (sid, term, subj), total in totals.items():
+            if total is not None:
+                by_student.setdefault(sid, {}).setdefault(term, {})[subj] = total
+
+        for sid in batch:
+            st = students.get(sid)
+            if st is None:
+                continue
+            terms = []
+            all_totals: list[float] = []
+            for term in sorted(by_student.get(sid, {}), key=term_order):
+                subjects = by_student[sid][term]
+                average = sum(subjects.values()) / len(subjects)
+                all_totals.extend(subjects.values())
+                grade, _ = scale.lookup(average)
+                graded = [(subj, t, *scale.lookup(t)) for subj, t in sorted(subjects.items())]
+                terms.append({
+                    "term": term or None,
+                    "subjects": [
+                        {"subject": subj, "total": _round(t), "grade": g, "points": p}
+                        for subj, t, g, p in graded
+                    ],
+                    "average": _round(average),
+                    "grade": grade,
+                })
+            cumulative = sum(all_totals) / len(all_totals) if all_totals else None
+            yield {
+                "student_id": st.id,
+                "admission_no": st.admission_number,
+                "full_name": st.full_name,
+                "class_name": st.class_name,
+                "scale": scale.name,
+                "terms": terms,
+                "cumulative_average": _round(cumulative),
+                "cumulative_grade": scale.lookup(cumulative)[0],
+            }
+
+
+def transcript_csv_rows(t: dict) -> Iterator[list]:
+    for term in t["terms"]:
+        for s in term["subjects"]:
+            yield [t["student_id"], t["admission_no"], t["full_name"], t["class_name"], term["term"] or "",
+                   s["subject"], s["total"], s["grade"] or "", "" if s["points"] is None else s["points"]]
+
+
+def to_csv(transcripts: Iterable[dict]) -> str:
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(CSV_HEADER)
+    for t in transcripts:
+        w.writerows(transcript_csv_rows(t))
+    return buf.getvalue()
+
+
+def filename(t: dict, ext: str) -> str:
+    safe = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in str(t["admission_no"] or t["student_id"]))
+    return f"transcript-{safe}.{ext}"
+
+
+def write_zip(transcripts: Iterable[dict], fmt: str) -> str:
+    """Write one json or csv file per transcript into a temporary zip and return its path."""
+    fd, path = tempfile.mkstemp(suffix=".zip")
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for t in transcripts:
+                if fmt == "csv":
+                    zf.writestr(filename(t, "csv"), to_csv([t]))
+                else:
+                    zf.writestr(filename(t, "json"), json.dumps(t))
+    except Exception:
+        # The transcript generator queries lazily; don't leave a partial zip behind
+        os.remove(path)
+        raise
+    return path
+
+
+def class_student_ids(db: Session, class_name: str) -> list[int]:
+    return [sid for (sid,) in db.query(models.Student.id).filter(models.Student.class_name == class_name).order_by(models.Student.id).all()]
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from app.absence_monitor import CHRONIC, CONSECUTIVE, absence_rate, advance, evaluate
+
+
+def _counter():
+    return SimpleNamespace(window_end=None, marked_mask=0, absent_mask=0, consecutive_absences=0,
+                           rate_alerted=False, streak_alerted=False)
+
+
+def test_rolling_window_and_edge_triggered_alerts():
+    c = _counter()
+    start = date(2025, 2, 3)
+    fired = []
+    pattern = [False, False, True, True, True, False, False, False]
+    for i, absent in enumerate(pattern):
+        advance(c, start + timedelta(days=i), absent, window=30)
+        fired.append(evaluate(c))
+    assert fired[4] == [CHRONIC, CONSECUTIVE]  # 3 of 5 absent, third in a row
+    assert all(not kinds for kinds in fired[5:])
+    assert c.consecutive_absences == 0 and not c.streak_alerted and c.rate_alerted
+    assert absence_rate(c) == 37.5
+
+    # Correcting a past day recounts the run; old days drop out of the window
+    advance(c, start + timedelta(days=7), True, window=30)
+    advance(c, start + timedelta(days=6), True, window=30)
+    assert c.consecutive_absences == 2
+    advance(c, start + timedelta(days=60), False, window=30)
+    assert (c.marked_mask, c.absent_mask, absence_rate(c)) == (1, 0, 0.0)
+    assert evaluate(c) == [] and not c.rate_alerted
+
+
+def test_marking_attendance_alerts_parent_and_director_of_studies(db_session):
+    import json
+    import uuid
+
+    from fastapi import BackgroundTasks
+
+    from app import models
+    from app.routers.attendance import attendance_at_risk, mark_attendance
+
+    tag = uuid.uuid4().hex[:8]
+    role = db_session.query(models.Role).filter_by(name="Director of Studies").first() or models.Role(name="Director of Studies")
+    parent = models.User(username=f"parent-{tag}", email=f"parent-{tag}@example.com", full_name="Parent", role="parent", hashed_password="x")
+    # Legacy free-text role deliberately differs from the Role name
+    dos = models.User(username=f"dos-{tag}", email=f"dos-{tag}@example.com", full_name="DOS", role="teacher", hashed_password="x", roles=[role])
+    student = models.Student(admission_number=f"ABS-{tag}", full_name="Absent Student", class_name=f"ABS-{tag}")
+    db_session.add_all([parent, dos, student])
+    db_session.flush()
+    db_session.add(models.ParentStudentLink(parent_user_id=parent.id, student_id=student.id))
+    db_session.commit()
+    user_ids = [parent.id, dos.id]
+
+    try:
+        for day in (date(2031, 3, 3), date(2031, 3, 4), date(2031, 3, 5)):
+            background = BackgroundTasks()
+            mark_attendance({"date": day.isoformat(), "items": [{"student_id": student.id, "status": "absent"}]}, None, background, db_session)
+            for task in background.tasks:
+                task.func(*task.args, **task.kwargs)
+
+        alerted = {
+            n.user_id
+            for n in db_session.query(models.Notification).filter(models.Notification.user_id.in_(user_ids))
+            if json.loads(n.data or "{}").get("alert") == CONSECUTIVE
+        }
+        assert alerted == set(user_ids)
+
+        at_risk = attendance_at_risk(None, db_session, student.class_name)["items"]
+        assert [(r["admission_no"], r["full_name"], r["consecutive"]) for r in at_risk] == [(f"ABS-{tag}", "Absent Student", True)]
+    finally:
+        db_session.rollback()
+        db_session.query(models.Notification).filter(models.Notification.user_id.in_(user_ids)).delete()
+        db_session.query(models.Attendance).filter(models.Attendance.student_id == student.id).delete()
+        db_session.query(models.AbsenceCounter).filter(models.AbsenceCounter.student_id == student.id).delete()
+        db_session.query(models.ParentStudentLink).filter(models.ParentStudentLink.student_id == student.id).delete()
+        db_session.delete(student)
+        db_session.delete(parent)
+        db_session.delete(dos)
+        db_session.commit()
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+from datetime import date, timedelta
+
+from app.attendance_bitmap import ABSENT, LATE, PRESENT, empty, get_code, school_day_index, school_days, set_code, summarise
+
+
+def test_school_day_index_skips_weekends():
+    start = date(2025, 1, 6)  # Monday
+    assert school_day_index(start, start) == 0
+    assert school_day_index(start, date(2025, 1, 10)) == 4
+    assert school_day_index(start, date(2025, 1, 11)) is None  # Saturday
+    assert school_day_index(start, date(2025, 1, 13)) == 5
+    assert school_day_index(start, start - timedelta(days=1)) is None
+    assert school_days(start, date(2025, 1, 19)) == 10
+
+
+def test_summarise_counts_and_streaks():
+    start = date(2025, 1, 6)
+    bits = empty(10)
+    for i, code in enumerate([PRESENT, LATE, ABSENT, ABSENT, PRESENT, ABSENT, ABSENT, ABSENT]):
+        set_code(bits, i, code)
+    set_code(bits, 0, PRESENT)  # overwrite keeps neighbours intact
+    assert get_code(bits, 1) == LATE
+    s = summarise(bytes(bits), 10, start)
+    assert (s["present"], s["late"], s["absent"], s["marked_days"]) == (2, 1, 5, 8)
+    assert s["attendance_rate"] == 37.5
+    assert s["longest_absent_streak"] == 3
+    assert s["current_absent_streak"] == 3  # unmarked trailing days are ignored
+    assert s["absent_by_weekday"] == {"mon": 1, "tue": 1, "wed": 2, "thu": 1, "fri": 0}
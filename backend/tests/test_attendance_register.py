@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import uuid
+from datetime import date
+
+from openpyxl import load_workbook
+from sqlalchemy import inspect, text
+
+from app import models, schema_upgrades
+from app.routers import attendance
+
+
+def test_month_register_json_and_xlsx(db_session):
+    tag = uuid.uuid4().hex[:8]
+    cls = f"RG-{tag}"
+    students = [models.Student(admission_number=f"RG-{tag}-{i}", full_name=f"Register {i}", class_name=cls) for i in range(2)]
+    db_session.add_all(students)
+    db_session.flush()
+    first, second = students
+    db_session.add_all([
+        models.Attendance(student_id=first.id, date=date(2025, 2, 3), status="PRESENT"),
+        models.Attendance(student_id=first.id, date=date(2025, 2, 4), status="ABSENT"),
+        models.Attendance(student_id=second.id, date=date(2025, 2, 28), status="LATE"),
+        models.Attendance(student_id=second.id, date=date(2025, 3, 1), status="ABSENT"),  # next month
+    ])
+    db_session.commit()
+    try:
+        body = attendance.attendance_register(None, db_session, cls, "2025-02", "json")
+        assert (body["start"], body["end"], len(body["weekdays"])) == ("2025-02-01", "2025-02-28", 28)
+        rows = {r["admission_no"]: r for r in body["items"]}
+        assert rows[f"RG-{tag}-0"]["full_name"] == "Register 0"
+        assert rows[f"RG-{tag}-0"]["marks"] == ".." + "PA" + "." * 24
+        assert rows[f"RG-{tag}-1"]["marks"] == "." * 27 + "L"
+
+        response = attendance.attendance_register(None, db_session, cls, "2025-02", "xlsx")
+
+        async def read():
+            return b"".join([chunk async for chunk in response.body_iterator])
+
+        ws = load_workbook(io.BytesIO(asyncio.run(read()))).worksheets[0]
+        header, *sheet_rows = [list(r) for r in ws.iter_rows(values_only=True)]
+        assert header[:4] == ["admission_no", "full_name", 1, 2] and header[-3:] == ["present", "late", "absent"]
+        assert sheet_rows[0][:2] == [f"RG-{tag}-0", "Register 0"]
+        assert sheet_rows[0][4:6] == ["P", "A"] and sheet_rows[0][-3:] == [1, 0, 1]
+    finally:
+        db_session.rollback()
+        ids = [s.id for s in students]
+        db_session.query(models.Attendance).filter(models.Attendance.student_id.in_(ids)).delete()
+        db_session.query(models.Student).filter(models.Student.id.in_(ids)).delete()
+        db_session.commit()
+
+
+def test_day_register_joins_roster_to_marks(db_session):
+    tag = uuid.uuid4().hex[:8]
+    cls = f"DR-{tag}"
+    students = [models.Student(admission_number=f"DR-{tag}-{i}", full_name=f"Day {i}", class_name=cls) for i in range(2)]
+    other = models.Student(admission_number=f"DR-{tag}-x", full_name="Elsewhere", class_name=f"{cls}-other")
+    db_session.add_all(students + [other])
+    db_session.flush()
+    ids = [s.id for s in students] + [other.id]
+    db_session.add_all([
+        models.Attendance(student_id=students[0].id, date=date(2025, 6, 2), status="LATE", remarks="bus"),
+        models.Attendance(student_id=students[1].id, date=date(2025, 6, 3), status="ABSENT"),
+        models.Attendance(student_id=other.id, date=date(2025, 6, 2), status="PRESENT"),
+    ])
+    db_session.commit()
+    try:
+        body = attendance.get_attendance(None, db_session, cls, "2025-06-02")
+        assert body["items"] == [
+            {"student_id": ids[0], "admission_no": f"DR-{tag}-0", "full_name": "Day 0", "class_name": cls, "status": "LATE", "remarks": "bus"},
+            {"student_id": ids[1], "admission_no": f"DR-{tag}-1", "full_name": "Day 1", "class_name": cls, "status": None, "remarks": None},
+        ]
+    finally:
+        db_session.rollback()
+        db_session.query(models.Attendance).filter(models.Attendance.student_id.in_(ids)).delete()
+        db_session.query(models.Student).filter(models.Student.id.in_(ids)).delete()
+        db_session.commit()
+
+
+def test_ensure_indexes_adds_the_register_index_to_older_databases(db_session):
+    def present():
+        return "ix_attendance_date_student" in {ix["name"] for ix in inspect(db_session.connection()).get_indexes("attendance")}
+
+    db_session.execute(text("DROP INDEX ix_attendance_date_student"))
+    db_session.commit()
+    assert not present()
+    assert schema_upgrades.ensure_indexes(db_session) == {"ix_attendance_date_student": "created"}
+    assert present()
+    assert schema_upgrades.ensure_indexes(db_session) == {"ix_attendance_date_student": "present"}
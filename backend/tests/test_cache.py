@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+
+from fastapi import BackgroundTasks
+
+from app import cache, models
+from app.routers import attendance
+
+
+def test_single_flight_and_invalidation():
+    cache.set_backend(cache.MemoryBackend())
+    calls = []
+
+    @cache.cached("test", ttl=60)
+    def report(term, class_name=None):
+        calls.append((term, class_name))
+        time.sleep(0.05)
+        return {"term": term, "n": len(calls)}
+
+    try:
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(report("T1", class_name=" "))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # Eight concurrent callers, one computation; blank strings normalise to None
+        assert len(calls) == 1
+        assert all(r == {"term": "T1", "n": 1} for r in results)
+        assert report("T1") == {"term": "T1", "n": 1}
+
+        cache.invalidate("test")
+        assert report("T1") == {"term": "T1", "n": 2}
+    finally:
+        cache.set_backend(None)
+
+
+def test_memory_backend_refused_with_several_workers(monkeypatch):
+    monkeypatch.setattr(cache.settings, "CACHE_BACKEND", "memory")
+    monkeypatch.setattr(cache.settings, "WEB_CONCURRENCY", 4)
+    cache.set_backend(None)
+    try:
+        # Invalidations would stay in one worker, so the cache is switched off instead
+        assert cache.get_backend() is None
+    finally:
+        cache.set_backend(None)
+
+
+def test_marking_today_keeps_past_attendance_ranges(db_session):
+    cache.set_backend(cache.MemoryBackend())
+    today = date.today()
+    past_start, past_end = today - timedelta(days=40), today - timedelta(days=30)
+    student = models.Student(admission_number=f"C-{uuid.uuid4().hex[:8]}", full_name="Cache Test", class_name="CACHE-1")
+    db_session.add(student)
+    db_session.flush()
+    sid = student.id
+    db_session.add(models.Attendance(student_id=sid, date=past_start, status="PRESENT"))
+    db_session.commit()
+
+    def total():
+        return attendance._attendance_stats(db_session, past_start, past_end, (), "CACHE-1")["items"][0]["total"]
+
+    try:
+        assert total() == 1
+        # A row slipped in behind the cache shows when the entry was recomputed
+        db_session.add(models.Attendance(student_id=sid, date=past_end, status="ABSENT"))
+        db_session.add(models.Attendance(student_id=sid, date=today, status="PRESENT"))
+        attendance._commit_marks(db_session, today, [(sid, "PRESENT")], BackgroundTasks())
+        assert total() == 1
+
+        cache.invalidate(attendance._day_scope(past_end))
+        assert total() == 2
+    finally:
+        cache.set_backend(None)
+        db_session.query(models.Attendance).filter(models.Attendance.student_id == sid).delete()
+        db_session.query(models.AttendanceBitmap).filter(models.AttendanceBitmap.student_id == sid).delete()
+        db_session.delete(student)
+        db_session.commit()
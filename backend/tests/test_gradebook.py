@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import json
+import uuid
+from datetime import date
+from types import SimpleNamespace
+
+from starlette.requests import Request
+
+from app import models
+from app.routers import exams
+
+
+def _request(etag: str | None = None) -> Request:
+    headers = [(b"if-none-match", etag.encode())] if etag else []
+    return Request({"type": "http", "method": "GET", "path": "/exams/gradebook", "headers": headers})
+
+
+def test_gradebook_matrix_and_etag(db_session):
+    tag = uuid.uuid4().hex[:8]
+    cls = f"GB-{tag}"
+    user = SimpleNamespace(id=1, email=None, roles=[SimpleNamespace(name="Director of Studies")])
+    students = [models.Student(admission_number=f"GB-{tag}-{i}", full_name=f"Book {i}", class_name=cls) for i in range(2)]
+    assessments = [
+        models.Assessment(name="Quiz", class_name=cls, subject="Math", term=tag, total_score=20, weight=1.0, date=date(2025, 2, 1)),
+        models.Assessment(name="Exam", class_name=cls, subject="Math", term=tag, total_score=100, weight=3.0, date=date(2025, 3, 1)),
+    ]
+    db_session.add_all(students + assessments)
+    db_session.flush()
+    quiz, exam = assessments
+    db_session.add_all([
+        models.ExamResult(assessment_id=quiz.id, student_id=students[0].id, score=10),
+        models.ExamResult(assessment_id=exam.id, student_id=students[0].id, score=90),
+    ])
+    db_session.commit()
+
+    def fetch(etag=None):
+        return exams.gradebook(_request(etag), user, db_session, cls, tag, None)
+
+    try:
+        first = fetch()
+        body = json.loads(first.body)
+        assert first.status_code == 200
+        assert [a["id"] for a in body["assessments"]] == [quiz.id, exam.id]
+        top, empty = body["rows"]
+        assert (top["admission_no"], top["full_name"], top["scores"]) == (f"GB-{tag}-0", "Book 0", [10.0, 90.0])
+        assert (top["completed"], top["weighted_total"]) == (2, 80.0)
+        assert (empty["scores"], empty["weighted_total"]) == ([None, None], None)
+
+        etag = first.headers["etag"]
+        again = fetch(etag)
+        assert (again.status_code, again.body, again.headers["etag"]) == (304, b"", etag)
+
+        db_session.add(models.ExamResult(assessment_id=quiz.id, student_id=students[1].id, score=5))
+        db_session.commit()
+        changed = fetch(etag)
+        assert changed.status_code == 200 and changed.headers["etag"] != etag
+    finally:
+        db_session.rollback()
+        ids = [a.id for a in assessments]
+        db_session.query(models.ExamResult).filter(models.ExamResult.assessment_id.in_(ids)).delete()
+        db_session.query(models.Assessment).filter(models.Assessment.id.in_(ids)).delete()
+        db_session.query(models.Student).filter(models.Student.class_name == cls).delete()
+        db_session.commit()
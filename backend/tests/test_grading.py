@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import json
+
+from app.analytics_service import compile_scale, rank_values, weighted_totals
+
+
+def test_compiled_scale_lookup_bands():
+    items = json.dumps([
+        {"min": 80, "max": 100, "grade": "A", "point": 4},
+        {"min": 0, "max": 49, "grade": "F", "point": 0},
+        {"min": 50, "max": 79, "grade": "C", "point": 2},
+    ])
+    scale = compile_scale(items, "test")
+    assert scale.lookup(95) == ("A", 4.0)
+    assert scale.lookup(80) == ("A", 4.0)
+    assert scale.lookup(79.9) == ("C", 2.0)
+    assert scale.lookup(10) == ("F", 0.0)
+    assert scale.lookup(None) == (None, None)
+    # compiled once per distinct definition
+    assert compile_scale(items, "test") is scale
+
+
+def test_weighted_totals_normalise_by_total_score_and_weight():
+    rows = [
+        ("math", 80, 100, 1.0),
+        ("math", 45, 50, 3.0),   # 90%
+        ("eng", 30, 60, None),   # 50%, default weight
+        ("eng", None, 100, 1.0),  # missing score ignored
+    ]
+    totals = weighted_totals(rows)
+    assert round(totals["math"], 2) == 87.5
+    assert totals["eng"] == 50.0
+
+
+def test_rank_values_competition_and_dense_ties():
+    pairs = [("a", 90.0), ("b", 85.0), ("c", 85.0), ("d", 70.0)]
+    assert rank_values(pairs, "competition") == {"a": 1, "b": 2, "c": 2, "d": 4}
+    assert rank_values(pairs, "dense") == {"a": 1, "b": 2, "c": 2, "d": 3}
+
+
+def test_class_rankings_skip_zero_weight_subjects(db_session):
+    import uuid
+    from datetime import date
+
+    from app import models
+    from app.analytics_service import class_rankings
+
+    tag = uuid.uuid4().hex[:8]
+    cls = f"ZW-{tag}"
+    students = [models.Student(admission_number=f"ZW-{tag}-{i}", full_name=f"Weight {i}", class_name=cls) for i in range(2)]
+    math = models.Assessment(name="Exam", class_name=cls, subject="Math", term=tag, total_score=100, weight=1.0, date=date(2025, 3, 1))
+    # A practice paper weighted zero: no subject total rather than a division by zero
+    art = models.Assessment(name="Practice", class_name=cls, subject="Art", term=tag, total_score=100, weight=0.0, date=date(2025, 3, 1))
+    db_session.add_all(students + [math, art])
+    db_session.flush()
+    db_session.add_all([
+        models.ExamResult(assessment_id=math.id, student_id=students[0].id, score=60),
+        models.ExamResult(assessment_id=math.id, student_id=students[1].id, score=80),
+        models.ExamResult(assessment_id=art.id, student_id=students[0].id, score=99),
+    ])
+    db_session.commit()
+    try:
+        out = class_rankings.uncached(db_session, tag, cls)
+        assert [s["subject"] for s in out["subjects"]] == ["Math"]
+        assert [(s["student_id"], s["average"], s["position"]) for s in out["students"]] == [
+            (students[1].id, 80.0, 1),
+            (students[0].id, 60.0, 2),
+        ]
+    finally:
+        db_session.rollback()
+        db_session.query(models.ExamResult).filter(models.ExamResult.assessment_id.in_([math.id, art.id])).delete()
+        db_session.query(models.Assessment).filter(models.Assessment.term == tag).delete()
+        db_session.query(models.Student).filter(models.Student.class_name == cls).delete()
+        db_session.commit()
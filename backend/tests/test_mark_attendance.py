@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import uuid
+from datetime import date
+
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+
+from app import models
+from app.routers.attendance import mark_attendance
+
+
+def test_mark_attendance_upserts_and_reports_the_bad_item(db_session):
+    tag = uuid.uuid4().hex[:8]
+    students = [models.Student(admission_number=f"MA-{tag}-{i}", full_name=f"Mark {i}", class_name=f"MA-{tag}") for i in range(2)]
+    db_session.add_all(students)
+    db_session.commit()
+    first, second = (s.id for s in students)
+    day = date(2031, 4, 7)
+
+    def mark(items):
+        return mark_attendance({"date": day.isoformat(), "items": items}, None, BackgroundTasks(), db_session)
+
+    def marks():
+        rows = db_session.query(models.Attendance).filter(models.Attendance.student_id.in_([first, second])).all()
+        return {r.student_id: (r.status, r.remarks) for r in rows}
+
+    try:
+        assert mark([{"student_id": first, "status": "present"}, {"student_id": second, "status": "absent", "remarks": "ill"}])["count"] == 2
+        # Re-marking updates in place; the last item for a student wins
+        assert mark([{"student_id": first, "status": "absent"}, {"student_id": first, "status": "late", "remarks": "bus"}])["count"] == 1
+        assert marks() == {first: ("LATE", "bus"), second: ("ABSENT", "ill")}
+
+        for bad, index in (
+            ([{"student_id": first, "status": "present"}, {"student_id": second, "status": "excused"}], 1),
+            ([{"student_id": "x", "status": "present"}], 0),
+            ([{"student_id": first, "status": "present"}, "absent"], 1),
+        ):
+            with pytest.raises(HTTPException) as exc:
+                mark(bad)
+            assert exc.value.status_code == 400 and exc.value.detail["index"] == index
+        # A rejected register writes nothing
+        assert marks() == {first: ("LATE", "bus"), second: ("ABSENT", "ill")}
+    finally:
+        db_session.rollback()
+        ids = [first, second]
+        db_session.query(models.Attendance).filter(models.Attendance.student_id.in_(ids)).delete()
+        db_session.query(models.AttendanceBitmap).filter(models.AttendanceBitmap.student_id.in_(ids)).delete()
+        db_session.query(models.Student).filter(models.Student.id.in_(ids)).delete()
+        db_session.commit()
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import uuid
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+from openpyxl import load_workbook
+
+from app import models
+from app.routers import exams
+
+
+def _body(response) -> bytes:
+    async def read():
+        return b"".join([chunk async for chunk in response.body_iterator])
+
+    return asyncio.run(read())
+
+
+def test_mark_sheet_round_trip_and_assessment_mismatch(db_session):
+    tag = uuid.uuid4().hex[:8]
+    cls = f"MS-{tag}"
+    user = SimpleNamespace(id=1, email=None, roles=[SimpleNamespace(name="Director of Studies")])
+    st = models.Student(admission_number=f"MS-{tag}", full_name="Sheet Student", class_name=cls)
+    assessments = [
+        models.Assessment(name=name, class_name=cls, subject="Math", term=tag, total_score=100, date=date(2025, 4, 1))
+        for name in ("Quiz", "Exam")
+    ]
+    db_session.add_all([st] + assessments)
+    db_session.commit()
+    quiz, exam = assessments
+    try:
+        sheet = _body(exams.download_mark_sheet(quiz.id, user, db_session))
+        wb = load_workbook(io.BytesIO(sheet))
+        ws = wb.worksheets[0]
+        student_row = next(r for r in ws.iter_rows() if r[0].value == st.id)
+        assert (student_row[1].value, student_row[2].value) == (f"MS-{tag}", "Sheet Student")
+        student_row[3].value = 72
+        buf = io.BytesIO()
+        wb.save(buf)
+
+        def upload(assessment_id):
+            buf.seek(0)
+            return exams.upload_mark_sheet(assessment_id, user, BackgroundTasks(), SimpleNamespace(file=buf), db_session)
+
+        # The quiz's sheet posted to the exam's URL must not land on the quiz
+        with pytest.raises(HTTPException) as exc:
+            upload(exam.id)
+        assert exc.value.status_code == 400
+        assert exc.value.detail["errors"][0]["error"] == f"sheet is for assessment {quiz.id}, not {exam.id}"
+        assert db_session.query(models.ExamResult).filter(models.ExamResult.student_id == st.id).count() == 0
+
+        out = upload(quiz.id)
+        assert (out["inserted"], out["updated"]) == (1, 0)
+        row = db_session.query(models.ExamResult).filter(models.ExamResult.student_id == st.id).one()
+        assert (row.assessment_id, row.score) == (quiz.id, 72.0)
+    finally:
+        db_session.rollback()
+        ids = [a.id for a in assessments]
+        db_session.query(models.ExamResult).filter(models.ExamResult.assessment_id.in_(ids)).delete()
+        db_session.query(models.Assessment).filter(models.Assessment.id.in_(ids)).delete()
+        db_session.query(models.Student).filter(models.Student.id == st.id).delete()
+        db_session.commit()
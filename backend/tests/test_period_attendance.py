@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import uuid
+from datetime import date
+
+from app import models
+from app.period_attendance import first_concerns, mark_periods, rollup_daily
+from app.routers import attendance
+
+
+def test_daily_status_rolls_up_from_period_marks(db_session):
+    d = date(2025, 5, 6)
+    tag = uuid.uuid4().hex[:8]
+    students = [models.Student(admission_number=f"PA-{tag}-{i}", full_name=f"Period {i}", class_name=f"PA-{tag}") for i in range(3)]
+    db_session.add_all(students)
+    db_session.flush()
+    ids = [s.id for s in students]
+    present, absent, mixed = ids
+    try:
+        db_session.add(models.Attendance(student_id=mixed, date=d, status="PRESENT", remarks="kept"))
+        db_session.flush()
+        marks = {present: ["PRESENT", "PRESENT"], absent: ["ABSENT", "ABSENT"], mixed: ["PRESENT", "ABSENT"]}
+        for period in (1, 2):
+            mark_periods(db_session, d, [
+                {"student_id": sid, "period_index": period, "slot_id": None, "status": statuses[period - 1], "remarks": None}
+                for sid, statuses in marks.items()
+            ])
+        changed = rollup_daily(db_session, d, marks)
+        db_session.commit()
+        assert sorted(changed) == sorted([(present, None, "PRESENT"), (absent, None, "ABSENT"), (mixed, "PRESENT", "LATE")])
+        assert sorted(first_concerns(changed)) == sorted([(absent, "ABSENT"), (mixed, "LATE")])
+        row = db_session.query(models.Attendance).filter_by(student_id=mixed, date=d).one()
+        assert (row.status, row.remarks) == ("LATE", "kept")
+
+        # Re-marking only reports students whose daily status moved; ABSENT -> LATE is not news to parents
+        mark_periods(db_session, d, [{"student_id": absent, "period_index": 2, "slot_id": None, "status": "PRESENT", "remarks": None}])
+        changed = rollup_daily(db_session, d, [present, absent])
+        assert changed == [(absent, "ABSENT", "LATE")]
+        assert first_concerns(changed) == []
+        db_session.commit()
+    finally:
+        db_session.rollback()
+        db_session.query(models.PeriodAttendance).filter(models.PeriodAttendance.student_id.in_(ids)).delete()
+        db_session.query(models.Attendance).filter(models.Attendance.student_id.in_(ids)).delete()
+        db_session.query(models.Student).filter(models.Student.id.in_(ids)).delete()
+        db_session.commit()
+
+
+def test_lesson_register_lists_roster_with_period_marks(db_session):
+    tag = uuid.uuid4().hex[:8]
+    cls = f"PR-{tag}"
+    students = [models.Student(admission_number=f"PR-{tag}-{i}", full_name=f"Lesson {i}", class_name=cls) for i in range(2)]
+    slot = models.TimetableSlot(term=tag, day_of_week="Tue", period_index=3, class_name=cls, subject="Math")
+    db_session.add_all(students + [slot])
+    db_session.flush()
+    ids = [s.id for s in students]
+    try:
+        mark_periods(db_session, date(2025, 5, 6), [
+            {"student_id": ids[0], "period_index": 3, "slot_id": slot.id, "status": "ABSENT", "remarks": "sick"},
+        ])
+        db_session.commit()
+        body = attendance.get_period_attendance(None, db_session, "2025-05-06", slot.id)
+        assert (body["period_index"], body["class_name"], body["subject"]) == (3, cls, "Math")
+        assert body["items"] == [
+            {"student_id": ids[0], "admission_no": f"PR-{tag}-0", "full_name": "Lesson 0", "status": "ABSENT", "remarks": "sick"},
+            {"student_id": ids[1], "admission_no": f"PR-{tag}-1", "full_name": "Lesson 1", "status": None, "remarks": None},
+        ]
+    finally:
+        db_session.rollback()
+        db_session.query(models.PeriodAttendance).filter(models.PeriodAttendance.student_id.in_(ids)).delete()
+        db_session.query(models.TimetableSlot).filter(models.TimetableSlot.term == tag).delete()
+        db_session.query(models.Student).filter(models.Student.id.in_(ids)).delete()
+        db_session.commit()
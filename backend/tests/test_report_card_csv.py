@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import asyncio
+import uuid
+from datetime import date
+from types import SimpleNamespace
+
+from app import models
+from app.routers import report_cards
+
+
+def _text(response) -> str:
+    async def read():
+        return "".join([chunk async for chunk in response.body_iterator])
+
+    return asyncio.run(read())
+
+
+def test_report_card_csvs_stream_filtered_rows(db_session):
+    tag = uuid.uuid4().hex[:8]
+    cls = f"CSV-{tag}"
+    students = [models.Student(admission_number=f"CSV-{tag}-{i}", full_name=f"Csv {i}", class_name=cls) for i in range(2)]
+    outsider = models.Student(admission_number=f"CSV-{tag}-x", full_name="Other", class_name=f"{cls}-x")
+    this_term = models.Assessment(name="Exam", class_name=cls, subject="Math", term=tag, total_score=100, date=date(2025, 5, 1))
+    other_term = models.Assessment(name="Old", class_name=cls, subject="Art", term=f"{tag}-old", total_score=100, date=date(2024, 5, 1))
+    user = models.User(username=f"csv-{tag}", email=f"csv-{tag}@example.com", full_name="Csv", role="student", hashed_password="x")
+    db_session.add_all(students + [outsider, this_term, other_term, user])
+    db_session.flush()
+    first, second = (s.id for s in students)
+    db_session.add_all([
+        models.ExamResult(assessment_id=this_term.id, student_id=second, score=61.5),
+        models.ExamResult(assessment_id=this_term.id, student_id=first, score=70),
+        models.ExamResult(assessment_id=this_term.id, student_id=outsider.id, score=99),
+        models.ExamResult(assessment_id=other_term.id, student_id=first, score=40),
+        models.UserStudentLink(user_id=user.id, student_id=second),
+    ])
+    db_session.commit()
+    staff = SimpleNamespace(id=0, roles=[SimpleNamespace(name="Teacher")])
+    student = SimpleNamespace(id=user.id, roles=[SimpleNamespace(name="Student")])
+    try:
+        response = report_cards.class_report_cards_csv(None, tag, cls)
+        assert response.headers["content-disposition"] == f"attachment; filename=class-report-cards-{tag}-{cls}.csv"
+        assert _text(response).splitlines() == [
+            "student_id,assessment_id,subject,score",
+            f"{first},{this_term.id},Math,70.0",
+            f"{second},{this_term.id},Math,61.5",
+        ]
+
+        by_staff = _text(report_cards.student_report_card_csv(staff, None, db_session, first, None))
+        assert by_staff.splitlines() == [
+            "assessment_id,subject,score",
+            f"{this_term.id},Math,70.0",
+            f"{other_term.id},Art,40.0",
+        ]
+        # A student always gets their own card, whatever student_id they ask for
+        own = _text(report_cards.student_report_card_csv(student, None, db_session, first, tag))
+        assert own.splitlines() == ["assessment_id,subject,score", f"{this_term.id},Math,61.5"]
+
+        # Rows are flushed in chunks; the header comes first on its own
+        chunks = list(report_cards._stream_csv(
+            "h", lambda db: report_cards._results_for_term(db, tag, class_name=cls), lambda r: f"{r.score}\n", chunk_rows=1,
+        ))
+        assert chunks == ["h\n", "70.0\n", "61.5\n"]
+    finally:
+        db_session.rollback()
+        ids = [this_term.id, other_term.id]
+        db_session.query(models.UserStudentLink).filter(models.UserStudentLink.user_id == user.id).delete()
+        db_session.query(models.ExamResult).filter(models.ExamResult.assessment_id.in_(ids)).delete()
+        db_session.query(models.Assessment).filter(models.Assessment.id.in_(ids)).delete()
+        db_session.query(models.Student).filter(models.Student.admission_number.like(f"CSV-{tag}-%")).delete(synchronize_session=False)
+        db_session.query(models.User).filter(models.User.id == user.id).delete()
+        db_session.commit()
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from app import models, pdf, report_card_jobs
+
+
+def _seed_class(db, tag: str) -> tuple[str, list[int], list[int]]:
+    cls = f"RC-{tag}"
+    students = [
+        models.Student(admission_number=f"RC-{tag}-{i}", full_name=f"Card Student {i}", class_name=cls)
+        for i in range(2)
+    ]
+    assessments = [
+        models.Assessment(name=f"{subject} test", class_name=cls, subject=subject, term=tag, total_score=50, date=date(2025, 3, 1))
+        for subject in ("Math", "English")
+    ]
+    db.add_all(students + assessments)
+    db.flush()
+    for a in assessments:
+        db.add_all([
+            models.ExamResult(assessment_id=a.id, student_id=students[0].id, score=45),
+            models.ExamResult(assessment_id=a.id, student_id=students[1].id, score=30),
+        ])
+    db.commit()
+    return cls, [s.id for s in students], [a.id for a in assessments]
+
+
+def _cleanup(db, student_ids, assessment_ids):
+    db.rollback()
+    db.query(models.ExamResult).filter(models.ExamResult.assessment_id.in_(assessment_ids)).delete()
+    db.query(models.Assessment).filter(models.Assessment.id.in_(assessment_ids)).delete()
+    db.query(models.Student).filter(models.Student.id.in_(student_ids)).delete()
+    db.commit()
+
+
+def test_collect_cards_for_a_seeded_class(db_session):
+    tag = uuid.uuid4().hex[:8]
+    cls, student_ids, assessment_ids = _seed_class(db_session, tag)
+    try:
+        cards = report_card_jobs.collect_cards(db_session, tag, [cls])
+        assert [(c["student_id"], c["admission_no"], c["full_name"]) for c in cards] == [
+            (student_ids[0], f"RC-{tag}-0", "Card Student 0"),
+            (student_ids[1], f"RC-{tag}-1", "Card Student 1"),
+        ]
+        top = cards[0]
+        assert [s["subject"] for s in top["subjects"]] == ["English", "Math"]
+        assert top["average"] == 90.0 and top["position"] == 1 and top["out_of"] == 2
+        assert cards[1]["position"] == 2
+    finally:
+        _cleanup(db_session, student_ids, assessment_ids)
+
+
+def test_run_job_zips_one_pdf_per_student(db_session, monkeypatch, tmp_path):
+    monkeypatch.setattr(report_card_jobs.settings, "REPORT_CARD_DIR", str(tmp_path))
+    monkeypatch.setattr(report_card_jobs.settings, "REPORT_CARD_WORKERS", 2)
+    # Threads share the patched renderer; WeasyPrint's system libraries are not needed
+    monkeypatch.setattr(report_card_jobs, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(pdf, "render_report_cards", lambda cards: [c["full_name"].encode() for c in cards])
+    tag = uuid.uuid4().hex[:8]
+    cls, student_ids, assessment_ids = _seed_class(db_session, tag)
+    try:
+        job = report_card_jobs.start_job(tag, class_name=cls)
+        report_card_jobs.run_job(job["id"])
+        done = report_card_jobs.get_job(job["id"])
+        assert (done["status"], done["total"], done["done"], done["error"]) == ("done", 2, 2, None)
+        with zipfile.ZipFile(report_card_jobs.zip_path(job["id"])) as zf:
+            assert zf.read(f"{cls}/RC-{tag}-1.pdf") == b"Card Student 1"
+            assert len(zf.namelist()) == 2
+    finally:
+        _cleanup(db_session, student_ids, assessment_ids)
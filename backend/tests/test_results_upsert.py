@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import uuid
+from datetime import date
+
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+
+from app import models
+from app.routers import exams
+
+
+def test_upsert_results_outcomes_roster_and_cube(db_session):
+    tag = uuid.uuid4().hex[:8]
+    cls = f"UP-{tag}"
+    students = [models.Student(admission_number=f"UP-{tag}-{i}", full_name=f"Upsert {i}", class_name=cls) for i in range(2)]
+    outsider = models.Student(admission_number=f"UP-{tag}-x", full_name="Other class", class_name=f"{cls}-x")
+    a = models.Assessment(name="Exam", class_name=cls, subject="Math", term=tag, total_score=100, date=date(2025, 5, 1))
+    db_session.add_all(students + [outsider, a])
+    db_session.commit()
+    first, second = (s.id for s in students)
+
+    def post(items):
+        return exams.upsert_results({"assessment_id": a.id, "items": items}, None, BackgroundTasks(), db_session)
+
+    def cell():
+        c = db_session.query(models.AnalyticsCube).filter_by(term=tag, class_name=cls, subject="Math").one()
+        db_session.refresh(c)
+        return c.result_count, c.score_sum, c.min_score, c.max_score
+
+    try:
+        out = post([{"student_id": first, "score": 40}, {"student_id": second, "score": "70"}])
+        assert (out["inserted"], out["updated"]) == (2, 0)
+        assert cell() == (2, 110.0, 40.0, 70.0)
+
+        # Last item per student wins; existing rows report "updated" and adjust the cube by the difference
+        out = post([{"student_id": first, "score": 10}, {"student_id": first, "score": 55}])
+        assert out["items"] == [{"student_id": first, "score": 55.0, "outcome": "updated"}]
+        assert cell() == (2, 125.0, 55.0, 70.0)
+
+        with pytest.raises(HTTPException) as exc:
+            post([{"student_id": second, "score": 90}, {"student_id": outsider.id, "score": 50}, {"student_id": -1, "score": 1}])
+        assert exc.value.status_code == 400
+        assert exc.value.detail["student_ids"] == sorted([outsider.id, -1])
+        # Nothing from the rejected batch was written
+        db_session.rollback()
+        assert cell() == (2, 125.0, 55.0, 70.0)
+
+        with pytest.raises(HTTPException) as exc:
+            post([{"student_id": first, "score": 1}, {"student_id": second, "score": -5}, {"score": 3}])
+        assert [e["index"] for e in exc.value.detail["errors"]] == [1, 2]
+    finally:
+        db_session.rollback()
+        db_session.query(models.ExamResult).filter(models.ExamResult.assessment_id == a.id).delete()
+        db_session.query(models.AnalyticsCube).filter(models.AnalyticsCube.term == tag).delete()
+        db_session.query(models.Assessment).filter(models.Assessment.id == a.id).delete()
+        db_session.query(models.Student).filter(models.Student.admission_number.like(f"UP-{tag}-%")).delete(synchronize_session=False)
+        db_session.commit()
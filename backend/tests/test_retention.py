@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime, timezone
+
+from app import models
+from app.retention import purge_notifications, read_archive, read_archive_file
+
+
+def _old_notifications(db, n: int) -> list[int]:
+    rows = [
+        models.Notification(
+            user_id=1,
+            type=models.NotificationType.GRADE_UPDATED,
+            title=f"Old {i}",
+            message="archived",
+            created_at=datetime(2000, 1, 1, tzinfo=timezone.utc),
+        )
+        for i in range(n)
+    ]
+    db.add_all(rows)
+    db.commit()
+    return [r.id for r in rows]
+
+
+def test_purge_round_trips_through_table_archive(db_session):
+    ids = _old_notifications(db_session, 5)
+    summary = purge_notifications(db_session, days_old=3650, batch_size=2, pause_seconds=0, archive="table")
+    assert summary["deleted"] == 5
+    assert db_session.query(models.Notification).filter(models.Notification.id.in_(ids)).count() == 0
+
+    batches = (
+        db_session.query(models.NotificationArchive)
+        .filter(models.NotificationArchive.first_notification_id >= ids[0], models.NotificationArchive.last_notification_id <= ids[-1])
+        .order_by(models.NotificationArchive.first_notification_id)
+        .all()
+    )
+    archived = [row for b in batches for row in read_archive(b)]
+    assert [r["id"] for r in archived] == ids
+    assert archived[0]["title"] == "Old 0" and archived[0]["type"] == "grade_updated"
+
+
+def test_purge_round_trips_through_ndjson_archive(db_session, tmp_path):
+    ids = _old_notifications(db_session, 3)
+    summary = purge_notifications(
+        db_session, days_old=3650, batch_size=2, pause_seconds=0, archive="ndjson", archive_dir=str(tmp_path)
+    )
+    assert summary["deleted"] == 3
+    assert [r["id"] for r in read_archive_file(summary["archive_path"])] == ids
+    # Batches are staged then appended after commit; nothing is left half-written
+    assert [p.name for p in tmp_path.iterdir()] == [os.path.basename(summary["archive_path"])]
+
+
+def test_purge_batches_skip_kept_rows_and_id_gaps(db_session):
+    ids = _old_notifications(db_session, 2)
+    recent = models.Notification(user_id=1, type=models.NotificationType.GRADE_UPDATED, title="Recent", message="kept")
+    db_session.add(recent)
+    db_session.commit()
+    ids += _old_notifications(db_session, 3)
+    progress = []
+    try:
+        summary = purge_notifications(db_session, days_old=3650, batch_size=2, pause_seconds=0, on_progress=progress.append)
+        # Full batches of expired rows: the kept row in between never shortens one
+        assert (summary["deleted"], summary["batches"]) == (5, 3)
+        assert [p["through_id"] for p in progress] == [ids[1], ids[3], ids[4]]
+        assert progress[-1]["percent"] == 100.0
+        assert db_session.query(models.Notification).filter(models.Notification.id == recent.id).count() == 1
+    finally:
+        db_session.query(models.Notification).filter(models.Notification.id == recent.id).delete()
+        db_session.commit()
@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+import asyncio
+import json
+
+from app import main, report_card_jobs
+
+
+def test_lifespan_runs_startup_tasks(monkeypatch, tmp_path):
+    jobs = tmp_path / "report_cards"
+    monkeypatch.setattr(report_card_jobs.settings, "REPORT_CARD_DIR", str(jobs))
+    # Importing the app touches neither the database upgrades nor the job directory
+    assert not jobs.exists()
+    jobs.mkdir()
+    (jobs / "gone.json").write_text(json.dumps({
+        "id": "gone", "status": "rendering", "created_at": "2000-01-01T00:00:00+00:00", "heartbeat_at": "2000-01-01T00:00:00+00:00",
+    }))
+
+    async def serve():
+        async with main.lifespan(main.app):
+            pass
+
+    asyncio.run(serve())
+    assert json.loads((jobs / "gone.json").read_text())["status"] == "failed"
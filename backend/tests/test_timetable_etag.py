@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import json
+import uuid
+from types import SimpleNamespace
+
+from starlette.requests import Request
+
+from app import cache, models
+from app.routers import timetable
+
+
+def _user(user_id: int, email: str, *roles: str):
+    return SimpleNamespace(id=user_id, email=email, roles=[SimpleNamespace(name=r) for r in roles])
+
+
+def _request(etag: str | None = None) -> Request:
+    headers = [(b"if-none-match", etag.encode())] if etag else []
+    return Request({"type": "http", "method": "GET", "path": "/timetable/teacher", "headers": headers})
+
+
+def test_teacher_timetable_etags_and_teacher_override(db_session):
+    cache.set_backend(cache.MemoryBackend())
+    tag = uuid.uuid4().hex[:8]
+    term = f"ETAG-{tag}"
+    manager = _user(7001, f"dos-{tag}@example.com", "Director of Studies")
+    teacher = _user(7002, f"teacher-{tag}@example.com", "Teacher")
+    # Slots reference Teacher rows, resolved from users by email; the ids differ from the user ids
+    profiles = [models.Teacher(email=u.email, full_name=f"Teacher {u.id}") for u in (teacher, manager)]
+    db_session.add_all(profiles)
+    db_session.commit()
+    teacher_id, manager_teacher_id = (p.id for p in profiles)
+    assert {teacher_id, manager_teacher_id}.isdisjoint({teacher.id, manager.id})
+
+    def fetch(user, etag=None, teacher_id=None):
+        return timetable.teacher_timetable(_request(etag), user, db_session, term, teacher_id)
+
+    try:
+        timetable.create_slot(
+            {"term": term, "day_of_week": "Mon", "period_index": 1, "class_name": "S1A", "subject": "Math", "teacher_id": teacher_id},
+            manager, db_session,
+        )
+        first = fetch(teacher)
+        etag = first.headers["etag"]
+        assert first.status_code == 200 and json.loads(first.body)["items"][0]["subject"] == "Math"
+
+        # A matching If-None-Match gets an empty 304 with the same ETag
+        again = fetch(teacher, etag)
+        assert (again.status_code, again.body, again.headers["etag"]) == (304, b"", etag)
+
+        # Every kind of timetable write yields a new representation
+        seen = {etag}
+        writes = [
+            lambda: timetable.create_slot(
+                {"term": term, "day_of_week": "Tue", "period_index": 2, "class_name": "S1B", "subject": "Math", "teacher_id": teacher_id},
+                manager, db_session,
+            ),
+            lambda: timetable.create_allocation(
+                {"term": term, "class_name": "S1A", "subject": "Math", "required_per_week": 4, "teacher_id": teacher_id},
+                manager, db_session,
+            ),
+            lambda: timetable.upsert_config({"term": term, "days": ["Mon", "Tue"], "blocks": [{"periods": 4}]}, manager, db_session),
+        ]
+        for write in writes:
+            write()
+            r = fetch(teacher, etag)
+            assert r.status_code == 200 and r.headers["etag"] not in seen
+            etag = r.headers["etag"]
+            seen.add(etag)
+
+        # Teachers cannot read another teacher's week; managers can
+        other = json.loads(fetch(teacher, teacher_id=manager_teacher_id).body)
+        assert other["teacher_id"] == teacher_id
+        chosen = json.loads(fetch(manager, teacher_id=teacher_id).body)
+        assert chosen["teacher_id"] == teacher_id and len(chosen["items"]) == 2
+        own = json.loads(fetch(manager).body)
+        assert own["teacher_id"] == manager_teacher_id and own["items"] == []
+    finally:
+        cache.set_backend(None)
+        db_session.rollback()
+        for model in (models.TimetableSlot, models.SubjectAllocation, models.TimetableConfig):
+            db_session.query(model).filter(model.term == term).delete()
+        db_session.query(models.Teacher).filter(models.Teacher.email.in_([teacher.email, manager.email])).delete()
+        db_session.commit()
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from collections import Counter
+
+from app.timetable_generator import periods_per_day, solve
+
+
+def test_solve_places_every_lesson_without_clashes():
+    days = ["Mon", "Tue", "Wed", "Thu", "Fri"]
+    requirements = []
+    for i, cls in enumerate(["S1A", "S1B", "S1C", "S1D"]):
+        requirements += [
+            {"class_name": cls, "subject": "Math", "teacher_id": 1 + i % 2, "count": 5},
+            {"class_name": cls, "subject": "Eng", "teacher_id": 3 + i % 2, "count": 4},
+            {"class_name": cls, "subject": "Sci", "teacher_id": 5, "count": 3},
+        ]
+    fixed = [{"class_name": "S1A", "subject": "Sci", "teacher_id": 5, "day_of_week": "Mon", "period_index": 1}]
+    out = solve(days, periods_per_day([{"periods": 3}, {"minutes": 20}, {"periods": 3}]), requirements, fixed, time_budget=5)
+
+    assert out["unplaced"] == []
+    slots = out["slots"] + fixed
+    assert len(slots) == 4 * 12
+    assert max(Counter((s["day_of_week"], s["period_index"], s["class_name"]) for s in slots).values()) == 1
+    assert max(Counter((s["day_of_week"], s["period_index"], s["teacher_id"]) for s in slots).values()) == 1
+    assert all(1 <= s["period_index"] <= 6 for s in slots)
+    # Five maths lessons over five days: one a day once the search has spread them
+    assert set(Counter((s["class_name"], s["day_of_week"]) for s in slots if s["subject"] == "Math").values()) == {1}
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app import models
+from app.routers import timetable
+
+MANAGER = SimpleNamespace(id=1, email=None, roles=[SimpleNamespace(name="Director of Studies")])
+
+
+def _slot(term, class_name, **extra):
+    return {"term": term, "day_of_week": "Mon", "period_index": 1, "class_name": class_name, "subject": "Math", **extra}
+
+
+def test_slot_clashes_are_409_and_blank_room_or_teacher_is_unassigned(db_session, monkeypatch):
+    term = f"SLOT-{uuid.uuid4().hex[:8]}"
+    try:
+        first = timetable.create_slot(_slot(term, "S1A", teacher_id=5, room="Lab"), MANAGER, db_session)["id"]
+
+        with pytest.raises(HTTPException) as exc:
+            timetable.create_slot(_slot(term, "S1B", teacher_id="5"), MANAGER, db_session)
+        assert exc.value.status_code == 409
+        assert exc.value.detail["conflicts"] == [
+            {"type": "teacher_double_book", "teacher_id": 5, "slot_id": first, "class_name": "S1A", "subject": "Math"}
+        ]
+
+        # Blank rooms and teachers are stored as NULL and never clash with each other
+        for cls in ("S1B", "S1C"):
+            timetable.create_slot(_slot(term, cls, teacher_id="", room="  "), MANAGER, db_session)
+        blank = db_session.query(models.TimetableSlot).filter_by(term=term, class_name="S1C").one()
+        assert (blank.room, blank.teacher_id) == (None, None)
+
+        with pytest.raises(HTTPException) as exc:
+            timetable.update_slot(blank.id, {"room": "Lab"}, MANAGER, db_session)
+        assert exc.value.status_code == 409 and exc.value.detail["conflicts"][0]["type"] == "room_double_book"
+
+        # A writer that slips in after the pre-check trips the unique index: still a 409 with the conflict
+        checks = iter([[]])
+        real = timetable._slot_clashes
+        monkeypatch.setattr(timetable, "_slot_clashes", lambda db, slot: next(checks, None) or real(db, slot))
+        with pytest.raises(HTTPException) as exc:
+            timetable.update_slot(blank.id, {"teacher_id": 5}, MANAGER, db_session)
+        assert exc.value.status_code == 409
+        assert [c["slot_id"] for c in exc.value.detail["conflicts"]] == [first]
+        db_session.refresh(blank)
+        assert blank.teacher_id is None
+    finally:
+        db_session.rollback()
+        db_session.query(models.TimetableSlot).filter(models.TimetableSlot.term == term).delete()
+        db_session.commit()
+
+
+def test_conflicts_report_double_bookings_and_allocation_coverage(db_session):
+    from sqlalchemy import text
+
+    from app import timetable_integrity
+
+    term = f"CONF-{uuid.uuid4().hex[:8]}"
+    T = models.TimetableSlot
+    try:
+        # Databases that predate uq_slot_teacher can still hold a teacher double-booking
+        db_session.execute(text("DROP INDEX uq_slot_teacher"))
+        db_session.add_all([
+            T(term=term, day_of_week="Mon", period_index=1, class_name="S1A", subject="Math", teacher_id=9),
+            T(term=term, day_of_week="Mon", period_index=1, class_name="S1B", subject="Math", teacher_id=9),
+            T(term=term, day_of_week="Tue", period_index=1, class_name="S1A", subject="Math"),
+            T(term=term, day_of_week="Tue", period_index=2, class_name="S1A", subject="Art"),
+            models.SubjectAllocation(term=term, class_name="S1A", subject="Math", required_per_week=2),
+            models.SubjectAllocation(term=term, class_name="S1B", subject="Math", required_per_week=2),
+            models.SubjectAllocation(term=term, class_name="S1A", subject="Art", required_per_week=0),
+        ])
+        db_session.commit()
+        slots = {(s.day_of_week, s.period_index, s.class_name): s.id for s in db_session.query(T).filter(T.term == term)}
+
+        found = timetable.conflicts(MANAGER, db_session, term)["conflicts"]
+        assert found == [
+            {"type": "teacher_double_book", "day": "Mon", "period_index": 1, "teacher_id": 9,
+             "slots": [slots[("Mon", 1, "S1A")], slots[("Mon", 1, "S1B")]]},
+            {"type": "allocation_deficit", "class_name": "S1B", "subject": "Math", "required": 2, "assigned": 1},
+            {"type": "allocation_excess", "class_name": "S1A", "subject": "Art", "required": 0, "assigned": 1},
+        ]
+    finally:
+        db_session.rollback()
+        db_session.query(T).filter(T.term == term).delete()
+        db_session.query(models.SubjectAllocation).filter(models.SubjectAllocation.term == term).delete()
+        db_session.commit()
+        assert timetable_integrity.ensure_unique_indexes(db_session)["uq_slot_teacher"]["status"] in ("created", "present")
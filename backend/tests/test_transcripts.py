@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import uuid
+import zipfile
+from datetime import date
+
+import pytest
+
+from app import models, transcripts
+
+
+def test_transcripts_zip_and_partial_zip_cleanup(db_session):
+    tag = uuid.uuid4().hex[:8]
+    st = models.Student(admission_number=f"TR-{tag}", full_name="Transcript Student", class_name=f"TR-{tag}")
+    db_session.add(st)
+    db_session.flush()
+    a = models.Assessment(name="Mid", class_name=st.class_name, subject="Math", term=tag, total_score=50, date=date(2025, 2, 1))
+    db_session.add(a)
+    db_session.flush()
+    db_session.add(models.ExamResult(assessment_id=a.id, student_id=st.id, score=40))
+    db_session.commit()
+    path = None
+    try:
+        path = transcripts.write_zip(transcripts.build_transcripts(db_session, [st.id]), "json")
+        with zipfile.ZipFile(path) as zf:
+            t = json.loads(zf.read(f"transcript-TR-{tag}.json"))
+        assert (t["admission_no"], t["full_name"]) == (f"TR-{tag}", "Transcript Student")
+        assert t["terms"][0]["subjects"][0]["total"] == 80.0
+
+        def failing():
+            yield t
+            raise RuntimeError("database went away")
+
+        before = set(os.listdir(tempfile.gettempdir()))
+        with pytest.raises(RuntimeError):
+            transcripts.write_zip(failing(), "csv")
+        assert set(os.listdir(tempfile.gettempdir())) - before == set()
+    finally:
+        if path:
+            os.remove(path)
+        db_session.rollback()
+        db_session.query(models.ExamResult).filter(models.ExamResult.assessment_id == a.id).delete()
+        db_session.query(models.Assessment).filter(models.Assessment.id == a.id).delete()
+        db_session.query(models.Student).filter(models.Student.id == st.id).delete()
+        db_session.commit()